@@ -16,29 +16,63 @@
 - Изображения (скачивает и сохраняет локально)
 - Спойлеры и цитаты (без имён)
 - Форматирование текста
+
+Использование из Python (без временных файлов):
+  html, info = clean_forum_bytes(data, "pages/Тема.html")   # страница целиком
+  clean_post_tree(post_content)                           # один div.post-content
+Тяжёлые модули (image_stitcher с PIL, torch, urllib.request) импортируются только когда нужны.
+Изображения качаются параллельно (image_downloads.py): не больше 4 запросов к одному хосту,
+общий срок на страницу, пока они качаются - чистится текст постов.
 """
 
 import re
 import sys
 import shutil
-import hashlib
 import os
-try:
-    import image_stitcher
-except ImportError:
-    image_stitcher = None
-import urllib.request
-import urllib.parse
 from pathlib import Path
 from html import unescape
-from typing import Optional, List, Tuple
+from typing import List, Tuple
 
 try:
-    from bs4 import BeautifulSoup, NavigableString
+    from bs4 import NavigableString
 except ImportError:
     print("Установите BeautifulSoup: pip install beautifulsoup4")
     sys.exit(1)
 
+# Модули, общие с scripts/clean_html.py
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / 'scripts'
+
+
+def load_shared(name: str):
+    """
+    Загрузить scripts/<name>.py по пути к файлу. sys.path не меняется: у этих модулей
+    общие имена (html_charset, file_watch), и в чужой программе они могли бы подменить
+    её модули или оказаться подменены ими. В sys.modules - под именем _clean_forum_<name>.
+    """
+    import importlib.util
+
+    qualname = f"_clean_forum_{name}"
+    module = sys.modules.get(qualname)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(qualname, SCRIPTS_DIR / f"{name}.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[qualname] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[qualname]
+            raise
+    return module
+
+
+# Выбор парсера и определение кодировки
+html_charset = load_shared('html_charset')
+html_parsers = load_shared('html_parsers')
+
+import image_downloads
+import image_store
+from image_downloads import ImageDownloader
+
 
 # Минимальный CSS для отображения
 MINIMAL_CSS = """
@@ -60,6 +94,34 @@ a { color: #FE99FE; }
 """
 
 
+def decode_page(data: bytes) -> Tuple[str, str]:
+    """
+    Декодировать страницу и определить кодировку (см. scripts/html_charset.py).
+    Переводы строк приводятся к \\n, как это делал read_text.
+    """
+    content, encoding = html_charset.decode_html(data)
+    return content.replace('\r\n', '\n').replace('\r', '\n'), encoding
+
+
+def read_page(path: Path) -> Tuple[str, str]:
+    """
+    Прочитать страницу один раз и определить кодировку.
+    """
+    return decode_page(Path(path).read_bytes())
+
+
+def load_image_stitcher():
+    """
+    Модуль image_stitcher (а с ним и PIL) нужен только для пакетной модернизации,
+    поэтому импортируется при первом обращении. None, если PIL не установлен.
+    """
+    try:
+        import image_stitcher
+    except ImportError:
+        return None
+    return image_stitcher
+
+
 def fix_image_url(url: str) -> str:
     """
     Исправить битый URL изображения.
@@ -85,54 +147,6 @@ def fix_image_url(url: str) -> str:
     return url
 
 
-def download_image(url: str, save_dir: Path) -> Optional[str]:
-    """
-    Скачать изображение по URL и сохранить в папку.
-    Возвращает локальный путь или None при ошибке.
-    """
-    try:
-        # Генерируем имя файла из URL
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
-        
-        # Определяем расширение
-        parsed = urllib.parse.urlparse(url)
-        path_ext = Path(parsed.path).suffix.lower()
-        if path_ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg']:
-            ext = path_ext
-        else:
-            ext = '.jpg'  # По умолчанию
-        
-        filename = f"img_{url_hash}{ext}"
-        save_path = save_dir / filename
-        
-        # Если уже скачано - не качаем повторно
-        if save_path.exists():
-            return filename
-        
-        # Создаём папку если нет
-        save_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Скачиваем
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        req = urllib.request.Request(url, headers=headers)
-        
-        with urllib.request.urlopen(req, timeout=10) as response:
-            content = response.read()
-            
-            # Проверяем что это изображение
-            content_type = response.headers.get('Content-Type', '')
-            if 'image' not in content_type and len(content) < 100:
-                return None
-            
-            save_path.write_bytes(content)
-            return filename
-            
-    except Exception as e:
-        print(f"  ⚠ Не удалось скачать {url[:50]}...: {e}")
-        return None
-
-
-
 class ImageModernizer:
     """
     Класс для модернизации изображений.
@@ -289,12 +303,12 @@ class ImageModernizer:
         return image_path
 
 
-def process_images(post_content, files_dir: Path, files_dir_name: str, modernizer: ImageModernizer = None) -> int:
+def collect_images(post_content, files_dir: Path, modernizer: ImageModernizer = None) -> List[Tuple[object, str]]:
     """
-    Обработать все изображения в посте.
-    Возвращает количество успешно скачанных.
+    Первый проход по изображениям поста, без сети: локальные модернизируются,
+    <img> без URL удаляются. Возвращает [(img, url)] того, что нужно скачать.
     """
-    downloaded = 0
+    pending = []
     
     for img in post_content.find_all('img'):
         # Получаем URL (из src или alt)
@@ -335,8 +349,27 @@ def process_images(post_content, files_dir: Path, files_dir_name: str, modernize
             img.decompose()  # Нет валидного URL - удаляем
             continue
         
-        # Пробуем скачать
-        local_filename = download_image(url, files_dir)
+        pending.append((img, url))
+    
+    return pending
+
+
+def patch_images(pending: List[Tuple[object, str]], results: dict, files_dir: Path, files_dir_name: str,
+                 modernizer: ImageModernizer = None) -> int:
+    """
+    Второй проход, после скачивания: results - {(url, files_dir): имя файла или None}
+    (см. ImageDownloader). Скачанным <img> ставится локальный src, остальные удаляются.
+    Возвращает количество успешно скачанных.
+    """
+    downloaded = 0
+    
+    for img, url in pending:
+        local_filename = results.get((url, files_dir))
+        
+        # Тег мог быть удалён очисткой, пока шло скачивание
+        if img.decomposed:
+            downloaded += bool(local_filename)
+            continue
         
         if local_filename:
             local_path = files_dir / local_filename
@@ -364,10 +397,27 @@ def process_images(post_content, files_dir: Path, files_dir_name: str, modernize
     return downloaded
 
 
+def process_images(post_content, files_dir: Path, files_dir_name: str, modernizer: ImageModernizer = None,
+                   downloader: ImageDownloader = None) -> int:
+    """
+    Обработать все изображения в посте: скачать параллельно (ImageDownloader) и обновить src.
+    Возвращает количество успешно скачанных.
+    """
+    pending = collect_images(post_content, files_dir, modernizer)
+    requests = [(url, files_dir) for _, url in pending]
+    if downloader is None:
+        with new_downloader() as downloader:
+            results = downloader.download_all(requests)
+    else:
+        results = downloader.download_all(requests)
+    return patch_images(pending, results, files_dir, files_dir_name, modernizer)
+
+
 def batch_modernize_directory(directory: Path, modernizer: ImageModernizer):
     """
     Пакетная обработка изображений через атлас.
     """
+    image_stitcher = load_image_stitcher()
     if not image_stitcher:
         return
 
@@ -417,114 +467,75 @@ def batch_modernize_directory(directory: Path, modernizer: ImageModernizer):
 
 
 
-def clean_forum_html(input_path: str, output_path: str = None) -> str:
+def clean_post_tree(post_content, files_dir: Path = None, files_dir_name: str = None,
+                    modernizer: ImageModernizer = None, downloader: ImageDownloader = None) -> int:
     """
-    Очистить HTML файл форума от мусора.
-    
-    Args:
-        input_path: Путь к исходному HTML файлу
-        output_path: Путь для сохранения (если None - перезаписать исходный)
-    
-    Returns:
-        Путь к очищенному файлу
+    Очистить содержимое одного поста (div.post-content) на месте.
+
+    Если задана files_dir, изображения скачиваются туда (см. process_images),
+    иначе теги <img> не трогаются и сеть не используется.
+    Возвращает количество скачанных изображений.
     """
-    input_file = Path(input_path)
-    if not input_file.exists():
-        raise FileNotFoundError(f"Файл не найден: {input_path}")
-    
-    # Папка для изображений
-    files_dir_name = input_file.stem + "_files"
-    files_dir = input_file.parent / files_dir_name
-    
-    # Читаем файл (пробуем разные кодировки)
-    content = None
-    for encoding in ['utf-8', 'windows-1251', 'cp1251', 'latin-1']:
-        try:
-            content = input_file.read_text(encoding=encoding)
-            break
-        except UnicodeDecodeError:
-            continue
-    
-    if content is None:
-        raise ValueError(f"Не удалось прочитать файл с известной кодировкой")
-    
-    # Парсим HTML
-    soup = BeautifulSoup(content, 'html.parser')
-    
-    # Извлекаем заголовок
-    title_tag = soup.find('title')
-    title = title_tag.get_text() if title_tag else "Без названия"
-    title = re.sub(r'\s*¤\w*¤\s*', '', title).strip()
-    
-    # Находим все посты
-    posts = soup.find_all('div', class_='post')
-    
-    if not posts:
-        topic_div = soup.find('div', id=lambda x: x and x.startswith('topic_'))
-        if topic_div:
-            posts = topic_div.find_all('div', class_='post')
-    
-    # Извлекаем контент постов
-    cleaned_posts = []
-    total_images = 0
-    
-    # Инициализация модернизатора
-    import os
-    modernizer_api_key = os.environ.get("STABILITY_API_KEY")
-    # Простейшая проверка аргумента командной строки для включения локального режим (для теста)
-    use_local = "--local" in sys.argv
-    modernizer = ImageModernizer(api_key=modernizer_api_key, use_local=use_local)
+    images = 0
+    # 1. ОБРАБАТЫВАЕМ ИЗОБРАЖЕНИЯ (скачиваем)
+    if files_dir is not None:
+        images = process_images(post_content, files_dir, files_dir_name or files_dir.name, modernizer, downloader)
 
-    # Определяем режим работы (поштучный или пакетный)
-    use_batch = use_local and (image_stitcher is not None)
-    
-    # Если пакетный режим - в цикле не обрабатываем (передаем None)
-    loop_modernizer = None if use_batch else modernizer
+    clean_post_text(post_content)
+    drop_empty_tags(post_content)
+    return images
 
-    for post in posts:
-        post_content = post.find('div', class_='post-content')
-        if post_content:
-            # 1. ОБРАБАТЫВАЕМ ИЗОБРАЖЕНИЯ (скачиваем)
-            total_images += process_images(post_content, files_dir, files_dir_name, loop_modernizer)
-            
-            # 2. УДАЛЯЕМ ИМЕНА АВТОРОВ ЦИТАТ
-            for cite in post_content.find_all('cite'):
-                cite.decompose()
-            
-            # 3. УДАЛЯЕМ "Отредактировано..."
-            for p in post_content.find_all('p', class_='lastedit'):
-                p.decompose()
-            
-            # 4. УДАЛЯЕМ "Пост X из Y" маркеры
-            for span in post_content.find_all('span'):
-                text = span.get_text()
-                if re.match(r'Пост\s+\d+\s+из\s+\d+', text):
-                    span.decompose()
-            
-            # 5. Обрабатываем ссылки
-            for a in post_content.find_all('a'):
-                href = a.get('href', '')
-                # Удаляем технические ссылки
-                if href.startswith('javascript:') or 'PostBgColor' in href or 'PhrasesBgcolor' in href:
-                    a.replace_with(a.get_text())
-                # Внешние ссылки на форум - помечаем классом
-                elif 'aum.mybb.ru' in href:
-                    a.attrs = {'class': 'broken-link', 'data-original-href': href}
-                else:
-                    a.attrs = {'href': href} if href and not href.startswith('javascript:') else {}
-            
-            # 6. Добавляем onclick для спойлеров
-            for spoiler in post_content.find_all('div', class_='spoiler-box'):
-                spoiler['onclick'] = "this.classList.toggle('visible')"
-            
-            # 7. Удаляем пустые теги
-            for tag in post_content.find_all(['p', 'span', 'div']):
-                if not tag.get_text(strip=True) and not tag.find_all():
-                    tag.decompose()
-            
-            cleaned_posts.append(str(post_content))
-    
-    # Собираем чистый HTML
+
+def clean_post_text(post_content):
+    """
+    Шаги 2-6 очистки поста: цитаты, пометки, ссылки, спойлеры. <img> не трогаются,
+    поэтому можно выполнять, пока изображения ещё скачиваются.
+    """
+    # 2. УДАЛЯЕМ ИМЕНА АВТОРОВ ЦИТАТ
+    for cite in post_content.find_all('cite'):
+        cite.decompose()
+
+    # 3. УДАЛЯЕМ "Отредактировано..."
+    for p in post_content.find_all('p', class_='lastedit'):
+        p.decompose()
+
+    # 4. УДАЛЯЕМ "Пост X из Y" маркеры
+    for span in post_content.find_all('span'):
+        text = span.get_text()
+        if re.match(r'Пост\s+\d+\s+из\s+\d+', text):
+            span.decompose()
+
+    # 5. Обрабатываем ссылки
+    for a in post_content.find_all('a'):
+        href = a.get('href', '')
+        # Удаляем технические ссылки
+        if href.startswith('javascript:') or 'PostBgColor' in href or 'PhrasesBgcolor' in href:
+            a.replace_with(a.get_text())
+        # Внешние ссылки на форум - помечаем классом
+        elif 'aum.mybb.ru' in href:
+            a.attrs = {'class': 'broken-link', 'data-original-href': href}
+        else:
+            a.attrs = {'href': href} if href and not href.startswith('javascript:') else {}
+
+    # 6. Добавляем onclick для спойлеров
+    for spoiler in post_content.find_all('div', class_='spoiler-box'):
+        spoiler['onclick'] = "this.classList.toggle('visible')"
+
+
+def drop_empty_tags(post_content):
+    """
+    Шаг 7, последний: после него не должно остаться тегов, опустевших от удалённых <img>.
+    """
+    # 7. Удаляем пустые теги
+    for tag in post_content.find_all(['p', 'span', 'div']):
+        if not tag.get_text(strip=True) and not tag.find_all():
+            tag.decompose()
+
+
+def render_clean_page(title: str, cleaned_posts: List[str]) -> str:
+    """
+    Собрать итоговую страницу из заголовка и HTML очищенных постов.
+    """
     clean_html = f"""<!DOCTYPE html>
 <html lang="ru">
 <head>
@@ -552,15 +563,152 @@ def clean_forum_html(input_path: str, output_path: str = None) -> str:
     clean_html += """</body>
 </html>
 """
+    return clean_html
+
+
+def clean_forum_bytes(data: bytes, base_path, parser: str = 'html.parser', download_images: bool = True,
+                      modernizer: ImageModernizer = None, downloader: ImageDownloader = None) -> Tuple[str, dict]:
+    """
+    Очистить страницу форума, переданную байтами; на диск пишутся только скачанные изображения.
+
+    Args:
+        data: Содержимое сохранённой страницы
+        base_path: Где лежит (или будет лежать) страница: рядом с ней папка <имя>_files для изображений
+        parser: Парсер из html_parsers.CHOICES
+        download_images: Скачивать ли изображения (False - без сети, <img> остаются как есть)
+        modernizer: Модернизатор изображений (None - без модернизации)
+        downloader: Общий ImageDownloader для нескольких страниц (None - свой на эту страницу)
+
+    Returns:
+        (html, info), где info - словарь с title, encoding, parser, posts, images,
+        expired (сколько изображений не успело скачаться к сроку)
+    """
+    base_path = Path(base_path)
+    # Папка для изображений
+    files_dir_name = base_path.stem + "_files"
+    files_dir = base_path.parent / files_dir_name
+
+    # Декодируем один раз и определяем кодировку (BOM, UTF-8, <meta charset>, windows-1251)
+    content, encoding = decode_page(data)
+
+    # Парсим HTML
+    soup = html_parsers.make_soup(content, parser)
+
+    # Извлекаем заголовок
+    title_tag = soup.find('title')
+    title = title_tag.get_text() if title_tag else "Без названия"
+    title = re.sub(r'\s*¤\w*¤\s*', '', title).strip()
+
+    # Находим все посты
+    posts = soup.find_all('div', class_='post')
+
+    if not posts:
+        topic_div = soup.find('div', id=lambda x: x and x.startswith('topic_'))
+        if topic_div:
+            posts = topic_div.find_all('div', class_='post')
+
+    # Извлекаем контент постов
+    contents = []
+    for post in posts:
+        post_content = post.find('div', class_='post-content')
+        if post_content:
+            contents.append(post_content)
+
+    # Изображения всех постов качаются разом, а текст тем временем чистится;
+    # src проставляются, когда скачивание закончится (или выйдет срок)
+    pending = []
+    if download_images:
+        for post_content in contents:
+            pending.extend(collect_images(post_content, files_dir, modernizer))
+    own_downloader = downloader is None and bool(pending)
+    if own_downloader:
+        downloader = new_downloader()
+    started = downloader.start([(url, files_dir) for _, url in pending]) if pending else None
+
+    for post_content in contents:
+        clean_post_text(post_content)
+
+    total_images = 0
+    expired = 0
+    if started is not None:
+        expired_before = downloader.expired
+        try:
+            results = downloader.collect(started)
+        finally:
+            if own_downloader:
+                downloader.close()
+        expired = downloader.expired - expired_before
+        total_images = patch_images(pending, results, files_dir, files_dir_name, modernizer)
+
+    cleaned_posts = []
+    for post_content in contents:
+        drop_empty_tags(post_content)
+        cleaned_posts.append(str(post_content))
+
+    info = {
+        'title': title,
+        'encoding': encoding,
+        'parser': html_parsers.backend_name(soup),
+        'posts': len(cleaned_posts),
+        'images': total_images,
+        'expired': expired,
+        'files_dir': files_dir,
+    }
+    return render_clean_page(title, cleaned_posts), info
+
+
+def clean_forum_html(input_path: str, output_path: str = None, parser: str = 'html.parser',
+                     downloader: ImageDownloader = None) -> str:
+    """
+    Очистить HTML файл форума от мусора.
+    
+    Args:
+        input_path: Путь к исходному HTML файлу
+        output_path: Путь для сохранения (если None - перезаписать исходный)
+        parser: Парсер из html_parsers.CHOICES (результат очистки с lxml тот же, но быстрее)
+        downloader: Общий ImageDownloader (None - свой для этого файла)
+    
+    Returns:
+        Путь к очищенному файлу
+    """
+    input_file = Path(input_path)
+    if not input_file.exists():
+        raise FileNotFoundError(f"Файл не найден: {input_path}")
+    
+    # Инициализация модернизатора
+    modernizer_api_key = os.environ.get("STABILITY_API_KEY")
+    # Простейшая проверка аргумента командной строки для включения локального режим (для теста)
+    use_local = "--local" in sys.argv
+    modernizer = ImageModernizer(api_key=modernizer_api_key, use_local=use_local)
+
+    # Определяем режим работы (поштучный или пакетный)
+    use_batch = use_local and (load_image_stitcher() is not None)
+    
+    # Если пакетный режим - в цикле не обрабатываем (передаем None)
+    loop_modernizer = None if use_batch else modernizer
+
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = new_downloader()
+    try:
+        clean_html, info = clean_forum_bytes(input_file.read_bytes(), input_file, parser, modernizer=loop_modernizer,
+                                             downloader=downloader)
+    finally:
+        if own_downloader:
+            downloader.close()
+    print(f"  🔧 Парсер: {info['parser']}, кодировка: {info['encoding']}")
     
     # Сохраняем
     output_file = Path(output_path) if output_path else input_file
     output_file.write_text(clean_html, encoding='utf-8')
     
-    output_file.write_text(clean_html, encoding='utf-8')
-    
-    if total_images:
-        print(f"  📷 Скачано {total_images} изображений в {files_dir_name}/")
+    files_dir = info['files_dir']
+    if info['images']:
+        print(f"  📷 Скачано {info['images']} изображений в {files_dir.name}/")
+    if info['expired']:
+        print(f"  ⏱ Не успели скачаться к сроку: {info['expired']}")
+    if own_downloader:
+        print_download_summary(downloader)
         
     # Если пакетный режим и есть что обрабатывать
     if use_batch and files_dir.exists():
@@ -569,9 +717,11 @@ def clean_forum_html(input_path: str, output_path: str = None) -> str:
     return str(output_file)
 
 
-def process_directory(directory: str, pattern: str = "*.html"):
+def process_directory(directory: str, pattern: str = "*.html", parser: str = 'html.parser',
+                      downloader: ImageDownloader = None):
     """
     Обработать все HTML файлы в директории.
+    downloader - общий ImageDownloader (None - свой на все файлы этой директории).
     """
     dir_path = Path(directory)
     if not dir_path.is_dir():
@@ -580,38 +730,77 @@ def process_directory(directory: str, pattern: str = "*.html"):
     html_files = [f for f in dir_path.glob(pattern) if not f.name.endswith('.bak')]
     print(f"Найдено {len(html_files)} файлов для обработки")
     
-    for html_file in html_files:
-        try:
-            # Создаём backup
-            backup = html_file.with_suffix('.html.bak')
-            if not backup.exists():
-                import shutil
-                shutil.copy(html_file, backup)
-            
-            # Очищаем
-            result = clean_forum_html(str(html_file))
-            
-            # Статистика
-            original_size = backup.stat().st_size
-            new_size = Path(result).stat().st_size
-            reduction = (1 - new_size / original_size) * 100
-            
-            print(f"✓ {html_file.name}: {original_size/1024:.1f}KB → {new_size/1024:.1f}KB ({reduction:.0f}% уменьшение)")
-        
-        except Exception as e:
-            print(f"✗ {html_file.name}: {e}")
+    if downloader is not None:
+        for html_file in html_files:
+            process_file(html_file, parser, downloader)
+        return
 
+    # Один пул загрузок (и соединений) на все файлы
+    with new_downloader() as downloader:
+        for html_file in html_files:
+            process_file(html_file, parser, downloader)
+    print_download_summary(downloader)
 
-def merge_forum_pages(directory: str):
+
+def new_downloader(cache: bool = True, cache_dir=None, max_size: int = image_downloads.MAX_SIZE) -> ImageDownloader:
     """
-    Находит в директории группы файлов (например Name.html, Name2.html...)
-    и объединяет их в один файл с разделителем.
+    ImageDownloader с постоянным индексом загрузок (download_index.py) в cache_dir
+    (None - ~/.cache/clean_forum_html); cache=False - без индекса, всё качается заново.
+    max_size - предел размера одного изображения, байт.
     """
-    dir_path = Path(directory)
-    if not dir_path.is_dir():
-        raise NotADirectoryError(f"Не директория: {directory}")
+    index = None
+    if cache:
+        import download_index
+        index = download_index.DownloadIndex(cache_dir)
+    return ImageDownloader(index=index, max_size=max_size)
 
-    # 1. Группируем файлы
+
+def print_download_summary(downloader: ImageDownloader):
+    """
+    Итог по сети: сколько запросов ушло по уже открытым соединениям (см. http_pool.py),
+    сколько изображений обошлось без скачивания (download_index.py) и сколько
+    поставлено ссылками на хранилище (image_store.py).
+    """
+    if downloader.client.requests:
+        print(f"🔌 HTTP: {downloader.client.summary()}")
+    index = downloader.index
+    if index is not None and (index.hits or index.revalidated or index.stored or index.skipped):
+        print(f"🗄 Кэш изображений: {index.summary()}")
+    if index is not None and (index.store.linked or index.store.copied):
+        print(f"🔗 Хранилище: {index.store.summary()}")
+
+
+def process_file(html_file: Path, parser: str = 'html.parser', downloader: ImageDownloader = None):
+    """
+    Очистить один файл на месте, сохранив оригинал в .html.bak.
+    Возвращает путь записанного файла (None - не получилось).
+    """
+    try:
+        # Создаём backup
+        backup = html_file.with_suffix('.html.bak')
+        if not backup.exists():
+            shutil.copy(html_file, backup)
+        
+        # Очищаем
+        result = clean_forum_html(str(html_file), parser=parser, downloader=downloader)
+        
+        # Статистика
+        original_size = backup.stat().st_size
+        new_size = Path(result).stat().st_size
+        reduction = (1 - new_size / original_size) * 100
+        
+        print(f"✓ {html_file.name}: {original_size/1024:.1f}KB → {new_size/1024:.1f}KB ({reduction:.0f}% уменьшение)")
+        return Path(result)
+    
+    except Exception as e:
+        print(f"✗ {html_file.name}: {e}")
+        return None
+
+
+def find_page_groups(dir_path: Path) -> dict:
+    """
+    Сгруппировать страницы темы: Name.html, Name2.html... → {Name: [(номер, путь), ...]}.
+    """
     # Ключ: базовое имя, Значение: список (номер, путь)
     groups = {}
     
@@ -638,10 +827,28 @@ def merge_forum_pages(directory: str):
                 groups[base_name] = []
             groups[base_name].append((num, f))
 
+    return groups
+
+
+def merge_forum_pages(directory: str, parser: str = 'html.parser', only=None, store=None):
+    """
+    Находит в директории группы файлов (например Name.html, Name2.html...)
+    и объединяет их в один файл с разделителем.
+    only - если задано, объединяются только группы с этими базовыми именами.
+    store - image_store.ImageStore: изображения в <имя>_merged_files ставятся ссылками
+    на его объекты; None - жёсткими ссылками прямо на файлы страниц (копиями, если нельзя).
+    """
+    dir_path = Path(directory)
+    if not dir_path.is_dir():
+        raise NotADirectoryError(f"Не директория: {directory}")
+
+    # 1. Группируем файлы
+    groups = find_page_groups(dir_path)
+
     # 2. Обрабатываем группы
     count_merged = 0
     for base_name, file_list in groups.items():
-        if len(file_list) < 2:
+        if len(file_list) < 2 or (only is not None and base_name not in only):
             continue
             
         # Сортируем по номеру
@@ -654,19 +861,14 @@ def merge_forum_pages(directory: str):
             first_num, first_path = file_list[0]
             
             # Определяем кодировку и читаем
-            content = None
-            for encoding in ['utf-8', 'windows-1251', 'cp1251']:
-                try:
-                    content = first_path.read_text(encoding=encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
+            content, encoding = read_page(first_path)
             
             if not content:
                 print(f"  ⚠ Не удалось прочитать {first_path.name}")
                 continue
 
-            soup = BeautifulSoup(content, 'html.parser')
+            soup = html_parsers.make_soup(content, parser)
+            print(f"  🔧 Парсер: {html_parsers.backend_name(soup)}, кодировка: {encoding}")
             body = soup.find('body')
             if not body:
                 print(f"  ⚠ Нет body в {first_path.name}")
@@ -681,18 +883,12 @@ def merge_forum_pages(directory: str):
             # Читаем остальные файлы и добавляем
             for num, path in file_list[1:]:
                 # Читаем файл-продолжение
-                sub_content = None
-                for encoding in ['utf-8', 'windows-1251', 'cp1251']:
-                    try:
-                        sub_content = path.read_text(encoding=encoding)
-                        break
-                    except UnicodeDecodeError:
-                        continue
+                sub_content, _ = read_page(path)
                         
                 if not sub_content:
                     continue
                     
-                sub_soup = BeautifulSoup(sub_content, 'html.parser')
+                sub_soup = html_parsers.make_soup(sub_content, parser)
                 sub_posts = sub_soup.find_all('div', class_='post')
                 
                 if not sub_posts:
@@ -748,7 +944,11 @@ def merge_forum_pages(directory: str):
                     
                     if not destination.exists():
                         try:
-                            shutil.copy2(original_path, destination)
+                            # Жёсткая ссылка вместо копии: место на диске и время не растут
+                            if store is not None:
+                                store.link_file(original_path, destination)
+                            else:
+                                image_store.place_file(original_path, destination)
                         except Exception as e:
                             print(f"    ⚠ Ошибка копирования {new_filename}: {e}")
                             continue
@@ -761,7 +961,7 @@ def merge_forum_pages(directory: str):
             output_path.write_text(str(soup), encoding='utf-8')
             print(f"  ✓ Создан: {output_name} ({output_path.stat().st_size/1024:.1f} KB)")
             if count_images:
-                print(f"    📷 Скопировано {count_images} изображений в {merged_files_dir_name}/")
+                print(f"    📷 Изображений в {merged_files_dir_name}/: {count_images}")
             count_merged += 1
             
         except Exception as e:
@@ -775,6 +975,52 @@ def merge_forum_pages(directory: str):
         print(f"Всего объединено групп: {count_merged}")
 
 
+def watch_forum(target: str, output: str = None, parser: str = 'html.parser', merge: bool = False,
+                interval: float = 1.0, downloader: ImageDownloader = None):
+    """
+    Режим --watch: процесс (и импортированные парсеры) остаётся в памяти, файлы опрашиваются
+    через stat (scripts/file_watch.py), пересобирается только то, что зависит от изменённых файлов.
+    rebuild() возвращает записанные файлы: очищенная на месте страница - сама себе вход.
+    downloader - общий ImageDownloader для всех пересборок (None - свой на каждую).
+    """
+    file_watch = load_shared('file_watch')
+
+    path = Path(target)
+    store = downloader.index.store if downloader is not None and downloader.index is not None else None
+    if merge:
+        def list_targets():
+            return {base: [f for _, f in files] for base, files in find_page_groups(path).items() if len(files) >= 2}
+
+        def rebuild(changed):
+            merge_forum_pages(target, parser, only=set(changed), store=store)
+    elif path.is_dir():
+        def list_targets():
+            return {f: [f] for f in path.glob("*.html") if not f.name.endswith('.bak')}
+
+        def rebuild(changed):
+            return [process_file(html_file, parser, downloader) for html_file in changed if html_file.exists()]
+    else:
+        def list_targets():
+            return {target: [path]}
+
+        def rebuild(changed):
+            try:
+                saved = clean_forum_html(target, output, parser, downloader)
+            except Exception as e:
+                print(f"✗ {path.name}: {e}")
+                return None
+            print(f"✓ Сохранено: {saved}")
+            return [saved]
+
+    def report(changed, seconds):
+        print(f"⟳ Пересобрано: {len(changed)} за {seconds:.2f} с")
+
+    print(f"👀 Слежу за изменениями каждые {interval:g} с (Ctrl-C - выход)")
+    try:
+        file_watch.watch(list_targets, rebuild, interval, report)
+    except KeyboardInterrupt:
+        print("Остановлено")
+
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -785,12 +1031,21 @@ if __name__ == "__main__":
   python clean_forum_html.py <файл.html> <выход> [опции]  # Сохранить в другой файл
         
 Опции:
-  --merge   Объединить группы файлов (Name.html + Name2.html)
-  --local   Использовать локальную генерацию изображений (Stable Diffusion)
+  --merge          Объединить группы файлов (Name.html + Name2.html)
+  --local          Использовать локальную генерацию изображений (Stable Diffusion)
+  --parser=ИМЯ     Парсер: auto, lxml, lxml-native, html5lib, html.parser (по умолчанию html.parser);
+                   lxml-native здесь - то же, что auto при установленном lxml (отдельный путь
+                   на дереве lxml есть только в scripts/clean_html.py)
+  --watch          После обработки следить за файлами и пересобирать изменённые
+  --cache-dir=ПУТЬ Кэш скачанных изображений между запусками (по умолчанию ~/.cache/clean_forum_html)
+  --no-cache       Не использовать кэш: все изображения качаются заново
+  --max-image-mb=N Не качать изображения больше N МБ (по умолчанию 20)
         
 Примеры:
   python clean_forum_html.py pages/ --local
   python clean_forum_html.py --merge pages/
+  python clean_forum_html.py pages/ --parser=lxml
+  python clean_forum_html.py --merge pages/ --watch
 """)
         sys.exit(1)
     
@@ -805,14 +1060,47 @@ if __name__ == "__main__":
          
     target = positional[0]
     
-    if '--merge' in flags:
-        merge_forum_pages(target)
-    elif Path(target).is_dir():
-        process_directory(target)
-    elif Path(target).is_file():
-        output = positional[1] if len(positional) > 1 else None
-        result = clean_forum_html(target, output)
-        print(f"✓ Сохранено: {result}")
-    else:
-        print(f"✗ Не найдено: {target}")
+    parser = 'html.parser'
+    for flag in flags:
+        if flag.startswith('--parser='):
+            parser = flag.split('=', 1)[1]
+    try:
+        html_parsers.resolve_parser(parser)
+    except ValueError as e:
+        print(f"✗ {e}")
         sys.exit(1)
+    
+    cache_dir = None
+    max_size = image_downloads.MAX_SIZE
+    for flag in flags:
+        if flag.startswith('--cache-dir='):
+            cache_dir = flag.split('=', 1)[1]
+        elif flag.startswith('--max-image-mb='):
+            try:
+                max_size = int(float(flag.split('=', 1)[1]) * 1024 * 1024)
+            except ValueError:
+                max_size = 0
+            if max_size <= 0:
+                print(f"✗ Неверный размер: {flag}")
+                sys.exit(1)
+    
+    output = positional[1] if len(positional) > 1 else None
+    # Один загрузчик (соединения, индекс загрузок) на весь запуск, включая --watch
+    downloader = new_downloader(cache='--no-cache' not in flags, cache_dir=cache_dir, max_size=max_size)
+    try:
+        if '--merge' in flags:
+            merge_forum_pages(target, parser, store=downloader.index.store if downloader.index else None)
+        elif Path(target).is_dir():
+            process_directory(target, parser=parser, downloader=downloader)
+        elif Path(target).is_file():
+            result = clean_forum_html(target, output, parser, downloader)
+            print(f"✓ Сохранено: {result}")
+        else:
+            print(f"✗ Не найдено: {target}")
+            sys.exit(1)
+
+        if '--watch' in flags:
+            watch_forum(target, output, parser, merge='--merge' in flags, downloader=downloader)
+    finally:
+        downloader.close()
+    print_download_summary(downloader)
@@ -0,0 +1,147 @@
+"""
+Постоянный индекс загрузок изображений для image_downloads.py.
+
+В папке кэша (по умолчанию ~/.cache/clean_forum_html, или $XDG_CACHE_HOME) лежат:
+- downloads.sqlite: URL → SHA-256 и размер содержимого, ETag/Last-Modified, когда
+  скачан, когда и почему не скачался в последний раз;
+- objects/: само содержимое, общее для всех страниц и папок (image_store.py:
+  по SHA-256, в папки страниц ставится жёсткими ссылками).
+
+Поэтому при повторных запусках:
+- URL, скачанный не раньше fresh_ttl назад, берётся из objects/ без сети, в какую бы
+  папку <имя>_files он ни понадобился;
+- более старый перепроверяется условным GET (If-None-Match / If-Modified-Since),
+  ответ 304 - снова из objects/;
+- URL, который не скачался не раньше failure_ttl назад, не запрашивается вовсе
+  (если старая копия есть - используется она).
+
+Индексом можно пользоваться из нескольких потоков и процессов одновременно.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from image_store import ImageStore
+
+# Сколько секунд скачанный URL не перепроверяется
+FRESH_TTL = 7 * 24 * 3600
+# Сколько секунд не пробовать снова URL, который не скачался
+FAILURE_TTL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL,
+    failed_at REAL,
+    error TEXT
+)
+"""
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base) / 'clean_forum_html'
+
+
+class DownloadIndex:
+    """
+    См. описание модуля. Статистика: hits - взято из objects/ без сети,
+    revalidated - подтверждено ответом 304, skipped - не запрошено из-за недавней ошибки,
+    stored - скачано и сохранено в objects/.
+    """
+
+    def __init__(self, cache_dir=None, fresh_ttl: float = FRESH_TTL, failure_ttl: float = FAILURE_TTL):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.store = ImageStore(self.cache_dir / 'objects')
+        self.fresh_ttl = fresh_ttl
+        self.failure_ttl = failure_ttl
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Одно соединение на все потоки (под self._lock), autocommit; WAL - для других процессов
+        self._db = sqlite3.connect(str(self.cache_dir / 'downloads.sqlite'), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(SCHEMA)
+        self.hits = 0
+        self.revalidated = 0
+        self.skipped = 0
+        self.stored = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def summary(self) -> str:
+        return (f"из кэша {self.hits}, не изменились (304) {self.revalidated}, "
+                f"скачано {self.stored}, пропущено после недавних ошибок {self.skipped}")
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def lookup(self, url: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute('SELECT * FROM downloads WHERE url = ?', (url,)).fetchone()
+
+    def cached_object(self, row) -> Optional[Path]:
+        """Файл содержимого из objects/, если он на месте и нужного размера."""
+        if row is None or not row['sha256']:
+            return None
+        path = self.store.path(row['sha256'])
+        try:
+            return path if path.stat().st_size == row['size'] else None
+        except OSError:
+            return None
+
+    def place(self, path: Path, dest: Path):
+        """Поставить файл из objects/ в папку страницы (жёсткой ссылкой, если можно)."""
+        self.store.place(path, dest)
+
+    def is_fresh(self, row) -> bool:
+        return row['fetched_at'] is not None and time.time() - row['fetched_at'] < self.fresh_ttl
+
+    def recently_failed(self, row) -> bool:
+        return row['failed_at'] is not None and time.time() - row['failed_at'] < self.failure_ttl
+
+    def conditional_headers(self, row) -> dict:
+        headers = {}
+        if row['etag']:
+            headers['If-None-Match'] = row['etag']
+        if row['last_modified']:
+            headers['If-Modified-Since'] = row['last_modified']
+        return headers
+
+    def record_success(self, url: str, sha256: str, size: int, etag: str = None, last_modified: str = None):
+        """Запомнить, что URL скачан и его содержимое лежит в хранилище под sha256."""
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO downloads (url, sha256, size, etag, last_modified, fetched_at, failed_at, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, NULL, NULL) '
+                'ON CONFLICT(url) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, '
+                'etag = excluded.etag, last_modified = excluded.last_modified, '
+                'fetched_at = excluded.fetched_at, failed_at = NULL, error = NULL',
+                (url, sha256, size, etag, last_modified, time.time()))
+            self.stored += 1
+
+    def record_not_modified(self, url: str):
+        """Ответ 304: содержимое то же, следующая перепроверка - через fresh_ttl."""
+        with self._lock:
+            self._db.execute('UPDATE downloads SET fetched_at = ?, failed_at = NULL, error = NULL WHERE url = ?',
+                             (time.time(), url))
+            self.revalidated += 1
+
+    def record_failure(self, url: str, error: str):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO downloads (url, failed_at, error) VALUES (?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET failed_at = excluded.failed_at, error = excluded.error',
+                (url, time.time(), error[:200]))
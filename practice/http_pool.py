@@ -0,0 +1,205 @@
+"""
+HTTP-клиент с постоянными соединениями для image_downloads.py.
+
+Изображения форума приходят в основном с нескольких хостов (Google Drive, CDN mybb),
+поэтому соединения (TCP и TLS) не закрываются после ответа, а возвращаются в пул своего
+хоста и используются следующими запросами (HTTP/1.1 keep-alive, по одному запросу на
+соединение за раз). Только стандартная библиотека (http.client), потокобезопасно.
+
+- Перенаправления обходятся по тем же пулам; постоянные (301, 308) запоминаются,
+  и следующий запрос того же URL сразу идёт по новому адресу.
+- Сбои соединения, 429 и 5xx повторяются retries раз с паузой backoff * 2^n
+  (или Retry-After), пока не выйдет срок deadline.
+- Соединение из пула, которое сервер успел закрыть, тихо заменяется новым.
+
+Пример:
+  client = HTTPClient()
+  with client.open("https://example.com/a.png", timeout=10) as response:
+      data = response.read()
+  client.reuse_rate()   # доля запросов, ушедших по уже открытому соединению
+"""
+
+import http.client
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = 'Mozilla/5.0'
+RETRIES = 2
+BACKOFF = 0.5
+# Больше не ждём Retry-After, секунд
+MAX_RETRY_AFTER = 10
+MAX_REDIRECTS = 5
+# Незанятых соединений на хост
+MAX_IDLE = 4
+
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+RETRY_CODES = {429, 500, 502, 503, 504}
+# Ошибки, после которых запрос можно повторить
+RETRY_ERRORS = (ConnectionError, http.client.HTTPException)
+
+
+class HTTPError(Exception):
+    """Ответ не 200 (после перенаправлений и повторов)."""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"HTTP Error {status}: {reason}")
+        self.status = status
+
+
+class HTTPClient:
+    """
+    Пул соединений по (схема, хост, порт); см. описание модуля.
+    Статистика: requests - запросов отправлено, reused - из них по открытому соединению,
+    connections - соединений открыто, retried - повторов.
+    """
+
+    def __init__(self, retries: int = RETRIES, backoff: float = BACKOFF, max_idle: int = MAX_IDLE,
+                 user_agent: str = USER_AGENT):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_idle = max_idle
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+        self._redirects = {}
+        self.requests = 0
+        self.reused = 0
+        self.connections = 0
+        self.retried = 0
+
+    def reuse_rate(self) -> float:
+        return self.reused / self.requests if self.requests else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.requests} запросов, {self.connections} соединений, "
+                f"повторное использование {self.reuse_rate():.0%}, повторов {self.retried}")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _connect(self, key, timeout: float):
+        """Взять соединение из пула или открыть новое; (соединение, из_пула)."""
+        with self._lock:
+            conns = self._idle[key]
+            if conns:
+                conn = conns.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.connections += 1
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout), False
+
+    def _release(self, key, conn, response):
+        """Вернуть соединение в пул, если ответ дочитан и сервер его не закрывает."""
+        if response.isclosed() and not response.will_close and conn.sock is not None:
+            with self._lock:
+                if len(self._idle[key]) < self.max_idle:
+                    self._idle[key].append(conn)
+                    return
+        conn.close()
+
+    def _send(self, url: str, headers: dict, timeout: float):
+        """Один запрос без повторов и перенаправлений: (соединение, ответ, ключ пула)."""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Неподдерживаемая схема: {url}")
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        all_headers = {'User-Agent': self.user_agent, 'Accept': 'image/*,*/*;q=0.8'}
+        all_headers.update(headers)
+        while True:
+            conn, pooled = self._connect(key, timeout)
+            try:
+                conn.request('GET', path, headers=all_headers)
+                response = conn.getresponse()
+            except RETRY_ERRORS:
+                conn.close()
+                if pooled:
+                    # Сервер закрыл простаивавшее соединение - не считается повтором
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            with self._lock:
+                self.requests += 1
+                self.reused += pooled
+            return conn, response, key
+
+    @contextmanager
+    def open(self, url: str, headers: dict = None, timeout: float = 10, deadline: float = None):
+        """
+        GET с перенаправлениями и повторами; отдаёт ответ 200 (http.client.HTTPResponse)
+        или 304 на условный запрос (If-None-Match / If-Modified-Since в headers), или 206
+        на запрос с Range, иначе HTTPError (с кодом в status, например 416).
+        deadline - момент по time.monotonic(), после которого не повторяем.
+        Соединение возвращается в пул при выходе, если тело ответа прочитано до конца.
+        """
+        headers = dict(headers or {})
+        conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+        ranged = 'Range' in headers
+        url = self._redirects.get(url, url)
+        redirects = 0
+        attempt = 0
+        while True:
+            try:
+                conn, response, key = self._send(url, headers, timeout)
+            except RETRY_ERRORS:
+                if not self._wait_retry(attempt, None, deadline):
+                    raise
+                attempt += 1
+                continue
+            status = response.status
+            if status == 200 or status == 304 and conditional or status == 206 and ranged:
+                break
+            location = response.getheader('Location')
+            retry_after = response.getheader('Retry-After')
+            # Тело ошибки или перенаправления дочитываем, чтобы соединение вернулось в пул
+            try:
+                response.read()
+            except (OSError, http.client.HTTPException):
+                pass
+            self._release(key, conn, response)
+            if status in REDIRECT_CODES and location and redirects < MAX_REDIRECTS:
+                target = urljoin(url, location)
+                if status in (301, 308):
+                    self._redirects[url] = target
+                url = target
+                redirects += 1
+                continue
+            if status in RETRY_CODES and self._wait_retry(attempt, retry_after, deadline):
+                attempt += 1
+                continue
+            raise HTTPError(status, response.reason)
+        try:
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+        self._release(key, conn, response)
+
+    def _wait_retry(self, attempt: int, retry_after, deadline) -> bool:
+        """Подождать перед повтором; False, если повторы кончились или не успеваем к сроку."""
+        if attempt >= self.retries:
+            return False
+        pause = self.backoff * 2 ** attempt
+        if retry_after and retry_after.strip().isdigit():
+            pause = max(pause, min(int(retry_after), MAX_RETRY_AFTER))
+        if deadline is not None and time.monotonic() + pause >= deadline:
+            return False
+        time.sleep(pause)
+        with self._lock:
+            self.retried += 1
+        return True
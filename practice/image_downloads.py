@@ -0,0 +1,507 @@
+"""
+Скачивание изображений для clean_forum_html.py.
+
+download_image() - одно изображение, ImageDownloader - много сразу в пуле потоков:
+- к одному хосту не больше per_host запросов одновременно, остальные ждут в очереди
+  этого хоста и не занимают потоки, нужные другим хостам;
+- общий срок deadline секунд на вызов download_all(): что не успело - считается
+  нескачанным (таймаут запроса урезается до оставшегося времени);
+- один и тот же URL в одну папку качается один раз, даже если он запрошен
+  повторно, пока первый запрос ещё идёт.
+
+Пример:
+  with ImageDownloader() as downloader:
+      names = downloader.download_all([(url, Path("Тема_files")), ...])   # {(url, папка): имя или None}
+"""
+
+import hashlib
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+# Таймаут одного запроса, секунд
+TIMEOUT = 10
+# Потоков всего и одновременных запросов к одному хосту
+MAX_WORKERS = 16
+PER_HOST = 4
+# Срок на все изображения одной страницы, секунд
+DEADLINE = 120
+
+# Больше не качаем, байт
+MAX_SIZE = 20 * 1024 * 1024
+# Столько первых байтов читается до решения, изображение ли это
+SNIFF_BYTES = 1024
+CHUNK = 64 * 1024
+# Сколько раз в одном вызове продолжать оборвавшееся скачивание
+RESUMES = 2
+
+# Расширения, под которыми изображения сохранялись и сохраняются; первым проверяется
+# расширение из URL (так их называли до определения типа по содержимому)
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.bmp', '.ico', '.avif']
+
+
+class DownloadError(Exception):
+    """Ответ получен, но сохранять его нельзя: не изображение или слишком большой."""
+
+
+def sniff_image(head: bytes) -> Optional[str]:
+    """
+    Расширение по первым байтам файла (сигнатуры форматов), None - не изображение.
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return '.gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return '.avif'
+    if head[:2] == b'BM' and len(head) >= 14:
+        return '.bmp'
+    if head[:4] == b'\x00\x00\x01\x00':
+        return '.ico'
+    # SVG - текст: <?xml ...> или комментарий перед <svg, и это не HTML-страница
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith((b'<svg', b'<?xml', b'<!--')) and b'<svg' in text and b'<html' not in text:
+        return '.svg'
+    return None
+
+
+def sniff_file(path: Path) -> Optional[str]:
+    with open(path, 'rb') as f:
+        return sniff_image(f.read(SNIFF_BYTES))
+
+
+def image_stem(url: str) -> str:
+    """Имя локального файла для URL без расширения: img_<md5[:8]>."""
+    return f"img_{hashlib.md5(url.encode()).hexdigest()[:8]}"
+
+
+def image_filename(url: str) -> str:
+    """
+    Имя файла, под которым URL сохранялся до определения типа по содержимому:
+    img_<md5[:8]> и расширение из пути (.jpg по умолчанию).
+    """
+    path_ext = Path(urlparse(url).path).suffix.lower()
+    ext = path_ext if path_ext in IMAGE_EXTENSIONS else '.jpg'
+    return image_stem(url) + ext
+
+
+def find_downloaded(url: str, save_dir: Path) -> Optional[str]:
+    """
+    Уже скачанный файл URL в папке (с любым из IMAGE_EXTENSIONS), если это действительно
+    изображение: HTML-страницы ошибок, сохранённые раньше как .jpg, не считаются.
+    """
+    stem = image_stem(url)
+    legacy = image_filename(url)
+    for name in [legacy] + [stem + ext for ext in IMAGE_EXTENSIONS if stem + ext != legacy]:
+        path = save_dir / name
+        try:
+            if sniff_file(path):
+                return name
+        except OSError:
+            continue
+    return None
+
+
+class DownloadCancelled(Exception):
+    """Загрузчик закрыт (например, по Ctrl-C) посреди скачивания."""
+
+
+class PartialDownload:
+    """
+    Недокачанный файл <md5(url и папки)>.part и рядом .part.json с URL и валидатором ответа
+    (ETag или Last-Modified). Если скачивание прервалось (таймаут, обрыв, Ctrl-C), а сервер
+    объявил Accept-Ranges: bytes и дал валидатор, .part остаётся, и следующая попытка
+    (в этом же запуске или в следующем) просит только недостающее: Range: bytes=<размер>-
+    с If-Range, так что изменившийся на сервере файл придёт целиком заново.
+    Имя зависит и от папки назначения: один URL для двух страниц может качаться одновременно.
+    """
+
+    def __init__(self, tmp_dir: Path, url: str, save_dir: Path):
+        name = hashlib.md5(f"{url}\n{save_dir}".encode()).hexdigest()
+        self.url = url
+        self.path = tmp_dir / f"{name}.part"
+        self.meta_path = tmp_dir / f"{name}.part.json"
+        self.keep = False
+
+    def resume_headers(self) -> dict:
+        """Range и If-Range для продолжения; {} - начинать сначала."""
+        import json
+
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding='utf-8'))
+            size = self.path.stat().st_size
+        except (OSError, ValueError):
+            return {}
+        if meta.get('url') != self.url or not meta.get('validator') or not size:
+            return {}
+        self.keep = True
+        return {'Range': f"bytes={size}-", 'If-Range': meta['validator']}
+
+    def start(self, response):
+        """Запомнить, можно ли будет продолжить ответ, до того как пойдёт тело."""
+        import json
+
+        # If-Range со слабым ETag не работает - тогда Last-Modified
+        etag = response.getheader('ETag')
+        validator = etag if etag and not etag.startswith('W/') else response.getheader('Last-Modified')
+        ranges = response.getheader('Accept-Ranges', '').lower() == 'bytes' or response.status == 206
+        self.keep = bool(validator and ranges)
+        if self.keep:
+            self.meta_path.write_text(json.dumps({'url': self.url, 'validator': validator}), encoding='utf-8')
+        else:
+            self.meta_path.unlink(missing_ok=True)
+
+    def finish(self):
+        self.keep = False
+        self.meta_path.unlink(missing_ok=True)
+
+    def discard(self):
+        self.keep = False
+        self.path.unlink(missing_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+
+
+def save_response(response, part: PartialDownload, max_size: int = MAX_SIZE, stop=None):
+    """
+    Записать тело ответа в part.path по частям, не держа его в памяти.
+    Ответ 206 дописывается к уже скачанному, 200 пишется с начала.
+    Тип определяется по первым SNIFF_BYTES: не изображение - DownloadError сразу, без
+    скачивания остального; больше max_size (по Content-Length или по факту) - тоже.
+    stop - threading.Event: если установлен, скачивание прерывается (DownloadCancelled).
+    Возвращает (расширение, sha256, размер); переименовать part.path на место - дело
+    вызывающего. При обрыве .part остаётся, если его можно будет продолжить.
+    """
+    offset = 0
+    if response.status == 206:
+        content_range = response.getheader('Content-Range', '')
+        start = content_range.split(' ', 1)[-1].split('-', 1)[0]
+        offset = part.path.stat().st_size
+        if not start.isdigit() or int(start) != offset:
+            part.discard()
+            raise DownloadError(f"неожиданный Content-Range: {content_range!r}")
+
+    length = response.getheader('Content-Length')
+    if length and length.isdigit() and offset + int(length) > max_size:
+        part.discard()
+        raise DownloadError(f"больше {max_size // (1024 * 1024)} МБ ({offset + int(length)} байт)")
+
+    digest = hashlib.sha256()
+    if offset:
+        # Продолжение: тип уже проверен, хэш считается с начала файла
+        with open(part.path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+            digest.update(head)
+            for chunk in iter(lambda: f.read(CHUNK), b''):
+                digest.update(chunk)
+    else:
+        head = response.read(SNIFF_BYTES)
+        if sniff_image(head) is None:
+            part.discard()
+            content_type = response.getheader('Content-Type', '')
+            raise DownloadError(f"не изображение ({content_type or head[:20]!r})")
+        digest.update(head)
+    ext = sniff_image(head)
+
+    part.path.parent.mkdir(parents=True, exist_ok=True)
+    part.start(response)
+    size = offset
+    try:
+        with open(part.path, 'ab' if offset else 'wb') as f:
+            if not offset:
+                f.write(head)
+                size = len(head)
+            while True:
+                if stop is not None and stop.is_set():
+                    raise DownloadCancelled("скачивание прервано")
+                chunk = response.read(CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise DownloadError(f"больше {max_size // (1024 * 1024)} МБ")
+                digest.update(chunk)
+                f.write(chunk)
+            if length and length.isdigit() and size < offset + int(length):
+                # read(amt) не сообщает о закрытом раньше времени соединении
+                import http.client
+                raise http.client.IncompleteRead(b'', offset + int(length) - size)
+    except BaseException as e:
+        # Обрыв, таймаут, Ctrl-C - скачанное пригодится; слишком большой файл - нет
+        if isinstance(e, DownloadError) or not part.keep:
+            part.discard()
+        raise
+    part.finish()
+    return ext, digest.hexdigest(), size
+
+
+def download_image(url: str, save_dir: Path, timeout: float = TIMEOUT, client=None,
+                   deadline: float = None, index=None, max_size: int = MAX_SIZE, stop=None) -> Optional[str]:
+    """
+    Скачать изображение по URL и сохранить в папку как img_<md5[:8]> с расширением
+    по содержимому (см. save_response); файл появляется в папке только целиком.
+    client - общий http_pool.HTTPClient (None - отдельный на этот запрос),
+    deadline - момент по time.monotonic(), после которого запрос не повторяется,
+    index - download_index.DownloadIndex: кэш между запусками и папками (None - без него),
+    max_size - предел размера, байт,
+    stop - threading.Event, прерывающий скачивание (недокачанное остаётся в .part,
+    см. PartialDownload).
+    Возвращает имя файла в папке или None при ошибке.
+    """
+    stem = image_stem(url)
+    cached = None
+    part = None
+    try:
+        # Если уже скачано - не качаем повторно
+        existing = find_downloaded(url, save_dir)
+        if existing:
+            return existing
+
+        # Создаём папку если нет
+        save_dir.mkdir(parents=True, exist_ok=True)
+
+        headers = {}
+        row = index.lookup(url) if index is not None else None
+        if row is not None:
+            cached = index.cached_object(row)
+            if cached is not None and (index.is_fresh(row) or index.recently_failed(row)):
+                # Свежая копия (или сервер недавно не отвечал) - без сети
+                filename = stem + (sniff_file(cached) or '.jpg')
+                index.place(cached, save_dir / filename)
+                index.count('hits')
+                return filename
+            if index.recently_failed(row):
+                index.count('skipped')
+                return None
+            if cached is not None:
+                headers = index.conditional_headers(row)
+
+        # Скачиваем
+        if client is None:
+            import http_pool
+            client = http_pool.HTTPClient()
+        import http.client
+        # .part - рядом с местом назначения, чтобы переименование было атомарным
+        part = PartialDownload(index.store.root / 'partial' if index is not None else save_dir, url, save_dir)
+        resumes = 0
+        while True:
+            resume = part.resume_headers()
+            try:
+                with client.open(url, headers=resume or headers, timeout=timeout, deadline=deadline) as response:
+                    if response.status == 304:
+                        response.read()
+                        index.record_not_modified(url)
+                        filename = stem + (sniff_file(cached) or '.jpg')
+                        index.place(cached, save_dir / filename)
+                        return filename
+                    ext, sha256, size = save_response(response, part, max_size, stop)
+                    etag, last_modified = response.getheader('ETag'), response.getheader('Last-Modified')
+                break
+            except (TimeoutError, ConnectionError, http.client.IncompleteRead):
+                # Оборвалось посреди тела - продолжаем с того же места, пока есть время
+                if (not part.keep or resumes >= RESUMES
+                        or deadline is not None and time.monotonic() >= deadline):
+                    raise
+                resumes += 1
+            except Exception as e:
+                # 416: сервер не может отдать продолжение - начинаем сначала
+                if not resume or getattr(e, 'status', None) != 416:
+                    raise
+                part.discard()
+
+        filename = stem + ext
+        if index is None:
+            part.path.replace(save_dir / filename)
+        else:
+            # Один экземпляр в хранилище, в папке страницы - ссылка на него
+            stored = index.store.adopt(part.path, sha256)
+            index.record_success(url, sha256, size, etag, last_modified)
+            index.place(stored, save_dir / filename)
+        return filename
+
+    except Exception as e:
+        # Прерванное закрытием загрузчика, недокачанный .part, который можно продолжить,
+        # и таймаут, урезанный общим сроком страницы, - не повод не пробовать завтра
+        resumable = part is not None and part.keep
+        interrupted = (isinstance(e, DownloadCancelled) or resumable
+                       or isinstance(e, TimeoutError) and timeout < TIMEOUT)
+        if index is not None and not interrupted:
+            index.record_failure(url, str(e))
+        if cached is not None:
+            # Перепроверить не удалось - остаётся прежняя копия
+            filename = stem + (sniff_file(cached) or '.jpg')
+            index.place(cached, save_dir / filename)
+            return filename
+        if isinstance(e, DownloadCancelled):
+            return None
+        note = " (продолжится с того же места)" if resumable else ""
+        print(f"  ⚠ Не удалось скачать {url[:50]}...: {e}{note}")
+        return None
+
+
+def _resolve(future: 'Future', result=None, error: Exception = None):
+    """Завершить Future, если close() не завершил его раньше."""
+    from concurrent.futures import InvalidStateError
+
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class ImageDownloader:
+    """
+    Параллельное скачивание (см. описание модуля). Пул потоков и соединения
+    (http_pool.HTTPClient в self.client) живут до close(), так что один загрузчик
+    можно передавать всем страницам.
+    index - download_index.DownloadIndex (None - без кэша между запусками), закрывается
+    вместе с загрузчиком.
+    max_size - предел размера одного изображения, байт.
+    fetch(url, save_dir, timeout=, deadline=, client=, index=, max_size=, stop=) - функция
+    одной загрузки, по умолчанию download_image.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, per_host: int = PER_HOST,
+                 deadline: float = DEADLINE, fetch=download_image, client=None, index=None,
+                 max_size: int = MAX_SIZE):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.deadline = deadline
+        self.fetch = fetch
+        self.max_size = max_size
+        self.index = index
+        if client is None:
+            # http.client - при первом загрузчике, а не при импорте clean_forum_html
+            import http_pool
+            client = http_pool.HTTPClient(max_idle=per_host)
+        self.client = client
+        self._lock = threading.Lock()
+        self._pool = None
+        # (url, папка) → Future с именем файла; и выполненные, чтобы мёртвый URL не пробовать снова
+        self._jobs: Dict[Tuple[str, Path], 'Future'] = {}
+        self._active = defaultdict(int)
+        self._queued = defaultdict(deque)
+        self._stop = threading.Event()
+        # Статистика
+        self.requested = 0
+        self.deduplicated = 0
+        # не успели к сроку download_all()
+        self.expired = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Остановить загрузки, не дожидаясь их (в том числе по Ctrl-C): очереди отменяются,
+        идущие скачивания прерываются после текущего куска, оставляя .part для продолжения.
+        Все незавершённые Future получают None, так что collect() после close() не ждёт.
+        """
+        self._stop.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.client.close()
+        with self._lock:
+            self._queued.clear()
+            pending = {key: future for key, future in self._jobs.items() if not future.done()}
+            for key in pending:
+                del self._jobs[key]
+            busy = any(self._active.values())
+        for future in pending.values():
+            _resolve(future, None)
+        # Индекс ещё нужен прерываемым потокам; тогда его закроет выход из программы
+        if self.index is not None and not busy:
+            self.index.close()
+
+    def submit(self, url: str, save_dir: Path, deadline: float) -> 'Future':
+        """
+        Поставить URL в очередь; deadline - момент по time.monotonic(), после которого
+        запрос уже не начинается. Повторный URL получает тот же Future.
+        """
+        # concurrent.futures - при первой загрузке, а не при импорте clean_forum_html
+        from concurrent.futures import Future, ThreadPoolExecutor
+
+        key = (url, Path(save_dir))
+        with self._lock:
+            self.requested += 1
+            future = self._jobs.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future
+            future = self._jobs[key] = Future()
+            host = urlparse(url).netloc.lower()
+            if self._active[host] >= self.per_host:
+                self._queued[host].append((key, future, deadline))
+                return future
+            self._active[host] += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='image')
+            pool = self._pool
+        pool.submit(self._run, host, key, future, deadline)
+        return future
+
+    def _run(self, host: str, key, future: 'Future', deadline: float):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # Срок вышел (или загрузчик закрыт) до начала запроса: в другом вызове URL
+                # можно попробовать снова
+                with self._lock:
+                    self._jobs.pop(key, None)
+                _resolve(future, None)
+            else:
+                try:
+                    _resolve(future, self.fetch(key[0], key[1], timeout=min(TIMEOUT, remaining),
+                                                deadline=deadline, client=self.client, index=self.index,
+                                                max_size=self.max_size, stop=self._stop))
+                except Exception as e:
+                    _resolve(future, error=e)
+            # Освободившийся слот хоста сразу занимает следующий URL этого хоста
+            with self._lock:
+                if not self._queued[host]:
+                    self._active[host] -= 1
+                    return
+                key, future, deadline = self._queued[host].popleft()
+
+    def start(self, requests: Iterable[Tuple[str, Path]]):
+        """
+        Поставить все (url, папка) в очередь и сразу вернуться; общий срок - self.deadline
+        от этого момента. Результат забирает collect(), а пока можно делать другую работу.
+        """
+        deadline = time.monotonic() + self.deadline
+        return deadline, {(url, Path(save_dir)): self.submit(url, save_dir, deadline) for url, save_dir in requests}
+
+    def collect(self, started) -> Dict[Tuple[str, Path], Optional[str]]:
+        """
+        Дождаться запросов из start(), но не дольше срока.
+        Возвращает {(url, папка): имя файла или None}.
+        """
+        deadline, futures = started
+        if not futures:
+            return {}
+        from concurrent.futures import wait
+
+        done, not_done = wait(set(futures.values()), timeout=max(0.0, deadline - time.monotonic()))
+        self.expired += len(not_done)
+        return {key: future.result() if future in done and future.exception() is None else None
+                for key, future in futures.items()}
+
+    def download_all(self, requests: Iterable[Tuple[str, Path]]) -> Dict[Tuple[str, Path], Optional[str]]:
+        """Скачать все (url, папка) с общим сроком: collect(start(requests))."""
+        return self.collect(self.start(requests))
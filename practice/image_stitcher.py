@@ -191,7 +191,12 @@ def unstitch_images(stitched_image_path, meta_path):
             # Создаем директории если вдруг они пропали
             os.makedirs(os.path.dirname(original_path), exist_ok=True)
             
-            save_img.save(original_path)
+            # Новый файл вместо записи поверх: изображения в папках страниц бывают
+            # жёсткими ссылками на общее хранилище (image_store.py)
+            root, ext = os.path.splitext(original_path)
+            tmp_path = f"{root}.unstitch-tmp{ext}"
+            save_img.save(tmp_path)
+            os.replace(tmp_path, original_path)
             success_count += 1
         except Exception as e:
             print(f"Ошибка при сохранении {original_path}: {e}")
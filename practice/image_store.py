@@ -0,0 +1,116 @@
+"""
+Хранилище изображений по содержимому для clean_forum_html.py.
+
+Каждое изображение лежит один раз, под SHA-256 своих байтов: objects/<sha[:2]>/<sha256>.
+Папки страниц (<имя>_files, <имя>_merged_files) заполняются жёсткими ссылками на эти
+объекты, так что одинаковые картинки с разных URL, со страниц темы и из объединённых
+страниц занимают место на диске один раз, а "копирование" в ещё одну папку стоит
+одного link(). Где жёсткие ссылки невозможны (другой диск, файловая система без них),
+файл копируется.
+
+Файлы в папках страниц поэтому нельзя менять на месте - только заменять новым файлом
+(запись во временный и os.replace), иначе изменятся все ссылки сразу.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+
+CHUNK = 1 << 16
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _tmp_name(path: Path) -> Path:
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def place_file(src: Path, dest: Path) -> str:
+    """
+    Поставить src в dest жёсткой ссылкой, а если нельзя (другой диск, FAT, лимит ссылок) -
+    копией. Через временное имя: в dest либо прежний файл, либо целиком новый.
+    Возвращает 'linked' или 'copied'.
+    """
+    tmp = _tmp_name(Path(dest))
+    try:
+        os.link(src, tmp)
+        kind = 'linked'
+    except OSError:
+        shutil.copyfile(src, tmp)
+        kind = 'copied'
+    os.replace(tmp, dest)
+    return kind
+
+
+class ImageStore:
+    """
+    См. описание модуля. Статистика: stored - новых объектов, linked - файлов, поставленных
+    жёсткой ссылкой, copied - поставленных копией (ссылка не получилась).
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.linked = 0
+        self.copied = 0
+
+    def summary(self) -> str:
+        return f"новых объектов {self.stored}, жёстких ссылок {self.linked}, копий {self.copied}"
+
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def adopt(self, tmp: Path, sha256: str) -> Path:
+        """
+        Сделать объектом уже записанный временный файл (в той же файловой системе, например
+        в self.root) с известным SHA-256; если такой объект есть - файл удаляется.
+        Возвращает путь объекта.
+        """
+        path = self.path(sha256)
+        if path.exists():
+            Path(tmp).unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)
+            self._count('stored')
+        return path
+
+    def put_file(self, src: Path) -> str:
+        """
+        Добавить существующий файл; сам файл становится объектом (жёсткая ссылка),
+        если такого содержимого ещё нет. Возвращает SHA-256.
+        """
+        sha256 = file_sha256(src)
+        path = self.path(sha256)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            place_file(Path(src), path)
+            self._count('stored')
+        return sha256
+
+    def link(self, sha256: str, dest: Path):
+        """Поставить объект в dest (заменяя то, что там было)."""
+        self.place(self.path(sha256), Path(dest))
+
+    def link_file(self, src: Path, dest: Path) -> str:
+        """Положить src в хранилище и поставить тот же объект в dest; возвращает SHA-256."""
+        sha256 = self.put_file(src)
+        self.link(sha256, dest)
+        return sha256
+
+    def place(self, src: Path, dest: Path):
+        """place_file() со счётом ссылок и копий."""
+        self._count(place_file(src, dest))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+bench_clean_html.py
+
+Benchmark and regression check for clean_html.py.
+
+Usage:
+  python3 scripts/bench_clean_html.py                      # time the corpus + synthetic pages, check golden hashes
+  python3 scripts/bench_clean_html.py --update-golden      # accept the current outputs as golden
+  python3 scripts/bench_clean_html.py --json run.json      # save results, then later:
+  python3 scripts/bench_clean_html.py --baseline run.json --max-slowdown 0.2
+
+Every page group in sources/ and practice/pages/ is built (Name.html, Name 2.html, ... -> one page),
+plus synthetic forum pages generated with a fixed seed (N posts, M quotes, nesting depth D).
+For each case the best-of-R wall time gives MB/s and posts/s; one extra run under tracemalloc
+gives the peak memory, and decoding the inputs alone is timed too. Output hashes are compared
+against scripts/bench_golden.json.
+
+The exit status is 1 when an output hash changed or a case got slower (or used more memory)
+than the baseline allows, so the script can gate a change.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+import clean_html  # noqa: E402
+import html_charset  # noqa: E402
+
+DEFAULT_GOLDEN = os.path.join(SCRIPT_DIR, 'bench_golden.json')
+CORPUS_DIRS = ('sources', os.path.join('practice', 'pages'))
+DEFAULT_SYNTHETIC = ('200x40x4', '1000x200x8', '50x10x40')
+POST_RE = re.compile(rb'class="post[ "]')
+
+WORDS = ("тело", "дыхание", "внимание", "ощущение", "покой", "энергия", "практика", "сознание",
+         "расслабление", "мышцы", "образ", "свет", "тепло", "ритм", "волна", "центр", "поток")
+
+
+def synthetic_forum(posts: int, quotes: int, depth: int, seed: int = 0) -> bytes:
+    """Return a mybb-style forum page (cp1251, like the saved originals) with the given shape.
+
+    Quotes are spread over the posts; about a third repeat an earlier quote verbatim and
+    another third are edited re-quotes, so both dedupe paths get exercised. Each post wraps
+    part of its body in ``depth`` nested spans/divs.
+    """
+    rnd = random.Random(seed)
+
+    def sentence(n=12):
+        return ' '.join(rnd.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+    quote_posts = sorted(rnd.randrange(posts) for _ in range(quotes)) if posts else []
+    said: list[tuple[str, str]] = []
+    out = ['<!DOCTYPE html><html><head><meta charset="windows-1251"><title>Синтетическая тема</title>',
+           '<style>.post-content td { background: #000066; }</style>',
+           '<script>var FORUM = {topic: 1};</script></head><body><div id="pun-main">']
+    q = 0
+    for i in range(posts):
+        out.append(f'<div id="p{i}" class="post" data-posted="{1347965611 + i}">'
+                   f'<h3><span><a class="permalink" href="#p{i}">2012-09-18 14:53:31</a></span></h3>'
+                   '<div class="container"><div class="post-author"><ul>'
+                   f'<li class="pa-author"><a href="javascript:to(\'user{i % 17}\')">user{i % 17}</a></li>'
+                   '<li class="pa-avatar"><img src="synthetic_files/avatar.jpg" alt=""></li></ul></div>'
+                   f'<div class="post-body"><div class="post-box"><div id="p{i}-content" class="post-content">')
+        if i % 10 == 0:
+            out.append(f'<p><strong>Ступень {i // 10 + 1}</strong></p>')
+        while q < len(quote_posts) and quote_posts[q] == i:
+            kind = q % 3
+            if kind == 1 and said:
+                author, text = rnd.choice(said)
+            elif kind == 2 and said:
+                author, text = rnd.choice(said)
+                text = text.rsplit(' ', 3)[0] + ' ' + sentence(3)
+            else:
+                author, text = f"user{q % 17}", ' '.join(sentence() for _ in range(3))
+                said.append((author, text))
+            out.append(f'<div class="quote-box quote-main"><cite>{author} писал(а):</cite>'
+                       f'<blockquote><p>{text}</p></blockquote></div>')
+            q += 1
+        for _ in range(rnd.randint(2, 5)):
+            out.append(f'<p>{sentence(rnd.randint(8, 30))}<br>{sentence()}</p>')
+        out.append('<span style="color: yellow"><div>' * depth)
+        out.append(f'{sentence()} <a href="https://example.org/{i}">{sentence(3)}</a>')
+        out.append('</div></span>' * depth)
+        out.append('<p><img class="postimg" src="synthetic_files/pic.jpg" alt=""></p>')
+        out.append('</div></div></div><div class="post-links"><ul><li><a href="#">Цитировать</a></li>'
+                   '</ul></div></div></div>')
+    out.append('</div></body></html>')
+    return ''.join(out).encode('cp1251', 'xmlcharrefreplace')
+
+
+def corpus_cases() -> list[dict]:
+    cases = []
+    for rel in CORPUS_DIRS:
+        src_dir = os.path.join(ROOT, rel)
+        if not os.path.isdir(src_dir):
+            continue
+        for name, inputs in clean_html.group_source_pages(src_dir).items():
+            cases.append({'name': f"{rel}/{name}", 'inputs': inputs})
+    return cases
+
+
+def synthetic_cases(specs: list[str], work_dir: str) -> list[dict]:
+    cases = []
+    for spec in specs:
+        posts, quotes, depth = (int(x) for x in spec.split('x'))
+        path = os.path.join(work_dir, f"synthetic-{spec}.html")
+        with open(path, 'wb') as f:
+            f.write(synthetic_forum(posts, quotes, depth))
+        cases.append({'name': f"synthetic/{spec}", 'inputs': [path]})
+    return cases
+
+
+def run_case(case: dict, out_path: str, quote_similarity: float, parser: str) -> float:
+    # fresh asset indexes each run, so every run pays for its own directory walk
+    clean_html._asset_indexes.clear()
+    gc.collect()
+    start = time.perf_counter()
+    clean_html.build_page(case['inputs'], out_path, quote_similarity=quote_similarity, parser=parser)
+    return time.perf_counter() - start
+
+
+def measure(case: dict, work_dir: str, repeat: int, quote_similarity: float, parser: str) -> dict:
+    out_path = os.path.join(work_dir, re.sub(r'[^\w.-]+', '_', case['name']) + '.out.html')
+    blobs = []
+    for p in case['inputs']:
+        with open(p, 'rb') as f:
+            blobs.append(f.read())
+    size = sum(len(b) for b in blobs)
+    posts = sum(len(POST_RE.findall(b)) for b in blobs)
+
+    # charset detection + decoding on its own (html_charset), from bytes already in memory
+    decode_seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for b in blobs:
+            html_charset.decode_html(b)
+        decode_seconds = min(decode_seconds, time.perf_counter() - start)
+
+    seconds = min(run_case(case, out_path, quote_similarity, parser) for _ in range(repeat))
+
+    tracemalloc.start()
+    try:
+        run_case(case, out_path, quote_similarity, parser)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    with open(out_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {
+        'inputs': len(case['inputs']),
+        'bytes': size,
+        'posts': posts,
+        'seconds': round(seconds, 6),
+        'mb_per_s': round(size / seconds / 1e6, 3),
+        'posts_per_s': round(posts / seconds, 1),
+        'decode_ms': round(decode_seconds * 1000, 3),
+        'peak_mb': round(peak / 1e6, 2),
+        'sha256': digest,
+    }
+
+
+def environment() -> dict:
+    import importlib.util
+    import platform
+
+    import bs4
+
+    return {
+        'python': platform.python_version(),
+        'bs4': bs4.__version__,
+        'modules': [name for name in ('lxml', 'html5lib', 'readability') if importlib.util.find_spec(name)],
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark clean_html.py and check its output against golden hashes")
+    p.add_argument("--repeat", type=int, default=3, help="timed runs per case; the best one counts (default: 3)")
+    p.add_argument("--synthetic", nargs='*', default=list(DEFAULT_SYNTHETIC), metavar="PxQxD",
+                   help="synthetic pages as posts x quotes x nesting depth (default: %(default)s)")
+    p.add_argument("--no-corpus", action="store_true", help="only run the synthetic pages")
+    p.add_argument("--filter", help="only run cases whose name contains this string")
+    p.add_argument("--quote-similarity", type=float, default=1.0, help="passed through to build_page")
+    p.add_argument("--parser", default="auto", choices=clean_html.html_parsers.CHOICES,
+                   help="parser backend to benchmark; every backend must reproduce the golden hashes")
+    p.add_argument("--golden", default=DEFAULT_GOLDEN, help="golden hashes file (default: scripts/bench_golden.json)")
+    p.add_argument("--update-golden", action="store_true", help="write the current output hashes to --golden")
+    p.add_argument("--json", help="also write the results to this file (usable as a later --baseline)")
+    p.add_argument("--baseline", help="results file from an earlier --json run to compare timings against")
+    p.add_argument("--max-slowdown", type=float, default=0.25,
+                   help="fail when a case is this much slower than the baseline (0.25 = 25%%, default)")
+    p.add_argument("--max-memory-growth", type=float, default=0.25,
+                   help="fail when a case's peak memory grew this much over the baseline (default: 0.25)")
+    args = p.parse_args(argv)
+
+    # outputs live one level below the repo root so the rewritten asset URLs don't depend on
+    # where the checkout is, which keeps the hashes comparable between machines
+    work_dir = tempfile.mkdtemp(prefix='.bench-', dir=ROOT)
+    try:
+        cases = [] if args.no_corpus else corpus_cases()
+        cases += synthetic_cases(args.synthetic, work_dir)
+        if args.filter:
+            cases = [c for c in cases if args.filter in c['name']]
+        if not cases:
+            print("No benchmark cases")
+            sys.exit(2)
+
+        results = {}
+        width = max(len(c['name']) for c in cases)
+        print(f"  {'case':<{width}}  {'KB':>7}  {'posts':>5}  {'seconds':>8}  {'MB/s':>6}  {'posts/s':>8}  {'peak MB':>7}  {'decode ms':>9}")
+        for case in cases:
+            r = results[case['name']] = measure(case, work_dir, args.repeat, args.quote_similarity, args.parser)
+            print(f"  {case['name']:<{width}}  {r['bytes'] // 1024:>7}  {r['posts']:>5}  {r['seconds']:>8.3f}"
+                  f"  {r['mb_per_s']:>6.2f}  {r['posts_per_s']:>8.1f}  {r['peak_mb']:>7.1f}  {r['decode_ms']:>9.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    env = environment()
+    report = {'environment': env, 'parser': clean_html.html_parsers.resolve_parser(args.parser), 'cases': results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.update_golden:
+        golden = {'environment': env, 'cases': {name: r['sha256'] for name, r in sorted(results.items())}}
+        with open(args.golden, 'w', encoding='utf-8') as f:
+            json.dump(golden, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"Golden hashes written to {args.golden}")
+    elif os.path.exists(args.golden):
+        with open(args.golden, encoding='utf-8') as f:
+            golden = json.load(f)
+        if golden.get('environment', {}).get('modules') != env['modules']:
+            print(f"Note: golden hashes were made with {golden.get('environment')}; this run has {env}")
+        for name, r in results.items():
+            expected = golden['cases'].get(name)
+            if expected is None:
+                print(f"  {name}: no golden hash (run with --update-golden)")
+            elif expected != r['sha256']:
+                failures.append(f"{name}: output changed ({r['sha256'][:12]} != golden {expected[:12]})")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['cases']
+        for name, r in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            slowdown = r['seconds'] / base['seconds'] - 1
+            growth = r['peak_mb'] / base['peak_mb'] - 1 if base['peak_mb'] else 0.0
+            print(f"  {name}: {slowdown:+.1%} time, {growth:+.1%} peak memory vs baseline")
+            if slowdown > args.max_slowdown:
+                failures.append(f"{name}: {slowdown:.1%} slower than baseline (limit {args.max_slowdown:.0%})")
+            if growth > args.max_memory_growth:
+                failures.append(f"{name}: peak memory up {growth:.1%} (limit {args.max_memory_growth:.0%})")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"OK: {len(results)} case(s)")
+
+
+if __name__ == "__main__":
+    main()
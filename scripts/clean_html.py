@@ -7,8 +7,13 @@ Extract a minimal, mobile-friendly HTML document from a scraped forum/blog HTML
 Usage:
   python3 scripts/clean_html.py input.html -o output.html
 
+From Python (with scripts/ on sys.path), extract() cleans a page held in memory:
+  doc = clean_html.extract(html_bytes, "sources/Page.html")
+  doc.title, doc.content_html, doc.to_html()
+Heavier modules (readability, lxml.html, argparse) are only imported when used.
+
 The script tries to use readability-lxml to extract the main article. If unavailable,
-it falls back to a heuristic that picks the largest text-containing element.
+it falls back to a readability-style scorer (paragraph counts, commas, link density).
 
 It rewrites relative asset URLs (images/scripts/styles) to point at the sibling "_files"
 directory next to the source HTML when possible so embedded images still work.
@@ -18,62 +23,214 @@ Requirements (see requirements.txt): beautifulsoup4, lxml, readability-lxml, cha
 
 from __future__ import annotations
 
-import argparse
+import bisect
+import contextlib
+import copy
+import hashlib
+import json
 import os
+import signal
 import sys
+import threading
 import io
+import time
+import tracemalloc
+from typing import TYPE_CHECKING
 from urllib.parse import unquote, urlparse
 import re
 
 try:
-    from bs4 import BeautifulSoup, Comment
+    from bs4 import BeautifulSoup, CData, Comment, NavigableString, Tag
 except Exception:
     print("Missing dependency: beautifulsoup4. Please install with: pip install -r requirements.txt")
     raise
 
+import html_charset
+import html_parsers
 
-def detect_encoding(b: bytes) -> str:
-    # Try utf-8 first, then windows-1251, then fallback to latin-1
-    for enc in ("utf-8", "windows-1251", "latin-1"):
-        try:
-            b.decode(enc)
-            return enc
-        except Exception:
-            continue
-    return "utf-8"
+if TYPE_CHECKING:
+    import argparse
 
 
-def read_html(path: str) -> tuple[str, str]:
-    b = open(path, "rb").read()
-    enc = detect_encoding(b)
-    try:
-        return b.decode(enc, errors="replace"), enc
-    except Exception:
-        return b.decode("utf-8", errors="replace"), "utf-8"
+# Number of HTML parses done by this process; extract_fragment() reports the
+# per-input difference so stray serialize/reparse round-trips show up in --debug.
+parse_count = 0
+# Readability summaries computed / taken from the cache's memo by this process, reported the same way
+readability_runs = 0
+readability_memo_hits = 0
+
+# Local modules whose code decides what a fragment looks like; FragmentCache keys include their sources
+PIPELINE_MODULES = ('clean_html', 'html_charset', 'html_parsers', 'responsive_images')
+
+
+def make_soup(html_text: str, parser: str = "auto") -> BeautifulSoup:
+    """Create a BeautifulSoup object with the chosen backend (see html_parsers)."""
+    global parse_count
+    parse_count += 1
+    return html_parsers.make_soup(html_text, parser)
+
+UNWANTED_TAGS = ("script", "style", "noscript", "iframe", "input", "button", "form", "svg", "video", "audio")
+# string types get_text() counts for ordinary tags
+TEXT_STRING_TYPES = getattr(Tag, 'MAIN_CONTENT_STRING_TYPES', None) or {NavigableString, CData}
 
-def make_soup(html_text: str) -> BeautifulSoup:
-    """Create a BeautifulSoup object trying common parsers in order."""
-    for parser in ("lxml", "html5lib", "html.parser"):
-        try:
-            return BeautifulSoup(html_text, parser)
-        except Exception:
-            continue
-    # last resort
-    return BeautifulSoup(html_text, "html.parser")
 
 def remove_unwanted(soup: BeautifulSoup) -> None:
     # remove scripts, styles, comments, noscript, meta, link[rel!=stylesheet?]
-    for tag in soup(["script", "style", "noscript", "iframe", "input", "button", "form", "svg", "video", "audio"]):
+    for tag in soup(list(UNWANTED_TAGS)):
         tag.decompose()
 
-    for tag in soup.find_all(text=lambda t: isinstance(t, Comment)):
+    for tag in soup.find_all(string=lambda t: isinstance(t, Comment)):
         try:
             tag.extract()
         except Exception:
             pass
 
 
-def pick_main_content(soup: BeautifulSoup) -> BeautifulSoup:
+# Readability-style hints for the fallback scorer (class/id weights and paragraph-like tags)
+POSITIVE_HINTS = re.compile(r"article|body|content|entry|main|page|post|text|blog|story|topic", re.I)
+NEGATIVE_HINTS = re.compile(r"comment|combx|footer|foot|header|menu|nav|sidebar|sponsor|ad-|banner|share|social|author|profile|related|widget|links", re.I)
+PARAGRAPH_TAGS = ('p', 'pre', 'td')
+BLOCK_TAGS = frozenset(('address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'figure', 'footer',
+                        'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav', 'ol', 'p',
+                        'pre', 'section', 'table', 'ul'))
+TAG_BASE_SCORES = {'div': 5, 'article': 5, 'main': 5, 'section': 3, 'pre': 3, 'td': 3, 'blockquote': 3,
+                   'ol': -3, 'ul': -3, 'dl': -3, 'dd': -3, 'dt': -3, 'li': -3, 'form': -3, 'th': -5,
+                   'h1': -5, 'h2': -5, 'h3': -5, 'h4': -5, 'h5': -5, 'h6': -5}
+
+
+def score_main_content(soup: BeautifulSoup) -> Tag | None:
+    """Pick the main content node without calling get_text() per candidate.
+
+    One post-order walk computes, for every tag, its text length, the part of it
+    inside links and its comma count. Paragraphs (p/pre/td, and divs without block
+    children) then add 1 + commas + min(len // 100, 3) to their parent and half of
+    that to their grandparent. Each candidate's score is scaled by (1 - link density).
+    """
+    text_len: dict[int, int] = {}
+    link_len: dict[int, int] = {}
+    commas: dict[int, int] = {}
+    has_block: dict[int, bool] = {}
+    paragraphs: list[Tag] = []
+
+    stack = [(soup, False)]
+    while stack:
+        node, done = stack.pop()
+        if not done:
+            stack.append((node, True))
+            stack.extend((ch, False) for ch in reversed(node.contents) if isinstance(ch, Tag))
+            continue
+        tl = lk = cm = 0
+        block = False
+        for ch in node.contents:
+            if isinstance(ch, Tag):
+                k = id(ch)
+                tl += text_len[k]
+                lk += link_len[k]
+                cm += commas[k]
+                block = block or ch.name in BLOCK_TAGS
+            elif type(ch) in TEXT_STRING_TYPES:
+                stripped = ch.strip()
+                tl += len(stripped)
+                cm += stripped.count(',')
+        k = id(node)
+        text_len[k] = tl
+        link_len[k] = tl if node.name == 'a' else lk
+        commas[k] = cm
+        has_block[k] = block
+        if node.name in PARAGRAPH_TAGS or (node.name == 'div' and not block):
+            paragraphs.append(node)
+
+    scores: dict[int, float] = {}
+    nodes: dict[int, Tag] = {}
+
+    def initial_score(node: Tag) -> float:
+        score = TAG_BASE_SCORES.get(node.name, 0)
+        hints = ' '.join(node.get('class') or []) + ' ' + (node.get('id') or '')
+        if NEGATIVE_HINTS.search(hints):
+            score -= 25
+        if POSITIVE_HINTS.search(hints):
+            score += 25
+        return score
+
+    for para in paragraphs:
+        tl = text_len[id(para)]
+        if tl < 25:
+            continue
+        content_score = 1 + commas[id(para)] + min(tl // 100, 3)
+        parent = para.parent
+        for weight, ancestor in ((1, parent), (0.5, parent.parent if parent is not None else None)):
+            if not isinstance(ancestor, Tag) or isinstance(ancestor, BeautifulSoup):
+                continue
+            k = id(ancestor)
+            if k not in scores:
+                scores[k] = initial_score(ancestor)
+                nodes[k] = ancestor
+            scores[k] += content_score * weight
+
+    best = None
+    best_score = 0.0
+    for k, score in scores.items():
+        tl = text_len[k]
+        link_density = link_len[k] / tl if tl else 0.0
+        score *= 1 - link_density
+        if score > best_score:
+            best_score = score
+            best = nodes[k]
+    return best or soup.body
+
+
+# What readability drops from every document anyway (hidden elements, stylesheet links), and
+# boilerplate it would only have to score: navigation, sidebars, menus, share/ad blocks
+DISPLAY_NONE_RE = re.compile(r"(?:^|;)\s*(?:display\s*:\s*none|visibility\s*:\s*hidden)\s*(?:!important\s*)?(?:;|$)", re.I)
+BOILERPLATE_TAGS = frozenset(('nav', 'aside'))
+BOILERPLATE_HINTS = re.compile(r"sidebar|menu|navig|breadcrumb|banner|advert|(?<![a-z])ads?(?![a-z])|ad-|share|social|"
+                               r"footer|header|pagination|pager|popup|cookie", re.I)
+CONTENT_HINTS = re.compile(r"article|body|content|main|post|text|entry|story|column", re.I)
+# readability scores p/pre/td and takes the title from h1/h2, so subtrees holding these stay
+SCORED_TAGS = ('p', 'pre', 'td', 'h1', 'h2', 'article', 'main')
+
+
+def _prunable(tag: Tag) -> bool:
+    if tag.has_attr('hidden') or tag.name == 'link':
+        return True
+    style = tag.get('style')
+    if style and DISPLAY_NONE_RE.search(style):
+        return True
+    if tag.name in BOILERPLATE_TAGS:
+        return tag.find(SCORED_TAGS) is None
+    hints = ' '.join(tag.get('class', ())) + ' ' + (tag.get('id') or '')
+    if len(hints) < 3 or tag.name in ('html', 'body'):
+        return False
+    return bool(BOILERPLATE_HINTS.search(hints)) and not CONTENT_HINTS.search(hints) and tag.find(SCORED_TAGS) is None
+
+
+def readability_markup(soup: BeautifulSoup) -> str:
+    """Serialize soup for readability without hidden elements and obvious boilerplate subtrees.
+
+    One walk over the tree. Hidden/display:none elements and <link>s never hold readable text;
+    boilerplate (nav, and aside or sidebar/menu/share/... containers) only goes when it holds
+    nothing readability would score, so the picked article stays the same while the markup it
+    has to parse (twice or more) and score shrinks. The pruned subtrees are put back before
+    returning, so the heuristic fallback still sees the whole page.
+    """
+    removed = []
+    extracted = set()
+    try:
+        for tag in soup.find_all(_prunable):
+            if any(id(parent) in extracted for parent in tag.parents):
+                continue
+            parent = tag.parent
+            removed.append((parent, parent.index(tag), tag))
+            tag.extract()
+            extracted.add(id(tag))
+        return str(soup)
+    finally:
+        for parent, index, tag in reversed(removed):
+            parent.insert(index, tag)
+
+
+def pick_main_content(soup: BeautifulSoup, parser: str = "auto", memo: FragmentCache | None = None,
+                      use_readability: bool = True) -> BeautifulSoup:
     # If the page contains forum posts, prefer extracting only the post content
     # i.e., for each div.post take .post-content (or .post-body/.post-box) and concatenate them.
     posts = soup.select('div.post')
@@ -85,61 +242,164 @@ def pick_main_content(soup: BeautifulSoup) -> BeautifulSoup:
             # try common selectors for post body/content
             content = p.select_one('.post-content') or p.select_one('.post-body') or p.select_one('.post-box')
             if content:
-                # copy only the inner HTML/text of the content
-                fragment = make_soup(str(content))
+                # transplant the content subtree instead of serializing and reparsing it;
+                # copy only if it already came along with an earlier (enclosing) post
+                if any(parent is container for parent in content.parents):
+                    content = copy.copy(content)
+                else:
+                    content.extract()
                 # remove nested author/links if accidentally present (keep .quote-box for later processing)
-                for bad in fragment.select('.post-author, .post-links, .post-links ul, .post-links li'):
+                for bad in content.select('.post-author, .post-links, .post-links ul, .post-links li'):
                     bad.decompose()
-                # append children preserving order
-                for child in fragment.body.contents if fragment.body else fragment.contents:
-                    container.append(child)
+                container.append(content)
         title = soup.title.string if soup.title else ''
         return out, title
 
     # Prefer readability if available
-    try:
-        from readability import Document
-
-        html = str(soup)
-        doc = Document(html)
-        summary = doc.summary()
-        title = doc.short_title() or (soup.title.string if soup.title else "")
-        return make_soup(summary), title
-    except Exception:
-        # Heuristic: find the largest element by text length among common containers
-        candidates_selectors = [
-            "article",
-            "main",
-            "#pun-viewtopic",
-            ".post",
-            ".postcontent",
-            ".post-body",
-            ".topic",
-            "#content",
-            "body",
-        ]
-        best = None
-        best_len = 0
-        for sel in candidates_selectors:
-            node = soup.select_one(sel)
-            if node:
-                l = len(node.get_text(separator=" ", strip=True))
-                if l > best_len:
-                    best_len = l
-                    best = node
-
-        # If nothing found, pick the largest div
-        if best is None:
-            for node in soup.find_all(["div", "section"], recursive=True):
-                l = len(node.get_text(separator=" ", strip=True))
-                if l > best_len:
-                    best_len = l
-                    best = node
-
-        title = soup.title.string if soup.title else ""
-        if best is None:
-            return make_soup("<div>%s</div>" % soup.get_text(separator="\n", strip=True)), title
-        return best, title
+    if use_readability:
+        try:
+            from readability import Document
+
+            global parse_count, readability_runs, readability_memo_hits
+            html = readability_markup(soup)
+            key = memo.summary_key(html) if memo is not None else None
+            cached = memo.get_summary(key) if key else None
+            if cached is not None:
+                readability_memo_hits += 1
+                summary, title = cached
+            else:
+                # readability only takes markup, so this round-trip can't be avoided
+                parse_count += 1
+                doc = Document(html)
+                summary = doc.summary()
+                title = doc.short_title()
+                readability_runs += 1
+                if key:
+                    memo.put_summary(key, summary, title)
+            title = title or (soup.title.string if soup.title else "")
+            return make_soup(summary, parser), title
+        except Exception:
+            pass
+
+    # Heuristic: score containers the way readability does, in linear time
+    best = score_main_content(soup)
+
+    title = soup.title.string if soup.title else ""
+    if best is None:
+        return make_soup("<div>%s</div>" % soup.get_text(separator="\n", strip=True), parser), title
+    return best, title
+
+
+def _class_test(name: str) -> str:
+    # XPath for "has class name", matching the way bs4 splits the class attribute
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def lxml_document(html_text: str):
+    """Parse a whole page into a plain lxml tree, for the lxml-native parser."""
+    from lxml import html as lxml_html
+
+    global parse_count
+    parse_count += 1
+    return lxml_html.document_fromstring(html_text)
+
+
+def pick_posts_lxml(root):
+    """The forum branch of remove_unwanted + pick_main_content, run on an lxml tree.
+
+    Returns (content_soup, title), or None when the page has no div.post. The result is
+    the same as the BeautifulSoup path's: the picked post bodies are serialized once and
+    handed to html.parser, which rebuilds the tree as is. Serializing as XML keeps
+    non-ASCII URLs intact; lxml's HTML serializer would percent-encode them.
+    """
+    from lxml import etree
+
+    posts = root.xpath(f"//div[{_class_test('post')}]")
+    if not posts:
+        return None
+    etree.strip_elements(root, *UNWANTED_TAGS, etree.Comment, with_tail=False)
+    bad_test = f".//*[{_class_test('post-author')} or {_class_test('post-links')}]"
+
+    taken = set()
+    parts = []
+    for p in posts:
+        for name in ('post-content', 'post-body', 'post-box'):
+            found = p.xpath(f".//*[{_class_test(name)}]")
+            if found:
+                content = found[0]
+                break
+        else:
+            continue
+        if content in taken or any(parent in taken for parent in content.iterancestors()):
+            content = copy.deepcopy(content)
+        else:
+            # like bs4's extract(): the text following the node stays where it was
+            parent = content.getparent()
+            if content.tail:
+                prev = content.getprevious()
+                if prev is not None:
+                    prev.tail = (prev.tail or '') + content.tail
+                else:
+                    parent.text = (parent.text or '') + content.tail
+                content.tail = None
+            parent.remove(content)
+            taken.add(content)
+        for bad in content.xpath(bad_test):
+            if bad.getparent() is not None:
+                bad.drop_tree()
+        parts.append(etree.tostring(content, encoding='unicode', method='xml', with_tail=False))
+
+    title_el = root.find('.//title')
+    title = title_el.text if title_el is not None else ''
+    global parse_count
+    parse_count += 1
+    return BeautifulSoup('<div>%s</div>' % ''.join(parts), 'html.parser'), title
+
+
+class AssetIndex:
+    """Filename -> path index of everything under a source directory, built with one walk.
+
+    Directories and files are visited in sorted order, so when the same name exists in
+    several folders the first one in that order always wins.
+    """
+
+    def __init__(self, src_dir: str):
+        self.src_dir = src_dir
+        self.files_by_dir: dict[str, set[str]] = {}
+        self.first_path: dict[str, str] = {}
+        for root, dirs, files in os.walk(src_dir or os.curdir):
+            dirs.sort()
+            files.sort()
+            self.files_by_dir[os.path.normpath(root)] = set(files)
+            for name in files:
+                self.first_path.setdefault(name, os.path.join(root, name))
+
+    def contains(self, directory: str, name: str) -> bool:
+        return name in self.files_by_dir.get(os.path.normpath(directory), ())
+
+    def find(self, name: str) -> str | None:
+        return self.first_path.get(name)
+
+    def fingerprint(self) -> str:
+        """Hash of the indexed listing; rewritten URLs only change when this does."""
+        h = hashlib.sha256()
+        for directory in sorted(self.files_by_dir):
+            h.update(directory.encode('utf-8', 'surrogateescape') + b'\0')
+            for name in sorted(self.files_by_dir[directory]):
+                h.update(name.encode('utf-8', 'surrogateescape') + b'\1')
+        return h.hexdigest()
+
+
+_asset_indexes: dict[str, AssetIndex] = {}
+
+
+def get_asset_index(src_dir: str) -> AssetIndex:
+    """Return the shared AssetIndex for src_dir, building it on first use."""
+    key = os.path.abspath(src_dir or os.curdir)
+    index = _asset_indexes.get(key)
+    if index is None:
+        index = _asset_indexes[key] = AssetIndex(src_dir)
+    return index
 
 
 def rewrite_asset_urls(content_soup: BeautifulSoup, src_html_path: str, out_path: str) -> None:
@@ -147,6 +407,9 @@ def rewrite_asset_urls(content_soup: BeautifulSoup, src_html_path: str, out_path
     src_dir = os.path.dirname(src_html_path)
     base_name = os.path.splitext(os.path.basename(src_html_path))[0]
     assets_dir = os.path.join(src_dir, base_name + "_files")
+    out_dir = os.path.dirname(out_path)
+    index = get_asset_index(src_dir)
+    resolved: dict[str, str] = {}
 
     def fix_url(url: str) -> str:
         if not url:
@@ -161,18 +424,14 @@ def rewrite_asset_urls(content_soup: BeautifulSoup, src_html_path: str, out_path
         name = os.path.basename(decoded)
         if not name:
             return url
-        # if assets_dir exists and contains this file, generate relative path from out_path
-        if os.path.isdir(assets_dir) and os.path.exists(os.path.join(assets_dir, name)):
-            rel = os.path.relpath(os.path.join(assets_dir, name), os.path.dirname(out_path))
+        # if assets_dir contains this file, generate relative path from out_path
+        if index.contains(assets_dir, name):
+            rel = os.path.relpath(os.path.join(assets_dir, name), out_dir)
             return rel.replace("\\", "/")
         # otherwise, try to find file anywhere in the source dir
-        cand = None
-        for root, _, files in os.walk(src_dir):
-            if name in files:
-                cand = os.path.join(root, name)
-                break
+        cand = index.find(name)
         if cand:
-            return os.path.relpath(cand, os.path.dirname(out_path)).replace("\\", "/")
+            return os.path.relpath(cand, out_dir).replace("\\", "/")
         # fallback: return decoded (might be an absolute path fragment)
         return decoded
 
@@ -180,7 +439,10 @@ def rewrite_asset_urls(content_soup: BeautifulSoup, src_html_path: str, out_path
         for attr in ("src", "href"):
             if tag.has_attr(attr):
                 try:
-                    tag[attr] = fix_url(tag[attr])
+                    url = tag[attr]
+                    if url not in resolved:
+                        resolved[url] = fix_url(url)
+                    tag[attr] = resolved[url]
                 except Exception:
                     pass
 
@@ -231,152 +493,245 @@ def build_output_html(title: str, content_html: str) -> str:
     return doc
 
 
-def main(argv=None):
-    p = argparse.ArgumentParser(description="Create a minimal mobile-friendly HTML from scraped forum/blog HTML files")
-    p.add_argument("inputs", nargs='+', help="one or more source HTML files (e.g. sources/Файл.html sources/Файл2.html)")
-    p.add_argument("-o", "--output", help="output HTML file", default="relaxation_guide.html")
-    p.add_argument("--title", help="optional output title (overrides input titles)")
-    args = p.parse_args(argv)
-
-
-    # Verify inputs exist
-    # global seen quotes across all inputs to dedupe repeated quoted blocks
-    seen_quotes = set()
-    for inp in args.inputs:
-        if not os.path.exists(inp):
-            print(f"Input not found: {inp}")
-            sys.exit(2)
-
-    # Aggregate content from all inputs
-    aggregate = BeautifulSoup('', 'html.parser')
-    agg_container = aggregate.new_tag('div')
-    aggregate.append(agg_container)
-    title = None
-    for inp in args.inputs:
-        html_text, enc = read_html(inp)
-        soup = make_soup(html_text)
-        remove_unwanted(soup)
+KEEP_CLASSES = ('step-number', 'extracted-quote')
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5')
 
-        content_node, t = pick_main_content(soup)
-        if title is None:
-            title = t
 
-        # Ensure we have a soup fragment
-        if not isinstance(content_node, BeautifulSoup):
-            content_soup = make_soup(str(content_node))
-        else:
-            content_soup = content_node
-
-        remove_unwanted(content_soup)
+def kept_classes(tag: Tag) -> list:
+    # Only step-number and extracted-quote survive cleanup; a plain-string class
+    # (as set by new_tag callers) iterates per character and never matches.
+    return [c for c in tag.get('class', []) if c in KEEP_CLASSES]
 
-        # Rewrite asset urls relative to this input file
-        rewrite_asset_urls(content_soup, inp, args.output)
 
-        # Process quote-boxes: dedupe across files and normalize to <blockquote class='extracted-quote'>
-        for q in content_soup.select('.quote-box'):
-            qtext = ' '.join(q.get_text(separator=' ', strip=True).split())
-            if not qtext:
-                q.decompose()
-                continue
-            if qtext in seen_quotes:
-                q.decompose()
-            else:
-                seen_quotes.add(qtext)
-                newb = content_soup.new_tag('blockquote')
-                newb['class'] = 'extracted-quote'
-                newp = content_soup.new_tag('p')
-                newp.string = qtext
-                newb.append(newp)
-                q.replace_with(newb)
-
-        # Append children of this fragment to aggregate container (preserve order)
-        children = content_soup.body.contents if getattr(content_soup, 'body', None) else content_soup.contents
-        for child in children:
-            try:
-                agg_container.append(child)
-            except Exception:
-                agg_container.append(BeautifulSoup(str(child), 'html.parser'))
+def is_unwanted(node) -> bool:
+    if isinstance(node, Comment):
+        return True
+    return isinstance(node, Tag) and node.name in UNWANTED_TAGS
 
-    # Some small cleanups: remove event handlers and most attributes on the aggregate container
-    for tag in aggregate.find_all(True):
-        # remove event handlers and inline styles, keep class for certain allowed classes
-        for k in list(tag.attrs.keys()):
-            if k.startswith("on") or k in ("style", "id", "role", "aria-*"):
-                try:
-                    del tag.attrs[k]
-                except Exception:
-                    pass
-        # keep classes only for step-number and extracted-quote
-        if tag.has_attr('class'):
-            classes = [c for c in tag.get('class', []) if c in ('step-number','extracted-quote')]
-            if classes:
-                tag['class'] = classes
-            else:
-                del tag.attrs['class']
 
-    # Now aggressively sanitize: keep only structural textual elements and their textual content.
-    def sanitize_fragment(fragment: BeautifulSoup) -> BeautifulSoup:
-        from bs4 import NavigableString, Tag
+class TextIndex:
+    """Stripped text of every tag in one or more subtrees, collected in one iterative walk.
 
-        allowed_tags = set(['h1','h2','h3','h4','h5','p','ul','ol','li','blockquote','figure','figcaption','details','summary'])
+    ``text(node, sep)`` returns the same string as ``node.get_text(sep, strip=True)``
+    without rescanning the subtree, and ``text_len`` answers the length without
+    joining at all. Unwanted tags and comments are skipped as if removed.
+    """
 
-        out_soup = BeautifulSoup('', 'html.parser')
-        container = out_soup.new_tag('div')
-        out_soup.append(container)
+    def __init__(self, *roots):
+        self.strings: list[str] = []
+        self.offsets = [0]
+        self.ranges: dict[int, tuple[int, int]] = {}
+        self.preorder: dict[int, tuple[int, int]] = {}
+        self.step_positions: list[int] = []
+        self.step_spans: list[Tag] = []
+        self._counter = 0
+        for root in roots:
+            self.add(root)
 
-        def append_paragraph(parent, text):
-            text = text.strip()
-            if not text:
-                return
-            parts = [s.strip() for s in re.split(r"\n\s*\n", text) if s.strip()]
-            for part in parts:
-                p = out_soup.new_tag('p')
-                p.string = part
-                parent.append(p)
+    def add(self, root) -> None:
+        """Index one more subtree (roots are expected in document order)."""
+        counter = self._counter
+        stack = [(root, None)]
+        while stack:
+            node, entered = stack.pop()
+            if entered is not None:
+                self.ranges[id(node)] = (entered[0], len(self.strings))
+                self.preorder[id(node)] = (entered[1], counter)
+                continue
+            if isinstance(node, NavigableString):
+                if type(node) in TEXT_STRING_TYPES:
+                    s = node.strip()
+                    if s:
+                        self.strings.append(s)
+                        self.offsets.append(self.offsets[-1] + len(s))
+                continue
+            if not isinstance(node, Tag) or (node is not root and node.name in UNWANTED_TAGS):
+                continue
+            counter += 1
+            if node.name == 'span' and 'step-number' in kept_classes(node):
+                self.step_positions.append(counter)
+                self.step_spans.append(node)
+            stack.append((node, (len(self.strings), counter)))
+            stack.extend((ch, None) for ch in reversed(node.contents))
+        self._counter = counter
+
+    def _range(self, node):
+        types = getattr(node, 'interesting_string_types', None)
+        if types is not None and types != TEXT_STRING_TYPES:
+            return None
+        return self.ranges.get(id(node))
+
+    def text(self, node, sep: str = ' ') -> str:
+        r = self._range(node)
+        if r is None:
+            return node.get_text(separator=sep, strip=True)
+        return sep.join(self.strings[r[0]:r[1]])
+
+    def text_len(self, node) -> int:
+        r = self._range(node)
+        if r is None:
+            return len(node.get_text(separator=' ', strip=True))
+        a, b = r
+        return self.offsets[b] - self.offsets[a] + max(b - a - 1, 0)
+
+    def first_step_span(self, node) -> Tag | None:
+        """First descendant span.step-number of node, like the first hit of find_all('span')."""
+        r = self.preorder.get(id(node))
+        if r is None:
+            return None
+        i = bisect.bisect_right(self.step_positions, r[0])
+        if i < len(self.step_positions) and self.step_positions[i] <= r[1]:
+            return self.step_spans[i]
+        return None
+
+
+def is_heading_text(t: str) -> bool:
+    if not t:
+        return False
+    t = t.strip()
+    if len(t) > 140:
+        return False
+    if 'Ступень' in t or t.startswith('Зачем') or t.startswith('Метод') or t.startswith('Обязательный'):
+        return True
+    if t.isupper() and len(t) > 4:
+        return True
+    if re.match(r'^\s*\d+\.?\s*$', t):
+        return True
+    return False
+
+
+def is_short_heading_text_candidate(t: str) -> bool:
+    if not t:
+        return False
+    t = t.strip()
+    if len(t) < 4 or len(t) > 140:
+        return False
+    # prefer strings without sentence-ending punctuation and not long multi-sentence
+    if t.count('.') > 1 or t.count('?') or t.count('!'):
+        # allow one punctuation but avoid multi-sentence lines
+        if t.count('.') > 1:
+            return False
+    # few words (heuristic): headings are usually compact
+    if len(t.split()) > 12:
+        return False
+    return True
+
+
+class SectionSanitizer:
+    """Keep only structural textual elements and their textual content, grouped into div.section blocks.
+
+    Top-level nodes are fed in document order, possibly across several fragments;
+    unwanted tags, attributes and classes are dropped while walking, so the input
+    does not need a separate cleanup pass first. The last node of every feed is held
+    back until the next one arrives, because the heading heuristics look one
+    sibling ahead. ``take_output()`` hands back the finished part of the result as
+    HTML and drops it from the tree, which is what --stream uses to keep memory flat.
+    With collect_sections=True it also appends what it hands back to ``sections``,
+    in the section model (see section_ir()), for the Markdown and JSON outputs.
+    ``images`` (a responsive_images.ResponsiveImages) rewrites every kept <img>.
+    """
+
+    SECTION_OPEN = '<div class="section">'
+    SECTION_CLOSE = '</div>'
+
+    def __init__(self, collect_sections: bool = False, images=None):
+        self.out_soup = BeautifulSoup('', 'html.parser')
+        self.container = self.out_soup.new_tag('div')
+        self.out_soup.append(self.container)
+        self.pending = []
+        self.index = None
+        # Group content into sections when h2 or explicit headings encountered
+        self.current_section = self.new_section()
+        self._started = False
+        self._open_section = None
+        self.sections: list[dict] | None = [] if collect_sections else None
+        self.images = images
+
+    def new_section(self) -> Tag:
+        section = self.out_soup.new_tag('div')
+        section['class'] = 'section'
+        self.container.append(section)
+        self.current_section = section
+        return section
+
+    def feed(self, nodes) -> None:
+        children = self.pending + [ch for ch in nodes if not is_unwanted(ch)]
+        self.index = TextIndex(*children)
+        i = self._run(children, len(children) - 1)
+        # detach the held-back node so its source document can be freed
+        self.pending = [ch.extract() for ch in children[i:]]
+
+    def close(self) -> None:
+        children, self.pending = self.pending, []
+        self.index = TextIndex(*children)
+        self._run(children, len(children))
+
+    def text(self, node, sep: str = ' ') -> str:
+        return self.index.text(node, sep)
+
+    def append_paragraph(self, parent, text):
+        text = text.strip()
+        if not text:
+            return
+        parts = [s.strip() for s in re.split(r"\n\s*\n", text) if s.strip()]
+        for part in parts:
+            p = self.out_soup.new_tag('p')
+            p.string = part
+            parent.append(p)
+
+    def process_node(self, node, parent_out):
+        out_soup = self.out_soup
+        text = self.text
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if is_unwanted(node):
+                continue
 
-        def process_node(node, parent_out):
             # NavigableString -> append to a paragraph in parent_out
             if isinstance(node, NavigableString):
-                append_paragraph(parent_out, str(node))
-                return
+                self.append_paragraph(parent_out, str(node))
+                continue
 
             if not isinstance(node, Tag):
-                return
+                continue
 
             name = node.name.lower()
             if name in ('p',):
                 # preserve the paragraph as-is (text-only)
-                append_paragraph(parent_out, node.get_text(separator='\n', strip=True))
-                return
+                self.append_paragraph(parent_out, text(node, '\n'))
+                continue
 
-            if name in ('blockquote',) or 'quote' in ' '.join(node.get('class', [])) or 'extracted-quote' in (node.get('class') or []):
+            classes = kept_classes(node)
+            if name in ('blockquote',) or 'quote' in ' '.join(classes) or 'extracted-quote' in classes:
                 bq = out_soup.new_tag('blockquote')
                 bq['class'] = 'extracted-quote'
                 # preserve paragraphs inside blockquote
                 for ch in node.contents:
+                    if is_unwanted(ch):
+                        continue
                     if isinstance(ch, NavigableString):
-                        append_paragraph(bq, str(ch))
-                    elif isinstance(ch, Tag) and ch.name.lower() == 'p':
-                        append_paragraph(bq, ch.get_text(separator='\n', strip=True))
+                        self.append_paragraph(bq, str(ch))
                     else:
-                        append_paragraph(bq, ch.get_text(separator='\n', strip=True))
+                        self.append_paragraph(bq, text(ch, '\n'))
                 parent_out.append(bq)
-                return
+                continue
 
-            if name in ('h1','h2','h3','h4','h5'):
+            if name in HEADING_TAGS:
                 newh = out_soup.new_tag(name)
-                newh.string = node.get_text(separator=' ', strip=True)
+                newh.string = text(node)
                 parent_out.append(newh)
-                return
+                continue
 
-            if name in ('ul','ol'):
+            if name in ('ul', 'ol'):
                 newlist = out_soup.new_tag(name)
-                for li in node.find_all('li', recursive=False):
-                    newli = out_soup.new_tag('li')
-                    newli.string = li.get_text(separator=' ', strip=True)
-                    newlist.append(newli)
+                for li in node.contents:
+                    if isinstance(li, Tag) and li.name == 'li':
+                        newli = out_soup.new_tag('li')
+                        newli.string = text(li)
+                        newlist.append(newli)
                 parent_out.append(newlist)
-                return
+                continue
 
             if name == 'figure':
                 newfig = out_soup.new_tag('figure')
@@ -384,145 +739,91 @@ def main(argv=None):
                 if img and img.has_attr('src'):
                     newimg = out_soup.new_tag('img')
                     newimg['src'] = img['src']
+                    if self.images is not None:
+                        self.images.rewrite(newimg)
                     newfig.append(newimg)
                 figcap = node.find('figcaption')
                 if figcap:
                     newcap = out_soup.new_tag('figcaption')
-                    newcap.string = figcap.get_text(separator=' ', strip=True)
+                    newcap.string = text(figcap)
                     newfig.append(newcap)
                 parent_out.append(newfig)
-                return
-
-            # For other tags: recurse into children and preserve paragraphs inside
-            for ch in node.contents:
-                process_node(ch, parent_out)
-
-        # Start from fragment root — if it's wrapper div, iterate its children
-        root = fragment
-        if len(fragment.contents) == 1 and isinstance(fragment.contents[0], Tag) and fragment.contents[0].name == 'div':
-            root = fragment.contents[0]
-
-
-        # Helper: heading heuristic for span text
-        def is_heading_text(t: str) -> bool:
-            if not t:
-                return False
-            t = t.strip()
-            if len(t) > 140:
-                return False
-            if 'Ступень' in t or t.startswith('Зачем') or t.startswith('Метод') or t.startswith('Обязательный'):
-                return True
-            if t.isupper() and len(t) > 4:
-                return True
-            if re.match(r'^\s*\d+\.?\s*$', t):
-                return True
-            return False
+                continue
 
-        # Group content into sections when h2 or explicit headings encountered
-        current_section = out_soup.new_tag('div')
-        current_section['class'] = 'section'
-        container.append(current_section)
+            # For other tags: walk into children and preserve paragraphs inside
+            stack.extend(reversed(node.contents))
 
-        children = list(root.contents)
+    def _run(self, children: list, stop: int) -> int:
+        """Process children[i] for i < stop (children[stop:] is lookahead only); returns where it stopped."""
+        out_soup = self.out_soup
+        index = self.index
+        text = self.text
         i = 0
-        def is_short_heading_text_candidate(t: str) -> bool:
-            if not t:
-                return False
-            t = t.strip()
-            if len(t) < 4 or len(t) > 140:
-                return False
-            # prefer strings without sentence-ending punctuation and not long multi-sentence
-            if t.count('.') > 1 or t.count('?') or t.count('!'):
-                # allow one punctuation but avoid multi-sentence lines
-                if t.count('.') > 1:
-                    return False
-            # few words (heuristic): headings are usually compact
-            if len(t.split()) > 12:
-                return False
-            return True
-
-        while i < len(children):
+        while i < stop:
             ch = children[i]
             # If current node contains a span.step-number (explicit), synthesize H2
             if isinstance(ch, Tag):
                 # look for explicit step-number span (only treat explicit step-number spans as headings)
-                heading_span = None
-                for s in ch.find_all('span'):
-                    if any('step-number' in c for c in (s.get('class') or [])):
-                        heading_span = s
-                        break
+                heading_span = index.first_step_span(ch)
                 if heading_span is not None:
                     # assemble heading text: span text + following small inline text from ch
-                    span_text = heading_span.get_text(separator=' ', strip=True)
+                    span_text = text(heading_span)
                     # remaining text in node excluding the span's text
-                    node_text = ch.get_text(separator=' ', strip=True)
+                    node_text = text(ch)
                     rest = node_text.replace(span_text, '', 1).strip()
-                    h2txt = span_text + ((' ' + rest) if rest else '')
-                    current_section = out_soup.new_tag('div')
-                    current_section['class'] = 'section'
-                    container.append(current_section)
+                    section = self.new_section()
                     newh = out_soup.new_tag('h2')
                     # preserve the span as inner element
                     newspan = out_soup.new_tag('span')
-                    newspan['class'] = ['step-number'] if 'step-number' in (heading_span.get('class') or []) else None
+                    newspan['class'] = ['step-number']
                     newspan.string = span_text
                     newh.append(newspan)
                     if rest:
                         newh.append(out_soup.new_string(' ' + rest))
-                    current_section.append(newh)
+                    section.append(newh)
                     i += 1
                     continue
 
                 # Heuristic A: short standalone text in its own container (div/p with only inline children)
-                txt_only = ch.get_text(separator=' ', strip=True)
+                # (anything over 140 chars can't be a heading, so skip building the string)
+                txt_only = text(ch) if index.text_len(ch) <= 140 else None
                 if is_short_heading_text_candidate(txt_only):
                     # ensure node is essentially a short title: has no block children like ul/ol/figure
-                    block_children = any(c.name.lower() in ('ul','ol','figure','table','pre','blockquote') for c in ch.find_all(True, recursive=False))
+                    block_children = any(isinstance(c, Tag) and not is_unwanted(c) and c.name.lower() in ('ul','ol','figure','table','pre','blockquote') for c in ch.contents)
                     if not block_children:
-                        current_section = out_soup.new_tag('div')
-                        current_section['class'] = 'section'
-                        container.append(current_section)
                         newh = out_soup.new_tag('h2')
                         newh.string = txt_only
-                        current_section.append(newh)
+                        self.new_section().append(newh)
                         i += 1
                         continue
 
                 # Heuristic B: <strong> or <b> followed by <br> or short sibling -> synthesize heading
-                strong = ch.find(['strong','b'], recursive=False)
-                attached = False
-                if strong and strong.get_text(strip=True):
+                strong = next((c for c in ch.contents if isinstance(c, Tag) and c.name in ('strong', 'b')), None)
+                if strong and text(strong):
                     # prefer inline <br> inside same node or a following short text sibling
-                    br_inside = any(c.name == 'br' for c in ch.find_all(True, recursive=False))
+                    br_inside = any(isinstance(c, Tag) and c.name == 'br' for c in ch.contents)
                     nxt = children[i+1] if i+1 < len(children) else None
                     nxt_txt = None
                     if br_inside:
                         # gather remaining text in ch after strong
-                        full = ch.get_text(separator=' ', strip=True)
-                        rest = full.replace(strong.get_text(separator=' ', strip=True), '', 1).strip()
+                        full = text(ch)
+                        rest = full.replace(text(strong), '', 1).strip()
                         nxt_txt = rest
                     elif nxt is not None:
                         if isinstance(nxt, NavigableString):
                             nxt_txt = str(nxt).strip()
                         elif isinstance(nxt, Tag) and nxt.name.lower() in ('p','div','span'):
-                            nxt_txt = nxt.get_text(separator=' ', strip=True)
+                            nxt_txt = text(nxt)
                     if nxt_txt and is_short_heading_text_candidate(nxt_txt):
-                        h2txt = strong.get_text(separator=' ', strip=True)
-                        if nxt_txt:
-                            h2txt = h2txt + ' ' + nxt_txt
-                        current_section = out_soup.new_tag('div')
-                        current_section['class'] = 'section'
-                        container.append(current_section)
                         newh = out_soup.new_tag('h2')
                         # preserve strong as inline element
                         newstrong = out_soup.new_tag(strong.name)
-                        newstrong.string = strong.get_text(separator=' ', strip=True)
+                        newstrong.string = text(strong)
                         newh.append(newstrong)
-                        if nxt_txt:
-                            newh.append(out_soup.new_string(' ' + nxt_txt))
-                        current_section.append(newh)
+                        newh.append(out_soup.new_string(' ' + nxt_txt))
+                        self.new_section().append(newh)
                         # if we consumed next sibling text node, skip it
-                        if isinstance(nxt, (NavigableString, Tag)) and nxt_txt:
+                        if isinstance(nxt, (NavigableString, Tag)):
                             i += 2
                         else:
                             i += 1
@@ -530,29 +831,23 @@ def main(argv=None):
 
                 # Heuristic C: short ALL CAPS line
                 if txt_only and txt_only.isupper() and is_short_heading_text_candidate(txt_only):
-                    current_section = out_soup.new_tag('div')
-                    current_section['class'] = 'section'
-                    container.append(current_section)
                     newh = out_soup.new_tag('h2')
                     newh.string = txt_only
-                    current_section.append(newh)
+                    self.new_section().append(newh)
                     i += 1
                     continue
             # explicit h2 -> new section
             if isinstance(ch, Tag) and ch.name.lower() == 'h2':
-                current_section = out_soup.new_tag('div')
-                current_section['class'] = 'section'
-                container.append(current_section)
                 newh = out_soup.new_tag('h2')
-                newh.string = ch.get_text(separator=' ', strip=True)
-                current_section.append(newh)
+                newh.string = text(ch)
+                self.new_section().append(newh)
                 i += 1
                 continue
 
             # span.step-number or short heading-span: synthesize an H2 combining this span and the next text/sibling
-            if isinstance(ch, Tag) and ch.name.lower() in ('span',) and ('step-number' in (ch.get('class') or []) or is_heading_text(ch.get_text(separator=' ', strip=True))):
+            if isinstance(ch, Tag) and ch.name.lower() in ('span',) and ('step-number' in kept_classes(ch) or is_heading_text(text(ch))):
                 # collect heading pieces
-                parts = [ch.get_text(separator=' ', strip=True)]
+                parts = [text(ch)]
                 # look ahead for a short text node or tag to attach (skip if it's another span.step-number)
                 nxt = children[i+1] if i+1 < len(children) else None
                 attached = False
@@ -563,21 +858,18 @@ def main(argv=None):
                             parts.append(txt)
                             attached = True
                     elif isinstance(nxt, Tag) and nxt.name.lower() in ('strong','b','span'):
-                        t2 = nxt.get_text(separator=' ', strip=True)
+                        t2 = text(nxt)
                         if t2 and len(t2) < 200:
                             parts.append(t2)
                             attached = True
 
                 h2txt = ' '.join([p for p in parts if p])
-                current_section = out_soup.new_tag('div')
-                current_section['class'] = 'section'
-                container.append(current_section)
                 newh = out_soup.new_tag('h2')
                 # preserve step-number as inner span if present
-                if 'step-number' in (ch.get('class') or []):
+                if 'step-number' in kept_classes(ch):
                     sp = out_soup.new_tag('span')
                     sp['class'] = ['step-number']
-                    sp.string = ch.get_text(separator=' ', strip=True)
+                    sp.string = text(ch)
                     newh.append(sp)
                     # append remaining text
                     rest = h2txt[len(sp.string):].strip()
@@ -585,28 +877,1197 @@ def main(argv=None):
                         newh.append(out_soup.new_string(' ' + rest))
                 else:
                     newh.string = h2txt
-                current_section.append(newh)
+                self.new_section().append(newh)
                 # if we consumed next sibling, skip it
                 i += 2 if attached else 1
                 continue
 
             # Otherwise process node into current section
-            process_node(ch, current_section)
+            self.process_node(ch, self.current_section)
             i += 1
+        return i
+
+    def take_output(self, final: bool = False) -> str:
+        """Serialize everything finished so far and remove it from the tree.
+
+        Concatenating all the pieces gives exactly ``str(self.out_soup)``. Pass
+        final=True after close() to get the closing tags as well.
+        """
+        pieces = []
+        if not self._started:
+            pieces.append('<div>')
+            self._started = True
+        for section in list(self.container.contents):
+            is_current = section is self.current_section and not final
+            if section is not self._open_section:
+                pieces.append(self.SECTION_OPEN)
+                if self.sections is not None:
+                    self.sections.append(new_section_ir())
+            for ch in list(section.contents):
+                pieces.append(str(ch))
+                if self.sections is not None:
+                    add_to_section_ir(self.sections[-1], ch)
+                ch.decompose()
+            if is_current:
+                self._open_section = section
+                break
+            pieces.append(self.SECTION_CLOSE)
+            section.decompose()
+        if final:
+            pieces.append('</div>')
+        return ''.join(pieces)
+
+
+def sanitize_fragment(fragment: BeautifulSoup, images=None) -> BeautifulSoup:
+    """Sanitize a whole fragment in one go; see SectionSanitizer."""
+    # Start from fragment root — if it's wrapper div, iterate its children
+    root = fragment
+    if len(fragment.contents) == 1 and isinstance(fragment.contents[0], Tag) and fragment.contents[0].name == 'div':
+        root = fragment.contents[0]
+
+    sanitizer = SectionSanitizer(images=images)
+    sanitizer.feed(list(root.contents))
+    sanitizer.close()
+    return sanitizer.out_soup
+
+
+# The section model: what sanitize_fragment() keeps, as plain data. One output is a list
+# of sections, each {'heading': str | None, 'step': str | None, 'blocks': [...]} where a
+# block is one of
+#   {'type': 'paragraph', 'text': str}
+#   {'type': 'heading', 'level': 1-5, 'text': str}
+#   {'type': 'quote', 'paragraphs': [str, ...]}
+#   {'type': 'list', 'ordered': bool, 'items': [str, ...]}
+#   {'type': 'figure', 'src': str | None, 'width': int | None, 'height': int | None, 'caption': str | None}
+# ``step`` is the step number of a "span.step-number" heading. The HTML output is the
+# sanitized tree itself; the Markdown and JSON outputs are rendered from this model.
+
+def ir_text(node) -> str:
+    # as a browser would show it: runs of spaces/tabs collapse, blank lines and indentation go
+    lines = (' '.join(line.split()) for line in node.get_text().split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def new_section_ir() -> dict:
+    return {'heading': None, 'step': None, 'blocks': []}
+
+
+def block_ir(node) -> dict | None:
+    """One top-level node of a sanitized section as a block (None for empty/unknown nodes)."""
+    if not isinstance(node, Tag):
+        text = ' '.join(str(node).split())
+        return {'type': 'paragraph', 'text': text} if text else None
+    name = node.name
+    if name == 'p':
+        text = ir_text(node)
+        return {'type': 'paragraph', 'text': text} if text else None
+    if name in HEADING_TAGS:
+        return {'type': 'heading', 'level': int(name[1]), 'text': ir_text(node)}
+    if name == 'blockquote':
+        return {'type': 'quote', 'paragraphs': [ir_text(p) for p in node.find_all('p')]}
+    if name in ('ul', 'ol'):
+        return {'type': 'list', 'ordered': name == 'ol', 'items': [ir_text(li) for li in node.find_all('li')]}
+    if name == 'figure':
+        img = node.find('img')
+        caption = node.find('figcaption')
+        size = [int(img[a]) if img is not None and str(img.get(a, '')).isdigit() else None for a in ('width', 'height')]
+        return {'type': 'figure', 'src': img.get('src') if img else None,
+                'width': size[0], 'height': size[1], 'caption': ir_text(caption) if caption else None}
+    text = node.get_text(' ', strip=True)
+    return {'type': 'paragraph', 'text': text} if text else None
+
+
+def add_to_section_ir(section: dict, node) -> None:
+    # a section opened by sanitize_fragment starts with its h2; that becomes the section heading
+    if isinstance(node, Tag) and node.name == 'h2' and section['heading'] is None and not section['blocks']:
+        section['heading'] = ir_text(node)
+        step = node.find('span', class_='step-number')
+        section['step'] = ir_text(step) if step else None
+        return
+    block = block_ir(node)
+    if block is not None:
+        section['blocks'].append(block)
+
+
+def section_ir(content_soup: BeautifulSoup) -> list[dict]:
+    """The section model of a sanitize_fragment() result; empty sections are left out."""
+    root = content_soup.contents[0] if content_soup.contents else content_soup
+    sections = []
+    for section in root.find_all('div', class_='section', recursive=False):
+        ir = new_section_ir()
+        for ch in section.contents:
+            add_to_section_ir(ir, ch)
+        sections.append(ir)
+    return drop_empty_sections(sections)
+
+
+def drop_empty_sections(sections: list[dict]) -> list[dict]:
+    return [ir for ir in sections if ir['heading'] is not None or ir['blocks']]
+
+
+MD_ESCAPE_RE = re.compile(r"([\\`*_\[\]<>|])")
+# text at the start of a line that Markdown would read as a heading, quote or list marker
+MD_LINE_START_RE = re.compile(r"^(\s*)(#+|>|[-+]|\d+(?=[.)]))", re.M)
+
+
+def md_escape(text: str) -> str:
+    text = MD_ESCAPE_RE.sub(r"\\\1", text)
+    return MD_LINE_START_RE.sub(lambda m: m.group(1) + (m.group(2) + '\\' if m.group(2)[0].isdigit() else '\\' + m.group(2)), text)
+
+
+def render_markdown(title: str, sections: list[dict]) -> str:
+    """A page in the section model as Markdown."""
+    def one_line(text):
+        return ' '.join(text.split())
+
+    out = [f"# {md_escape(one_line(title))}"]
+    for section in sections:
+        if section['heading'] is not None:
+            out.append(f"## {md_escape(one_line(section['heading']))}")
+        for block in section['blocks']:
+            kind = block['type']
+            if kind == 'paragraph':
+                out.append(md_escape(block['text']))
+            elif kind == 'heading':
+                out.append(f"{'#' * block['level']} {md_escape(one_line(block['text']))}")
+            elif kind == 'quote':
+                out.append('\n>\n'.join('\n'.join('> ' + line for line in md_escape(p).split('\n'))
+                                        for p in block['paragraphs']) or '>')
+            elif kind == 'list':
+                out.append('\n'.join(f"{f'{n}.' if block['ordered'] else '-'} {md_escape(one_line(item))}"
+                                     for n, item in enumerate(block['items'], 1)))
+            elif kind == 'figure':
+                if block['src']:
+                    out.append(f"![{md_escape(one_line(block['caption'] or ''))}](<{block['src'].replace('>', '%3E')}>)")
+                if block['caption']:
+                    out.append(f"*{md_escape(one_line(block['caption']))}*")
+    return '\n\n'.join(out) + '\n'
+
+
+def render_json(title: str, sections: list[dict]) -> str:
+    """A page in the section model as JSON: {"title": ..., "sections": [...]}."""
+    return json.dumps({'title': title, 'sections': sections}, ensure_ascii=False, indent=2) + '\n'
+
+
+OUTPUT_FORMATS = ('html', 'md', 'json')
+
+
+def output_paths(output: str, formats=('html',)) -> dict[str, str]:
+    """Where each format of one page goes: the HTML at output itself, the others next to it."""
+    base = os.path.splitext(output)[0]
+    return {fmt: output if fmt == 'html' else f"{base}.{fmt}" for fmt in OUTPUT_FORMATS if fmt in formats}
+
+
+def write_text_outputs(paths: dict[str, str], title: str, sections: list[dict]) -> None:
+    """Write the Markdown and/or JSON outputs of a page from its section model."""
+    renderers = {'md': render_markdown, 'json': render_json}
+    for fmt, path in paths.items():
+        if fmt in renderers:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(renderers[fmt](title, sections))
+
+
+class StageProfiler:
+    """Wall time and tracemalloc peak per named stage, for --profile; a no-op unless enabled.
+
+    ``peak_kb`` is the most memory the stage held on top of what was allocated when it
+    started. Repeated stages (e.g. sanitize in --stream mode) accumulate. Don't nest stages:
+    tracemalloc has a single peak counter.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages: dict[str, dict] = {}
+        self.current = None  # the stage last entered, tracked even when disabled
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        self.current = name
+        if not self.enabled:
+            yield
+            return
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'peak_kb': 0})
+            entry['seconds'] = round(entry['seconds'] + seconds, 6)
+            entry['peak_kb'] = max(entry['peak_kb'], peak // 1024)
+
+
+def count_tags(root) -> int:
+    if isinstance(root, Tag):
+        return sum(1 for _ in root.find_all(True))
+    return sum(1 for el in root.iter() if isinstance(el.tag, str))
+
+
+# cheap pre-check so the lxml-native path isn't tried on pages that can't have div.post
+POST_CLASS_RE = re.compile(r"""class\s*=\s*["'][^"']*(?<![\w-])post(?![\w-])""")
+
+
+class TimeBudgetExceeded(BaseException):
+    """Raised inside an input's extraction when its --time-budget runs out.
+
+    A BaseException so the ``except Exception`` fallbacks along the way (parser
+    selection, readability) let it through to extract_fragment().
+    """
+
+
+@contextlib.contextmanager
+def time_budget(seconds: float | None):
+    """Raise TimeBudgetExceeded in the block once ``seconds`` of wall time have passed.
+
+    Uses SIGALRM, so it only works in the main thread on platforms with setitimer
+    (--jobs workers run their tasks in their main thread); elsewhere it doesn't limit
+    anything. The signal is handled between Python bytecodes, so a single long call into
+    C (lxml parsing a huge document) finishes before the block is interrupted.
+    """
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expired(signum, frame):
+        raise TimeBudgetExceeded(seconds)
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def extract_cheaply(html_text: str, parser: str = "auto"):
+    """The fallback for inputs over their time budget: forum posts or the heuristic scorer, no readability.
+
+    Parses with lxml when it is installed, whatever the chosen parser, since that is the
+    fastest backend. Returns (content_node, title, backend used).
+    """
+    if 'lxml' in html_parsers.available_backends():
+        if POST_CLASS_RE.search(html_text):
+            try:
+                picked = pick_posts_lxml(lxml_document(html_text))
+            except Exception:
+                picked = None
+            if picked is not None:
+                return picked[0], picked[1], 'lxml-native'
+        parser = 'lxml-native'
+    soup = make_soup(html_text, parser)
+    remove_unwanted(soup)
+    content_node, t = pick_main_content(soup, parser, use_readability=False)
+    return content_node, t, html_parsers.backend_name(soup)
+
+
+def extract_fragment(inp: str, out_path: str, profile: bool = False, parser: str = "auto",
+                     memo: FragmentCache | None = None, budget: float | None = None, data: bytes | None = None):
+    """Read one input file and return (content_soup, title, report) with asset URLs rewritten.
+
+    With ``data`` the page's bytes are taken from there instead, and ``inp`` only says where
+    the page lives (for its assets).
+    ``report`` is a small picklable dict of per-input diagnostics for --debug; with
+    profile=True it also carries per-stage timings and node counts. ``memo`` is a cache
+    whose readability summaries may be reused. When parsing and picking the main content
+    take longer than ``budget`` seconds, they are abandoned for extract_cheaply() and the
+    report gets a ``fallback`` entry naming the stage that ran over.
+    """
+    prof = StageProfiler(profile)
+    parser = html_parsers.resolve_parser(parser)
+    parses_before = parse_count
+    runs_before, memo_hits_before = readability_runs, readability_memo_hits
+    with prof.stage('read'):
+        if data is None:
+            with open(inp, 'rb') as f:
+                data = f.read()
+    with prof.stage('decode'):
+        html_text, enc = html_charset.decode_html(data)
+    del data
+
+    fallback = None
+    nodes_parsed = None
+    prof.current = None
+    try:
+        with time_budget(budget):
+            picked = None
+            if parser == 'lxml-native' and POST_CLASS_RE.search(html_text):
+                try:
+                    with prof.stage('parse'):
+                        root = lxml_document(html_text)
+                    nodes_parsed = count_tags(root) if profile else None
+                    with prof.stage('pick_main_content'):
+                        picked = pick_posts_lxml(root)
+                except Exception:
+                    # lxml couldn't take this page; the soup path below falls back to other backends
+                    picked = None
+                root = None
+            if picked is not None:
+                content_node, t = picked
+                used = 'lxml-native'
+            else:
+                with prof.stage('parse'):
+                    soup = make_soup(html_text, parser)
+                nodes_parsed = count_tags(soup) if profile else None
+                used = html_parsers.backend_name(soup)
+                with prof.stage('remove_unwanted'):
+                    remove_unwanted(soup)
+
+                with prof.stage('pick_main_content'):
+                    content_node, t = pick_main_content(soup, parser, memo)
+    except TimeBudgetExceeded:
+        fallback = {'stage': prof.current or 'parse', 'budget': budget}
+        soup = root = None  # let the abandoned tree go before parsing again
+        with prof.stage('fallback'):
+            content_node, t, used = extract_cheaply(html_text, parser)
+
+    # Ensure we have a soup fragment: move the picked node into a fresh document
+    if not isinstance(content_node, BeautifulSoup):
+        content_soup = BeautifulSoup('', 'html.parser')
+        content_soup.append(content_node.extract())
+    else:
+        content_soup = content_node
+
+    # Rewrite asset urls relative to this input file
+    with prof.stage('rewrite_urls'):
+        rewrite_asset_urls(content_soup, inp, out_path)
+    report = {'input': inp, 'encoding': enc, 'parser': used, 'reparses': parse_count - parses_before - 1}
+    if readability_memo_hits > memo_hits_before:
+        report['readability'] = 'memo'
+    elif readability_runs > runs_before:
+        report['readability'] = 'ran'
+    if fallback is not None:
+        report['fallback'] = fallback
+    if profile:
+        report['stages'] = prof.stages
+        report['nodes'] = {'parsed': nodes_parsed, 'extracted': count_tags(content_soup)}
+    return content_soup, t, report
+
+
+def fragment_children(content_soup: BeautifulSoup) -> list:
+    return list(content_soup.body.contents if getattr(content_soup, 'body', None) else content_soup.contents)
+
+
+def _extract_fragment_html(job: tuple) -> tuple[str, str | None, dict]:
+    # Worker entry point for --jobs: soups don't pickle cheaply, so ship the fragment back as HTML
+    content_soup, t, report = extract_fragment(*job)
+    html = ''.join(str(child) for child in fragment_children(content_soup))
+    return html, (None if t is None else str(t)), report
+
+
+class QuoteIndex:
+    """Quotes seen so far across all inputs, for dropping repeats.
+
+    Exact repeats (after whitespace normalization) are always dropped. With a
+    similarity threshold below 1.0, near-duplicates are dropped too. Each quote
+    becomes a set of word 3-gram shingles with a 64-value MinHash signature.
+    The signature uses one-permutation hashing: each shingle's 64-bit hash picks a
+    bin and competes for that bin's minimum, and empty bins borrow from the next
+    filled one. That is one hash per shingle instead of 64.
+    The signature is split into 32 LSH bands of 2 values. A quote is compared
+    only with earlier quotes that share at least one band, so each check takes
+    about the same time however many quotes have been seen. A quote counts as a
+    repeat when its estimated Jaccard similarity or its containment in an
+    earlier quote (which catches truncated re-quotes) reaches the threshold.
+    Hashes are seeded, so the same inputs always give the same output.
+    """
+
+    NUM_PERM = 64
+    BAND_ROWS = 2
+    SHINGLE = 3
+
+    def __init__(self, threshold: float = 1.0):
+        self.threshold = threshold
+        self.exact: set[str] = set()
+        self.buckets: dict[tuple, list[int]] = {}
+        self.signatures: list[tuple[tuple[int, ...], int]] = []
+        self.kept = 0
+        self.dropped_exact = 0
+        self.dropped_near = 0
+
+    def _shingles(self, qtext: str) -> set[int]:
+        words = qtext.lower().split()
+        k = self.SHINGLE
+        grams = [' '.join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))]
+        return {int.from_bytes(hashlib.blake2b(g.encode('utf-8'), digest_size=8).digest(), 'big') for g in grams}
+
+    def _signature(self, shingles: set[int]) -> tuple[int, ...]:
+        n = self.NUM_PERM
+        bins = [None] * n
+        for x in shingles:
+            b, v = x % n, x // n
+            if bins[b] is None or v < bins[b]:
+                bins[b] = v
+        sig = []
+        for i in range(n):
+            j = i
+            while bins[j % n] is None:
+                j += 1
+            # borrowed values are offset by the distance so they don't collide with real ones
+            sig.append(bins[j % n] + ((j - i) << 58))
+        return tuple(sig)
+
+    def is_duplicate(self, qtext: str) -> bool:
+        """Return True if qtext repeats an earlier quote; otherwise remember it and return False."""
+        if qtext in self.exact:
+            self.dropped_exact += 1
+            return True
+        self.exact.add(qtext)
+        if self.threshold >= 1.0:
+            self.kept += 1
+            return False
+
+        shingles = self._shingles(qtext)
+        sig = self._signature(shingles)
+        rows = self.BAND_ROWS
+        bands = [(i, sig[i:i + rows]) for i in range(0, self.NUM_PERM, rows)]
+        checked = set()
+        for band in bands:
+            for cand in self.buckets.get(band, ()):
+                if cand in checked:
+                    continue
+                checked.add(cand)
+                other, other_size = self.signatures[cand]
+                jaccard = sum(1 for x, y in zip(sig, other) if x == y) / self.NUM_PERM
+                # |A n B| = J / (1 + J) * (|A| + |B|); containment is relative to the new quote
+                containment = jaccard / (1 + jaccard) * (len(shingles) + other_size) / len(shingles)
+                if max(jaccard, containment) >= self.threshold:
+                    self.dropped_near += 1
+                    return True
+
+        idx = len(self.signatures)
+        self.signatures.append((sig, len(shingles)))
+        for band in bands:
+            self.buckets.setdefault(band, []).append(idx)
+        self.kept += 1
+        return False
+
+
+def process_quotes(content_soup: BeautifulSoup, quotes: QuoteIndex) -> None:
+    # Process quote-boxes: dedupe across files and normalize to <blockquote class='extracted-quote'>
+    for q in content_soup.select('.quote-box'):
+        qtext = ' '.join(q.get_text(separator=' ', strip=True).split())
+        if not qtext:
+            q.decompose()
+            continue
+        if quotes.is_duplicate(qtext):
+            q.decompose()
+        else:
+            newb = content_soup.new_tag('blockquote')
+            newb['class'] = 'extracted-quote'
+            newp = content_soup.new_tag('p')
+            newp.string = qtext
+            newb.append(newp)
+            q.replace_with(newb)
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _dir_listing(path: str) -> list:
+    """Sorted [name, size] of the files in a directory; empty when it doesn't exist."""
+    try:
+        with os.scandir(path) as entries:
+            return sorted([e.name, e.stat().st_size] for e in entries if e.is_file())
+    except OSError:
+        return []
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'clean_html')
+
+
+class FragmentCache:
+    """On-disk cache of extracted fragments, keyed by content rather than mtimes.
+
+    A fragment key covers the input bytes, where the input and output live (asset URLs
+    are relative between them), the listing of the input's asset directory, the
+    installed parsers and the sources of PIPELINE_MODULES. Entries are JSON files holding the
+    fragment HTML as it was before quote dedupe, which stays a cross-file step.
+
+    The same directory memoizes readability summaries by the hash of the (pruned) document
+    readability is given, so they survive changes to these modules and to the asset folders.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._env = None
+
+    def _environment(self) -> list:
+        if self._env is None:
+            import importlib.util
+            import bs4
+
+            here = os.path.dirname(os.path.abspath(__file__))
+            self._env = [
+                [_file_sha256(os.path.join(here, name + '.py')) for name in PIPELINE_MODULES],
+                bs4.__version__,
+                [name for name in ('lxml', 'html5lib', 'readability') if importlib.util.find_spec(name)],
+            ]
+        return self._env
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, kind, key[:2], key + '.json')
+
+    def _load(self, path: str):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path: str, data) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def fragment_key(self, inp: str, out_path: str, parser: str = "auto") -> str:
+        src_dir = os.path.dirname(inp)
+        parts = [
+            self._environment(),
+            html_parsers.resolve_parser(parser),
+            _file_sha256(inp),
+            os.path.abspath(inp),
+            os.path.abspath(os.path.dirname(out_path) or os.curdir),
+            get_asset_index(src_dir).fingerprint(),
+        ]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        entry = self._load(self._path('fragments', key))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['html'], entry['title'], dict(entry['report'], cache='hit')
 
-        return out_soup
+    def put(self, key: str, html: str, title: str | None, report: dict) -> None:
+        report = {k: v for k, v in report.items() if k not in ('stages', 'nodes', 'readability')}
+        self._store(self._path('fragments', key), {'html': html, 'title': title, 'report': report})
 
-    # Sanitize the aggregated content
-    content_soup = sanitize_fragment(aggregate)
+    def summary_key(self, html: str) -> str:
+        from importlib.metadata import PackageNotFoundError, version
 
-    # Build output
-    out_title = args.title or title or os.path.splitext(os.path.basename(args.inputs[0]))[0]
-    out_html = build_output_html(out_title, str(content_soup))
+        try:
+            readability_version = version('readability-lxml')
+        except PackageNotFoundError:
+            readability_version = None
+        return hashlib.sha256(json.dumps([readability_version, html]).encode('utf-8')).hexdigest()
+
+    def get_summary(self, key: str):
+        entry = self._load(self._path('readability', key))
+        return None if entry is None else (entry['summary'], entry['title'])
+
+    def put_summary(self, key: str, summary: str, title: str | None) -> None:
+        self._store(self._path('readability', key), {'summary': summary, 'title': title})
+
+    def output_key(self, fragment_keys: list[str], *options) -> str:
+        return hashlib.sha256(json.dumps([fragment_keys, *options]).encode('utf-8')).hexdigest()
+
+    def _stamp_path(self, out_path: str) -> str:
+        return self._path('outputs', hashlib.sha256(os.path.abspath(out_path).encode('utf-8')).hexdigest())
+
+    def output_up_to_date(self, out_path: str, run_key: str, images_dir: str | None = None) -> bool:
+        """True when out_path was last written by a run with this key and hasn't been touched since.
+
+        With ``images_dir`` (the page's responsive image folder) its file listing must be
+        unchanged too, so a deleted or emptied folder gets the images written again.
+        """
+        stamp = self._load(self._stamp_path(out_path))
+        if not stamp or stamp.get('key') != run_key or not os.path.exists(out_path):
+            return False
+        if images_dir is not None and stamp.get('images') != _dir_listing(images_dir):
+            return False
+        return stamp.get('sha256') == _file_sha256(out_path)
+
+    def record_output(self, out_path: str, run_key: str, images_dir: str | None = None) -> None:
+        stamp = {'key': run_key, 'sha256': _file_sha256(out_path)}
+        if images_dir is not None:
+            stamp['images'] = _dir_listing(images_dir)
+        self._store(self._stamp_path(out_path), stamp)
+
+
+def iter_fragments(inputs: list[str], out_path: str, jobs: int = 1, cache: FragmentCache | None = None,
+                   keys: list[str] | None = None, profile: bool = False, parser: str = "auto",
+                   budget: float | None = None):
+    """Yield (content_soup, title, report) per input, in input order.
+
+    With jobs > 1 the extraction runs in a process pool; fragments come back as HTML
+    and are reparsed here so quote dedupe still happens serially in input order.
+    With a cache, hits are served from disk and only the misses are extracted. Fragments
+    that fell back to the cheap extractor aren't cached, so a later run tries again.
+    """
+    if cache is not None and keys is None:
+        keys = [cache.fragment_key(inp, out_path, parser) for inp in inputs]
+    cached = {}
+    if cache is not None:
+        for i, key in enumerate(keys):
+            entry = cache.get(key)
+            if entry is not None:
+                cached[i] = entry
+    todo = [i for i in range(len(inputs)) if i not in cached]
+
+    def reparse(html: str, report: dict):
+        # Parsing shipped/cached HTML back into a soup is real work in this process; profile it too
+        prof = StageProfiler(profile)
+        prof.stages = dict(report.get('stages', {}))
+        with prof.stage('reparse'):
+            soup = BeautifulSoup(html, 'html.parser')
+        return soup, (dict(report, stages=prof.stages) if profile else report)
+
+    if jobs <= 1 or len(todo) < 2:
+        for i, inp in enumerate(inputs):
+            if i in cached:
+                html, t, report = cached[i]
+                content_soup, report = reparse(html, report)
+                yield content_soup, t, report
+                continue
+            content_soup, t, report = extract_fragment(inp, out_path, profile, parser, cache, budget)
+            if cache is not None and 'fallback' not in report:
+                html = ''.join(str(child) for child in fragment_children(content_soup))
+                cache.put(keys[i], html, None if t is None else str(t), report)
+                report = dict(report, cache='miss')
+            yield content_soup, t, report
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as pool:
+        results = pool.map(_extract_fragment_html, [(inputs[i], out_path, profile, parser, cache, budget) for i in todo])
+        for i in range(len(inputs)):
+            if i in cached:
+                html, t, report = cached[i]
+            else:
+                html, t, report = next(results)
+                if cache is not None and 'fallback' not in report:
+                    cache.put(keys[i], html, t, report)
+                    report = dict(report, cache='miss')
+            content_soup, report = reparse(html, report)
+            yield content_soup, t, report
+
+
+def build_page(inputs: list[str], output: str, title: str | None = None, jobs: int = 1,
+               cache: FragmentCache | None = None, debug: bool = False, stream: bool = False,
+               quote_similarity: float = 1.0, profile: bool = False, parser: str = "auto",
+               budget: float | None = None, formats=('html',), image_widths=None) -> dict:
+    """Build one output page from its inputs.
+
+    Returns a summary dict: ``status`` is "written" or "up to date", plus quote counts,
+    the parser backends that were used and the inputs that went over the per-input time
+    ``budget`` (``fallbacks``). A page with fallbacks isn't recorded as up to date.
+    With stream=True each input is sanitized and written out as soon as it has been
+    extracted, instead of aggregating every input into one tree first.
+    With profile=True the summary also has a ``profile`` entry: per-input reports
+    (stage timings, node counts) and the page-level sanitize/write stages.
+    ``formats`` picks the files written (see output_paths()); all of them come from
+    the same sanitized sections. With ``image_widths`` the kept images go through the
+    responsive image stage (see responsive_images.py) and the summary counts them.
+    """
+    paths = output_paths(output, formats)
+    text_formats = [fmt for fmt in paths if fmt != 'html']
+    keys = run_key = images_dir = None
+    if image_widths is not None:
+        import responsive_images
+
+        images_dir = responsive_images.images_dir(output)
+    if cache is not None:
+        keys = [cache.fragment_key(inp, output, parser) for inp in inputs]
+        run_key = cache.output_key(keys, title, quote_similarity, sorted(paths), image_widths)
+        if all(cache.output_up_to_date(path, run_key, images_dir) for path in paths.values()):
+            return {'status': "up to date"}
+
+    # global seen quotes across all inputs to dedupe repeated quoted blocks
+    quotes = QuoteIndex(quote_similarity)
+    first_title = None
+    page_prof = StageProfiler(profile)
+    reports = []
+    parsers_used = set()
+    readability = {'ran': 0, 'memo': 0}
+    fallbacks = []
+    images = None
+    if image_widths is not None:
+        images = responsive_images.ResponsiveImages(output, image_widths)
+    started = time.perf_counter()
+
+    def fragments():
+        nonlocal first_title
+        for content_soup, t, report in iter_fragments(inputs, output, jobs, cache, keys, profile, parser, budget):
+            if first_title is None:
+                first_title = t
+            parsers_used.add(report['parser'])
+            if 'readability' in report:
+                readability[report['readability']] += 1
+            if 'fallback' in report:
+                fallbacks.append({'input': report['input'], 'stage': report['fallback']['stage']})
+            if debug:
+                print(f"[debug] {report['input']}: encoding={report['encoding']} parser={report['parser']} reparses={report['reparses']} cache={report.get('cache', 'off')} readability={report.get('readability', '-')}"
+                      f"{' fallback=' + report['fallback']['stage'] if 'fallback' in report else ''}", file=sys.stderr)
+            prof = StageProfiler(profile)
+            with prof.stage('quotes'):
+                process_quotes(content_soup, quotes)
+            if profile:
+                reports.append(dict(report, stages={**report.get('stages', {}), **prof.stages}))
+            yield content_soup
+
+    def out_title():
+        return title or first_title or os.path.splitext(os.path.basename(inputs[0]))[0]
+
+    if stream:
+        sections = write_streamed_page(paths.get('html'), fragments(), lambda: title or first_title is not None,
+                                       out_title, page_prof, collect_sections=bool(text_formats), images=images)
+    else:
+        aggregate = aggregate_fragments(fragments())
+
+        # Sanitize the aggregated content
+        with page_prof.stage('sanitize'):
+            content_soup = sanitize_fragment(aggregate, images)
+
+        # Build output
+        with page_prof.stage('write'):
+            if 'html' in paths:
+                out_html = build_output_html(out_title(), str(content_soup))
+
+                with open(output, "w", encoding="utf-8") as f:
+                    f.write(out_html)
+            sections = section_ir(content_soup) if text_formats else None
+    if text_formats:
+        with page_prof.stage('write'):
+            write_text_outputs(paths, str(out_title()), sections)
+    if cache is not None and not fallbacks:
+        for path in paths.values():
+            cache.record_output(path, run_key, images_dir)
+    result = {
+        'status': "written",
+        'quotes_kept': quotes.kept,
+        'quotes_dropped': quotes.dropped_exact + quotes.dropped_near,
+        'quotes_near': quotes.dropped_near,
+        'parsers': sorted(parsers_used),
+        'readability_runs': readability['ran'],
+        'readability_memo': readability['memo'],
+        'fallbacks': fallbacks,
+    }
+    if images is not None:
+        result['images'] = {'images': images.images, 'copied': images.copied, 'variants': images.variants,
+                            'dir': images.dir}
+    if profile:
+        result['profile'] = {
+            'output': output,
+            'seconds': round(time.perf_counter() - started, 6),
+            'jobs': jobs,
+            'stream': stream,
+            'inputs': reports,
+            'page_stages': page_prof.stages,
+        }
+    return result
+
+
+def aggregate_fragments(content_soups) -> BeautifulSoup:
+    """Move the children of every fragment, in order, into one <div> ready for sanitize_fragment()."""
+    aggregate = BeautifulSoup('', 'html.parser')
+    agg_container = aggregate.new_tag('div')
+    aggregate.append(agg_container)
+    for content_soup in content_soups:
+        for child in fragment_children(content_soup):
+            try:
+                agg_container.append(child)
+            except Exception:
+                agg_container.append(BeautifulSoup(str(child), 'html.parser'))
+    return aggregate
+
+
+class CleanDocument:
+    """One cleaned page as returned by extract(): title, sanitized content and the input's report.
+
+    ``sections`` is the same content in the section model (see section_ir()).
+    """
+
+    def __init__(self, title: str, content_html: str, report: dict, sections: list[dict]):
+        self.title = title
+        self.content_html = content_html
+        self.report = report
+        self.sections = sections
+
+    def to_html(self) -> str:
+        """The complete output page, byte for byte what the command line writes for this input."""
+        return build_output_html(self.title, self.content_html)
+
+    def to_markdown(self) -> str:
+        return render_markdown(self.title, self.sections)
+
+    def to_json(self) -> str:
+        return render_json(self.title, self.sections)
+
+
+def extract(html_bytes: bytes, base_path: str, out_path: str | None = None, parser: str = "auto",
+            quote_similarity: float = 1.0, budget: float | None = None) -> CleanDocument:
+    """Clean one page held in memory the way the command line cleans a single input; nothing is written.
+
+    ``base_path`` is where the page was saved: its ``<name>_files`` folder and directory are
+    where images are looked up. Asset URLs are made relative to ``out_path``, which defaults
+    to base_path (i.e. an output written next to the page).
+    """
+    content_soup, t, report = extract_fragment(base_path, out_path or base_path, parser=parser, budget=budget,
+                                               data=html_bytes)
+    process_quotes(content_soup, QuoteIndex(quote_similarity))
+    content_soup = sanitize_fragment(aggregate_fragments([content_soup]))
+    title = t or os.path.splitext(os.path.basename(base_path))[0]
+    return CleanDocument(str(title), str(content_soup), report, section_ir(content_soup))
+
+
+def write_streamed_page(output: str | None, fragments, title_known, get_title, prof: StageProfiler | None = None,
+                        collect_sections: bool = False, images=None) -> list[dict] | None:
+    """Sanitize and write fragments one at a time; the file is renamed into place at the end.
+
+    Only the current fragment, one held-back top-level node and the open section are
+    in memory at any time. Output is buffered only until the page title is known.
+    With collect_sections=True the page's section model is returned as well; with
+    output=None no HTML is written at all.
+    """
+    prof = prof or StageProfiler()
+    sanitizer = SectionSanitizer(collect_sections, images)
+    # without an HTML output the sections are still taken out as they finish, into the void
+    tmp = f"{output}.{os.getpid()}.tmp" if output is not None else os.devnull
+    buffered = []
+    tail = None
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for content_soup in fragments:
+                with prof.stage('sanitize'):
+                    sanitizer.feed(fragment_children(content_soup))
+                    del content_soup
+                    buffered.append(sanitizer.take_output())
+                with prof.stage('write'):
+                    if tail is None and title_known():
+                        head, tail = build_output_html(get_title(), '\0').split('\0')
+                        f.write(head)
+                    if tail is not None:
+                        f.writelines(buffered)
+                        buffered.clear()
+            with prof.stage('sanitize'):
+                sanitizer.close()
+                buffered.append(sanitizer.take_output(final=True))
+            with prof.stage('write'):
+                if tail is None:
+                    head, tail = build_output_html(get_title(), '\0').split('\0')
+                    f.write(head)
+                f.writelines(buffered)
+                f.write(tail)
+        if output is not None:
+            os.replace(tmp, output)
+    except BaseException:
+        if output is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return None if sanitizer.sections is None else drop_empty_sections(sanitizer.sections)
+
+
+# the page number follows whitespace or a non-digit, so "2020.html" is one page named "2020"
+PAGE_NAME_RE = re.compile(r"^(.+?)(?:(?:\s+|(?<=\D))(\d+))?\.html$")
+
+
+def group_source_pages(src_dir: str) -> dict[str, list[str]]:
+    """Group saved pages by topic: "Name.html", "Name 2.html", ... -> {"Name": [paths in page order]}."""
+    groups: dict[str, list[tuple[int, str]]] = {}
+    for fname in sorted(os.listdir(src_dir)):
+        if not fname.endswith('.html') or fname.endswith('_merged.html'):
+            continue
+        m = PAGE_NAME_RE.match(fname)
+        if not m:
+            continue
+        num = int(m.group(2)) if m.group(2) else 1
+        groups.setdefault(m.group(1), []).append((num, os.path.join(src_dir, fname)))
+    return {name: [path for _, path in sorted(pages)] for name, pages in sorted(groups.items())}
+
+
+def load_manifest(path: str) -> list[dict]:
+    """Read a JSON manifest mapping output file -> inputs list (or {"inputs": [...], "title": ...}).
+
+    Relative paths are resolved against the manifest's own directory.
+    """
+    base = os.path.dirname(path)
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    pages = []
+    for output, spec in data.items():
+        if isinstance(spec, list):
+            spec = {'inputs': spec}
+        pages.append({
+            'output': os.path.join(base, output),
+            'inputs': [os.path.join(base, inp) for inp in spec['inputs']],
+            'title': spec.get('title'),
+        })
+    return pages
+
+
+def _build_page_job(job: dict) -> dict:
+    # Worker entry point for site builds: one page per task, timed inside the worker
+    start = time.perf_counter()
+    cache = FragmentCache(job['cache_dir']) if job['cache_dir'] else None
+    try:
+        result = build_page(job['inputs'], job['output'], job['title'], cache=cache, debug=job['debug'],
+                            stream=job['stream'], quote_similarity=job['quote_similarity'], profile=job['profile'],
+                            parser=job['parser'], budget=job['budget'], formats=job['formats'],
+                            image_widths=job['image_widths'])
+    except Exception as e:
+        result = {'status': f"failed: {e}"}
+    return {
+        **result,
+        'output': job['output'],
+        'inputs': len(job['inputs']),
+        'seconds': time.perf_counter() - start,
+        'hits': cache.hits if cache else 0,
+        'misses': cache.misses if cache else 0,
+    }
+
+
+def build_site(pages: list[dict], jobs: int, cache_dir: str | None, debug: bool = False, stream: bool = False,
+               quote_similarity: float = 1.0, profile: bool = False, parser: str = "auto",
+               budget: float | None = None, formats=('html',), image_widths=None) -> list[dict]:
+    """Build every page in one process (or a pool of jobs processes) and print a timing summary."""
+    tasks = [dict(page, cache_dir=cache_dir, debug=debug, stream=stream, quote_similarity=quote_similarity,
+                  profile=profile, parser=parser, budget=budget, formats=formats, image_widths=image_widths)
+             for page in pages]
+    start = time.perf_counter()
+    if jobs <= 1 or len(tasks) < 2:
+        results = [_build_page_job(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+            results = list(pool.map(_build_page_job, tasks))
+    elapsed = time.perf_counter() - start
+
+    width = max(len(r['output']) for r in results)
+    for r in results:
+        cache_note = f"  cache {r['hits']}/{r['hits'] + r['misses']}" if cache_dir else ""
+        quote_note = f"  quotes -{r['quotes_dropped']}" if r.get('quotes_dropped') else ""
+        fallback_note = f"  fallback {len(r['fallbacks'])}" if r.get('fallbacks') else ""
+        print(f"  {r['output']:<{width}}  {r['inputs']} input(s)  {r['seconds']:6.2f}s  {r['status']}{cache_note}{quote_note}{fallback_note}")
+    print(f"Built {len(results)} page(s) in {elapsed:.2f}s")
+    print_fallbacks([f for r in results for f in r.get('fallbacks', ())], budget)
+    return results
+
+
+def print_fallbacks(fallbacks: list[dict], budget: float | None) -> None:
+    """List the inputs that went over the time budget and were extracted the cheap way."""
+    if not fallbacks:
+        return
+    print(f"Time budget: {len(fallbacks)} input(s) took over {budget:g}s and fell back to the cheap extractor")
+    for f in fallbacks:
+        print(f"  {f['input']} (stopped in {f['stage']})")
+
+
+def write_profile(path: str, results: list[dict]) -> None:
+    """Write the --profile report: one entry per built page, each listing its inputs' stages."""
+    report = {'pages': [r['profile'] for r in results if 'profile' in r]}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Profile: {path}")
 
-    with open(args.output, "w", encoding="utf-8") as f:
-        f.write(out_html)
 
-    print(f"Wrote {args.output} (extracted main content from {len(args.inputs)} input files)")
+def main(argv=None):
+    import argparse
+
+    p = argparse.ArgumentParser(description="Create a minimal mobile-friendly HTML from scraped forum/blog HTML files")
+    p.add_argument("inputs", nargs='*', help="one or more source HTML files (e.g. sources/Файл.html sources/Файл2.html)")
+    p.add_argument("-o", "--output", help="output HTML file", default="relaxation_guide.html")
+    p.add_argument("--title", help="optional output title (overrides input titles)")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="extract inputs (or build pages) in N worker processes (0 = one per CPU)")
+    p.add_argument("--debug", action="store_true", help="print a per-input diagnostics report to stderr")
+    p.add_argument("--cache-dir", help=f"where to keep extracted fragments between runs (default: {default_cache_dir()})")
+    p.add_argument("--no-cache", action="store_true", help="always extract every input from scratch")
+    p.add_argument("--build", metavar="SRC_DIR", help="build one page per Name.html/Name 2.html group found in SRC_DIR")
+    p.add_argument("--manifest", help="build the pages listed in a JSON manifest ({output: [inputs...]})")
+    p.add_argument("--stream", action="store_true", help="write each input's sections as soon as they are ready (bounded memory)")
+    p.add_argument("--quote-similarity", type=float, default=1.0, metavar="T",
+                   help="also drop quotes at least this similar (0-1) to an earlier one; 1.0 = exact repeats only (default)")
+    p.add_argument("--out-dir", default=".", help="where --build writes its pages (default: current directory)")
+    p.add_argument("--profile", metavar="REPORT.json",
+                   help="write per-input stage timings, node counts and tracemalloc peaks as JSON (slows the run down)")
+    p.add_argument("--parser", default="auto", choices=html_parsers.CHOICES,
+                   help="HTML parser backend (default: auto = lxml-native if lxml is installed, see html_parsers.py)")
+    p.add_argument("--time-budget", type=float, metavar="SECONDS",
+                   help="per-input limit on parsing and content extraction; inputs over it fall back to the "
+                        "forum-post/heuristic extractor without readability (default: no limit)")
+    p.add_argument("--format", default="html", metavar="FORMATS",
+                   help="comma-separated outputs to write from one parse: html, md, json (default: html). "
+                        "Markdown and JSON go next to the HTML path with their own extension")
+    p.add_argument("--responsive-images", action="store_true",
+                   help="copy kept images next to the output under content-hashed names and add width/height, "
+                        "lazy loading and (with Pillow) a srcset of smaller copies")
+    p.add_argument("--image-widths", default="320,640,960,1280", metavar="W,W,...",
+                   help="widths of the smaller copies for --responsive-images (default: %(default)s)")
+    p.add_argument("--watch", action="store_true",
+                   help="after building, keep running and rebuild the pages whose inputs change (polls with stat)")
+    p.add_argument("--watch-interval", type=float, default=1.0, metavar="SECONDS",
+                   help="how often --watch checks the inputs (default: 1)")
+    p.add_argument("--cprofile", metavar="FILE.prof",
+                   help="dump cProfile stats for this process (workers started by --jobs are not included)")
+    args = p.parse_args(argv)
+    try:
+        html_parsers.resolve_parser(args.parser)
+    except ValueError as e:
+        p.error(str(e))
+    if args.time_budget is not None and args.time_budget <= 0:
+        p.error("--time-budget must be positive")
+    if not 0 < args.quote_similarity <= 1:
+        p.error("--quote-similarity must be greater than 0 and at most 1")
+    unknown = set(args.format.split(',')) - set(OUTPUT_FORMATS)
+    if unknown:
+        p.error(f"unknown --format {', '.join(sorted(unknown))} (choose from {', '.join(OUTPUT_FORMATS)})")
+    if not re.fullmatch(r"\d+(,\d+)*", args.image_widths):
+        p.error("--image-widths takes comma-separated pixel widths, e.g. 320,640")
+    if args.watch and args.profile:
+        p.error("--watch can't be combined with --profile")
+    if args.watch_interval <= 0:
+        p.error("--watch-interval must be positive")
+
+    profiler = None
+    if args.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        _run(p, args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+
+
+def _run(p: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    cache_dir = None if args.no_cache else (args.cache_dir or default_cache_dir())
+    profile = bool(args.profile)
+    formats = args.format.split(',')
+    image_widths = None
+    if args.responsive_images:
+        image_widths = tuple(int(w) for w in args.image_widths.split(','))
+
+    if args.build or args.manifest:
+        def list_pages():
+            if args.manifest:
+                return load_manifest(args.manifest)
+            return [{'output': os.path.join(args.out_dir, name + '.html'), 'inputs': inputs, 'title': None}
+                    for name, inputs in group_source_pages(args.build).items()]
+
+        pages = list_pages()
+        if not pages:
+            print("No pages to build")
+            sys.exit(2)
+
+        def build(pages):
+            return build_site(pages, jobs, cache_dir, args.debug, args.stream, args.quote_similarity, profile,
+                              args.parser, args.time_budget, formats, image_widths)
+
+        results = build(pages)
+        if profile:
+            write_profile(args.profile, results)
+        if args.watch:
+            watch_pages(list_pages, build, args.watch_interval)
+            return
+        if any(r['status'].startswith('failed') for r in results):
+            sys.exit(1)
+        return
+
+    if not args.inputs:
+        p.error("give input files, --build SRC_DIR or --manifest FILE")
+
+    # Verify inputs exist
+    for inp in args.inputs:
+        if not os.path.exists(inp):
+            print(f"Input not found: {inp}")
+            sys.exit(2)
+
+    cache = FragmentCache(cache_dir) if cache_dir else None
+    page = {'output': args.output, 'inputs': args.inputs, 'title': args.title}
+
+    def build(pages):
+        if cache is not None:
+            cache.hits = cache.misses = 0
+        result = build_page(args.inputs, args.output, args.title, jobs, cache, args.debug, args.stream,
+                            args.quote_similarity, profile, args.parser, args.time_budget, formats, image_widths)
+        print_page_summary(args.output, len(args.inputs), result, cache, args.time_budget, formats)
+        return [result]
+
+    results = build([page])
+    if profile and results[0]['status'] != "up to date":
+        write_profile(args.profile, results)
+    if args.watch:
+        watch_pages(lambda: [page], build, args.watch_interval)
+
+
+def print_page_summary(output: str, n_inputs: int, result: dict, cache: FragmentCache | None,
+                       budget: float | None, formats=('html',)) -> None:
+    written = ', '.join(output_paths(output, formats).values())
+    if result['status'] == "up to date":
+        print(f"{written} is up to date ({n_inputs} input files unchanged)")
+        return
+
+    print(f"Wrote {written} (extracted main content from {n_inputs} input files)")
+    print(f"Quotes: kept {result['quotes_kept']}, dropped {result['quotes_dropped']} repeated ({result['quotes_near']} near-duplicates)")
+    print(f"Parser: {', '.join(result['parsers'])}")
+    if result['readability_runs'] or result['readability_memo']:
+        print(f"Readability: {result['readability_runs']} run(s), {result['readability_memo']} summary(ies) reused")
+    print_fallbacks(result['fallbacks'], budget)
+    if 'images' in result:
+        im = result['images']
+        print(f"Images: {im['images']} rewritten, {im['copied']} copied and {im['variants']} resized into {im['dir']}")
+    if cache is not None:
+        print(f"Cache: {cache.hits} hit(s), {cache.misses} miss(es) in {cache.cache_dir}")
+
+
+def watch_pages(list_pages, build, interval: float) -> None:
+    """--watch: keep this process (imports, parsers, asset indexes) warm and rebuild pages whose inputs change.
+
+    list_pages() is re-read on every poll, so new topics in a --build folder and edits to a
+    --manifest are picked up. build(pages) rebuilds just the given pages.
+    """
+    import file_watch
+
+    def list_targets():
+        try:
+            return {page['output']: page['inputs'] for page in list_pages()}
+        except (OSError, ValueError) as e:
+            # e.g. a manifest caught halfway through being saved; try again on the next poll
+            print(f"Can't list pages: {e}")
+            return {}
+
+    def rebuild(outputs):
+        wanted = set(outputs)
+        # the asset folders may have changed along with the pages
+        _asset_indexes.clear()
+        pages = [page for page in list_pages() if page['output'] in wanted]
+        try:
+            build(pages)
+        except Exception as e:
+            print(f"Rebuild failed: {e}")
+        # an output may also be listed as an input; its new stats are not an edit
+        return [page['output'] for page in pages]
+
+    def report(outputs, seconds):
+        print(f"Rebuilt {len(outputs)} page(s) in {seconds:.2f}s")
+
+    print(f"Watching for changes every {interval:g}s (Ctrl-C to stop)")
+    try:
+        file_watch.watch(list_targets, rebuild, interval, report)
+    except KeyboardInterrupt:
+        print("Stopped watching")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+"""
+file_watch.py
+
+Change detection for the --watch modes of clean_html.py and practice/clean_forum_html.py.
+
+Nothing but stat(): every interval the watched files are stat()ed and compared by
+(mtime_ns, size), so no inotify or other service is needed and it works the same on
+every platform. A target (one output) is rebuilt when any of its input files was
+changed, created or deleted.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+
+
+def stat_key(path) -> tuple[int, int] | None:
+    """(mtime_ns, size) of path, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def snapshot(paths) -> dict:
+    return {os.fspath(path): stat_key(path) for path in paths}
+
+
+def watch(list_targets, rebuild, interval: float = 1.0, report=None) -> None:
+    """Poll until KeyboardInterrupt, calling rebuild(changed_targets) when inputs change.
+
+    list_targets() returns {target: [input paths]} and is called on every poll, so a
+    target that appears later (a new page in a watched folder) is picked up. A target is
+    changed when the stats of its inputs differ from the last poll. The stats taken before
+    rebuild() are the new baseline, so an input saved while a rebuild runs is rebuilt on
+    the next poll. rebuild() may return the paths it wrote; those alone are stat()ed again
+    afterwards, so outputs written over their own inputs don't trigger another rebuild.
+    report(changed_targets, seconds) is called after each rebuild.
+    """
+    state = {target: snapshot(paths) for target, paths in list_targets().items()}
+    while True:
+        time.sleep(interval)
+        current = {target: snapshot(paths) for target, paths in list_targets().items()}
+        changed = [target for target, stats in current.items() if stats != state.get(target)]
+        if not changed:
+            continue
+        state = current
+        start = time.perf_counter()
+        written = rebuild(changed)
+        seconds = time.perf_counter() - start
+        written = {os.path.abspath(path) for path in written or () if path is not None}
+        for stats in state.values():
+            for path in stats:
+                if os.path.abspath(path) in written:
+                    stats[path] = stat_key(path)
+        if report is not None:
+            report(changed, seconds)
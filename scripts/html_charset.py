@@ -0,0 +1,83 @@
+"""
+html_charset.py
+
+Charset detection and decoding shared by clean_html.py and practice/clean_forum_html.py.
+
+The file is read once and decoded once:
+  1. a byte order mark decides outright;
+  2. otherwise the bytes are decoded as UTF-8 chunk by chunk, stopping at the first invalid
+     sequence. Saved pages often keep a stale <meta charset=windows-1251> after the browser
+     re-encoded them as UTF-8, so valid UTF-8 wins over a declared single-byte charset;
+  3. otherwise the charset from <meta charset> / <meta http-equiv="Content-Type"> is used;
+  4. otherwise windows-1251, which fits these forums, or latin-1 when the bytes can't be
+     windows-1251 (it leaves a few byte values undefined).
+"""
+
+from __future__ import annotations
+
+import codecs
+import re
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig", "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16", "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16", "utf-16"),
+)
+# only the start of the document is searched for a declaration, like browsers do (they use 1024)
+PRESCAN_BYTES = 4096
+CHUNK_SIZE = 1 << 16
+META_CHARSET_RE = re.compile(
+    rb"""<meta\s[^>]*?charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.I)
+
+
+def declared_charset(data: bytes) -> str | None:
+    """Python codec name declared by a <meta> tag near the start of data, if any and known."""
+    m = META_CHARSET_RE.search(data, 0, PRESCAN_BYTES)
+    if not m:
+        return None
+    try:
+        name = codecs.lookup(m.group(1).decode("ascii")).name
+    except LookupError:
+        return None
+    # a document that could spell out the meta tag in ASCII isn't UTF-16/32; browsers read it as UTF-8
+    return "utf-8" if name.startswith(("utf-16", "utf-32")) else name
+
+
+def _decode_utf8(data: bytes) -> str | None:
+    # Incremental decode: a non-UTF-8 file is usually rejected within its first few
+    # non-ASCII bytes instead of after a full trial decode
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parts = []
+    try:
+        for start in range(0, len(data), CHUNK_SIZE):
+            parts.append(decoder.decode(data[start:start + CHUNK_SIZE]))
+        parts.append(decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        return None
+    return "".join(parts)
+
+
+def decode_html(data: bytes) -> tuple[str, str]:
+    """Decode an HTML document; returns (text, encoding) with encoding as a Python codec name."""
+    for bom, codec, name in BOMS:
+        if data.startswith(bom):
+            return data.decode(codec, errors="replace"), name
+
+    text = _decode_utf8(data)
+    if text is not None:
+        return text, "utf-8"
+
+    declared = declared_charset(data)
+    if declared is not None:
+        return data.decode(declared, errors="replace"), declared
+
+    try:
+        return data.decode("cp1251"), "cp1251"
+    except UnicodeDecodeError:
+        return data.decode("latin-1"), "iso8859-1"
+
+
+def read_html_file(path) -> tuple[str, str]:
+    """Read and decode an HTML file; returns (text, encoding)."""
+    with open(path, "rb") as f:
+        return decode_html(f.read())
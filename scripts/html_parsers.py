@@ -0,0 +1,64 @@
+"""
+html_parsers.py
+
+Parser backend selection shared by clean_html.py and practice/clean_forum_html.py.
+
+Choices:
+  auto         the first installed of lxml, html5lib, html.parser; if one fails on a document
+               the next one is tried (what clean_html.py has always done). With lxml installed
+               this resolves to lxml-native.
+  lxml-native  soups are built with lxml, and callers may run their hot steps on a plain lxml
+               tree instead (clean_html.py extracts forum posts that way). A document lxml
+               fails on falls back the same way as with auto.
+  lxml, html5lib, html.parser
+               that BeautifulSoup tree builder and nothing else
+"""
+
+from __future__ import annotations
+
+from bs4 import BeautifulSoup
+
+BACKENDS = ("lxml", "html5lib", "html.parser")
+CHOICES = ("auto", "lxml-native") + BACKENDS
+
+
+def available_backends() -> list[str]:
+    """BeautifulSoup tree builders that are installed, in order of preference."""
+    from bs4.builder import builder_registry
+
+    return [name for name in BACKENDS if builder_registry.lookup(name)]
+
+
+def resolve_parser(choice: str = "auto") -> str:
+    """Return the parser a choice stands for; ValueError if it is unknown or not installed."""
+    if choice not in CHOICES:
+        raise ValueError(f"unknown parser {choice!r} (choose from {', '.join(CHOICES)})")
+    available = available_backends()
+    if choice == "auto":
+        return "lxml-native" if "lxml" in available else available[0]
+    if builder_name(choice) not in available:
+        raise ValueError(f"parser {choice!r} is not installed (available: {', '.join(available)})")
+    return choice
+
+
+def builder_name(parser: str) -> str:
+    """The BeautifulSoup builder behind a resolved parser name."""
+    return "lxml" if parser == "lxml-native" else parser
+
+
+def make_soup(markup, parser: str = "auto") -> BeautifulSoup:
+    """Parse markup with the chosen backend; see backend_name() for the one that was used."""
+    if parser not in ("auto", "lxml-native"):
+        return BeautifulSoup(markup, builder_name(resolve_parser(parser)))
+    for name in available_backends():
+        try:
+            return BeautifulSoup(markup, name)
+        except Exception:
+            continue
+    # last resort
+    return BeautifulSoup(markup, "html.parser")
+
+
+def backend_name(soup: BeautifulSoup) -> str:
+    """Name of the tree builder that produced soup ("lxml", "html5lib" or "html.parser")."""
+    return soup.builder.NAME
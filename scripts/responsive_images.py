@@ -0,0 +1,188 @@
+"""
+responsive_images.py
+
+The optional image stage of clean_html.py (--responsive-images).
+
+Every image a page keeps is copied next to the output, into "<output name>_images/",
+under a name made from a hash of its bytes, so pages share nothing with the scraped
+"_files" folders and an unchanged image is never copied twice. Each <img> gets its
+width/height (no layout shift while it loads), loading="lazy" and decoding="async".
+With Pillow installed, narrower copies are also written for the widths a phone needs
+and listed in srcset/sizes; without it the image is only copied and measured (the
+size is read from the PNG/GIF/JPEG/WebP header).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+from urllib.parse import quote, unquote, urlparse
+
+DEFAULT_WIDTHS = (320, 640, 960, 1280)
+# clean_html's .container is at most 680px wide
+SIZES = "(max-width: 680px) 100vw, 680px"
+RESIZABLE = {'.jpg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_size(path) -> tuple[int, int] | None:
+    """(width, height) from the file header for PNG, GIF, WebP and JPEG; None otherwise."""
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8X':
+                return 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+            if chunk == b'VP8 ':
+                w, h = struct.unpack('<HH', head[26:30])
+                return w & 0x3FFF, h & 0x3FFF
+            if chunk == b'VP8L':
+                bits = int.from_bytes(head[21:25], 'little')
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            return None
+        if head[:2] != b'\xff\xd8':
+            return None
+        # JPEG: walk the segments up to the first start-of-frame
+        f.seek(2)
+        while True:
+            byte = f.read(1)
+            while byte == b'\xff':
+                byte = f.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                continue
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if marker in JPEG_SOF:
+                sof = f.read(5)
+                if len(sof) < 5:
+                    return None
+                h, w = struct.unpack('>HH', sof[1:5])
+                return w, h
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def images_dir(out_path: str) -> str:
+    """The folder an output page's images are copied to: "<output name>_images/" beside it."""
+    return os.path.splitext(out_path)[0] + '_images'
+
+
+class ResponsiveImages:
+    """Rewrites the <img> tags of one output page; see the module docstring.
+
+    ``src`` values are expected relative to the output (as rewrite_asset_urls() leaves
+    them). Remote images and files that can't be found only get the lazy-loading
+    attributes. Each source file is processed once per page.
+    """
+
+    def __init__(self, out_path: str, widths=DEFAULT_WIDTHS):
+        self.out_dir = os.path.dirname(out_path)
+        self.dir = images_dir(out_path)
+        self.dir_name = os.path.basename(self.dir)
+        self.widths = sorted(widths)
+        self.images = 0
+        self.copied = 0
+        self.variants = 0
+        self._done: dict[str, dict] = {}
+        self._pil = None
+
+    def _url(self, name: str) -> str:
+        # percent-encoded: srcset splits on spaces and commas
+        return quote(f"{self.dir_name}/{name}")
+
+    def _image_module(self):
+        if self._pil is None:
+            try:
+                from PIL import Image, ImageOps
+                self._pil = (Image, ImageOps)
+            except ImportError:
+                self._pil = False
+        return self._pil
+
+    def rewrite(self, img) -> None:
+        src = img.get('src') or ''
+        path = None
+        if src and not urlparse(src).scheme and not src.startswith('//'):
+            path = os.path.normpath(os.path.join(self.out_dir, unquote(src)))
+        if path is not None and os.path.isfile(path):
+            attrs = self._done.get(path)
+            if attrs is None:
+                attrs = self._done[path] = self._process(path)
+            img.attrs.update(attrs)
+            self.images += 1
+        img['loading'] = 'lazy'
+        img['decoding'] = 'async'
+
+    def _process(self, path: str) -> dict:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        ext = os.path.splitext(path)[1].lower()
+        ext = '.jpg' if ext == '.jpeg' else ext
+        name = digest + ext
+        os.makedirs(self.dir, exist_ok=True)
+        dest = os.path.join(self.dir, name)
+        if not os.path.exists(dest):
+            _write_atomic(dest, data)
+            self.copied += 1
+
+        attrs = {'src': self._url(name)}
+        pil = self._image_module() if ext in RESIZABLE else False
+        if pil:
+            attrs.update(self._resize(pil, dest, digest, ext))
+        if 'width' not in attrs:
+            try:
+                size = image_size(dest)
+            except OSError:
+                size = None
+            if size:
+                attrs['width'], attrs['height'] = str(size[0]), str(size[1])
+        return attrs
+
+    def _resize(self, pil, path: str, digest: str, ext: str) -> dict:
+        Image, ImageOps = pil
+        try:
+            with Image.open(path) as im:
+                if getattr(im, 'is_animated', False):
+                    return {}
+                # the size a browser shows, which honours the EXIF orientation
+                im = ImageOps.exif_transpose(im)
+                width, height = im.size
+                srcset = []
+                for w in self.widths:
+                    if w >= width:
+                        break
+                    name = f"{digest}-{w}{ext}"
+                    dest = os.path.join(self.dir, name)
+                    if not os.path.exists(dest):
+                        small = im.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+                        if RESIZABLE[ext] == 'JPEG' and small.mode not in ('RGB', 'L'):
+                            small = small.convert('RGB')
+                        tmp = f"{dest}.{os.getpid()}.tmp"
+                        small.save(tmp, format=RESIZABLE[ext], quality=82, optimize=True)
+                        os.replace(tmp, dest)
+                        self.variants += 1
+                    srcset.append(f"{self._url(name)} {w}w")
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return {}
+        attrs = {'width': str(width), 'height': str(height)}
+        if srcset:
+            srcset.append(f"{self._url(digest + ext)} {width}w")
+            attrs['srcset'] = ', '.join(srcset)
+            attrs['sizes'] = SIZES
+        return attrs
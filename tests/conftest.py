@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The scripts are run directly rather than installed, so import them the same way.
+for folder in ('scripts', 'practice'):
+    path = str(ROOT / folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def clean_html_cli(tmp_path):
+    """Run scripts/clean_html.py in a subprocess, with its cache under tmp_path; returns stdout."""
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'xdg-cache'))
+
+    def run(*args):
+        result = subprocess.run([sys.executable, str(ROOT / 'scripts' / 'clean_html.py'), *map(str, args)],
+                                capture_output=True, text=True, env=env, check=True)
+        return result.stdout
+
+    return run
@@ -0,0 +1,51 @@
+"""rewrite_asset_urls(): asset URLs point at the source folder's files, relative to the output."""
+
+from bs4 import BeautifulSoup
+
+import clean_html
+
+
+def make_tree(tmp_path):
+    src = tmp_path / 'src'
+    for rel in ('page_files/a.png', 'other_files/b.png', 'zz/b.png'):
+        (src / rel).parent.mkdir(parents=True, exist_ok=True)
+        (src / rel).write_bytes(b'')
+    (tmp_path / 'out').mkdir()
+    return src
+
+
+def rewrite(src, tmp_path, *urls):
+    soup = BeautifulSoup(''.join(f'<img src="{url}">' for url in urls), 'html.parser')
+    clean_html.rewrite_asset_urls(soup, str(src / 'page.html'), str(tmp_path / 'out' / 'page.html'))
+    return [img['src'] for img in soup.find_all('img')]
+
+
+def test_urls_rewritten(tmp_path):
+    src = make_tree(tmp_path)
+    assert rewrite(src, tmp_path,
+                   './page_files/a.png',        # the page's own _files folder
+                   'C:/saved/elsewhere/b.png',  # found by name anywhere under the source folder
+                   'https://example.com/c.png',
+                   'missing%20file.png') == [
+        '../src/page_files/a.png',
+        '../src/other_files/b.png',
+        'https://example.com/c.png',
+        'missing file.png',
+    ]
+
+
+def test_duplicate_names_resolve_in_sorted_order(tmp_path):
+    src = make_tree(tmp_path)
+    index = clean_html.AssetIndex(str(src))
+    assert index.find('b.png') == str(src / 'other_files' / 'b.png')
+    assert index.contains(str(src / 'page_files'), 'a.png')
+    assert not index.contains(str(src / 'page_files'), 'b.png')
+
+
+def test_folder_indexed_once(tmp_path):
+    src = make_tree(tmp_path)
+    index = clean_html.get_asset_index(str(src))
+    (src / 'page_files' / 'new.png').write_bytes(b'')
+    assert clean_html.get_asset_index(str(src)) is index
+    # a file added after the index was built isn't seen in this run
+    assert rewrite(src, tmp_path, 'page_files/new.png') == ['page_files/new.png']
@@ -0,0 +1,162 @@
+"""download_index.DownloadIndex with download_image(), on a fake clock."""
+
+import http.server
+import struct
+import threading
+
+import pytest
+
+import download_index
+import image_downloads
+
+PNG = (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR'
+       + struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0) + b'\0\0\0\0')
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.version = 1
+        # (path, If-None-Match) of every request
+        self.requests = []
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """/missing - 404; anything else - PNG version server.version with ETag "v<version>", 304 if it matches."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if_none_match = self.headers.get('If-None-Match')
+        with server.lock:
+            server.requests.append((self.path, if_none_match))
+        etag = f'"v{server.version}"'
+        if self.path == '/missing':
+            status, body = 404, b'no such image'
+        elif if_none_match == etag:
+            status, body = 304, b''
+        else:
+            status, body = 200, PNG + bytes([server.version]) * 64
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def server():
+    srv = Server()
+    thread = threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(download_index, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def index(tmp_path, clock):
+    index = download_index.DownloadIndex(tmp_path / 'cache')
+    yield index
+    index.close()
+
+
+def counters(index):
+    return index.hits, index.revalidated, index.skipped, index.stored
+
+
+def download(url, index, save_dir):
+    filename = image_downloads.download_image(url, save_dir, index=index)
+    return filename and (save_dir / filename).read_bytes()
+
+
+def test_fresh_copy_then_conditional_get(server, index, clock, tmp_path):
+    url = server.url('/a.png')
+    first = download(url, index, tmp_path / 'one')
+    assert first.startswith(PNG)
+    assert counters(index) == (0, 0, 0, 1)
+
+    # another folder within FRESH_TTL: no request at all
+    clock.now += download_index.FRESH_TTL - 1
+    assert download(url, index, tmp_path / 'two') == first
+    assert counters(index) == (1, 0, 0, 1)
+    assert server.requests == [('/a.png', None)]
+
+    # past FRESH_TTL: revalidated with the stored ETag, 304 reuses the stored copy
+    clock.now += 2
+    assert download(url, index, tmp_path / 'three') == first
+    assert counters(index) == (1, 1, 0, 1)
+    assert server.requests[-1] == ('/a.png', '"v1"')
+    assert index.lookup(url)['fetched_at'] == clock.now
+
+    # the 304 restarted FRESH_TTL
+    clock.now += download_index.FRESH_TTL - 1
+    assert download(url, index, tmp_path / 'four') == first
+    assert counters(index) == (2, 1, 0, 1)
+    assert len(server.requests) == 2
+
+
+def test_changed_image_stored_again(server, index, clock, tmp_path):
+    url = server.url('/a.png')
+    first = download(url, index, tmp_path / 'one')
+    server.version = 2
+    clock.now += download_index.FRESH_TTL + 1
+    second = download(url, index, tmp_path / 'two')
+    assert second != first and second.startswith(PNG)
+    assert counters(index) == (0, 0, 0, 2)
+    assert index.lookup(url)['etag'] == '"v2"'
+    # both versions are kept, each once
+    assert len(list(index.store.root.glob('??/*'))) == 2
+
+
+def test_failures_cached_for_failure_ttl(server, index, clock, tmp_path):
+    url = server.url('/missing')
+    assert download(url, index, tmp_path) is None
+    assert index.lookup(url)['error']
+
+    clock.now += download_index.FAILURE_TTL - 1
+    assert download(url, index, tmp_path) is None
+    assert counters(index) == (0, 0, 1, 0)
+    assert len(server.requests) == 1
+
+    clock.now += 2
+    assert download(url, index, tmp_path) is None
+    assert len(server.requests) == 2
+
+
+def test_failed_revalidation_keeps_copy(server, index, clock, tmp_path):
+    url = server.url('/a.png')
+    first = download(url, index, tmp_path / 'one')
+    clock.now += download_index.FRESH_TTL + 1
+    server.server_close()
+    # the host is down: the old copy is used, and not asked for again within FAILURE_TTL
+    assert download(url, index, tmp_path / 'two') == first
+    assert index.lookup(url)['failed_at'] == clock.now
+    clock.now += download_index.FAILURE_TTL - 1
+    assert download(url, index, tmp_path / 'three') == first
+    assert counters(index) == (1, 0, 0, 1)
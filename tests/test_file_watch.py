@@ -0,0 +1,47 @@
+"""file_watch.watch(): what counts as a change around a rebuild."""
+
+import pytest
+
+import file_watch
+
+
+def run_watch(path, rebuild, polls=4):
+    """Watch one target whose only input is path; it first shows up on the first poll."""
+    calls = []
+
+    def list_targets():
+        calls.append(None)
+        if len(calls) > polls:
+            raise KeyboardInterrupt
+        return {'page': [path]} if len(calls) > 1 else {}
+
+    with pytest.raises(KeyboardInterrupt):
+        file_watch.watch(list_targets, rebuild, interval=0)
+
+
+def test_input_saved_during_rebuild_is_rebuilt(tmp_path):
+    page = tmp_path / 'page.html'
+    page.write_text('one')
+    rebuilt = []
+
+    def rebuild(changed):
+        rebuilt.append(changed)
+        if len(rebuilt) == 1:
+            page.write_text('saved while rebuilding')
+
+    run_watch(page, rebuild)
+    assert rebuilt == [['page'], ['page']]
+
+
+def test_output_written_over_its_input_is_not_a_change(tmp_path):
+    page = tmp_path / 'page.html'
+    page.write_text('original')
+    rebuilt = []
+
+    def rebuild(changed):
+        rebuilt.append(changed)
+        page.write_text('cleaned')
+        return [page]
+
+    run_watch(page, rebuild)
+    assert rebuilt == [['page']]
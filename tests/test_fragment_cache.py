@@ -0,0 +1,35 @@
+"""The fragment cache must be invalidated by edits to any module that cleans a page."""
+
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import clean_html
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def build(tree: Path) -> str:
+    result = subprocess.run(
+        [sys.executable, str(tree / 'scripts' / 'clean_html.py'), str(tree / 'src' / 'page.html'),
+         '-o', str(tree / 'out' / 'page.html'), '--cache-dir', str(tree / 'cache')],
+        capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+@pytest.mark.parametrize('module', clean_html.PIPELINE_MODULES)
+def test_module_edit_rebuilds_page(tmp_path, module):
+    shutil.copytree(ROOT / 'scripts', tmp_path / 'scripts', ignore=shutil.ignore_patterns('__pycache__'))
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'out').mkdir()
+    shutil.copy(ROOT / 'sources' / 'АЛЬФА-ИСЦЕЛЕНИЕ.html', tmp_path / 'src' / 'page.html')
+
+    assert 'Cache: 0 hit(s), 1 miss(es)' in build(tmp_path)
+    assert 'is up to date' in build(tmp_path)
+
+    with open(tmp_path / 'scripts' / f'{module}.py', 'a', encoding='utf-8') as f:
+        f.write('\n# edited\n')
+    assert 'Cache: 0 hit(s), 1 miss(es)' in build(tmp_path)
@@ -0,0 +1,172 @@
+"""http_pool.HTTPClient against a scripted local http.server."""
+
+import http.server
+import threading
+from collections import Counter
+
+import pytest
+
+import http_pool
+from http_pool import HTTPClient, HTTPError
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        # client port of every request, to tell connections apart
+        self.ports = []
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    /ok - 200; /busy/N - 503 with Retry-After: 3 for the first N requests, then 200;
+    /limited - always 429; /moved, /moved-308, /found - 301, 308, 302 to /ok;
+    /loop/K - 302 to /loop/K+1; /etag - 304 for If-None-Match "e1", else 200;
+    /not-modified - always 304; /part - 206 for Range, else 200.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            server.ports.append(self.client_address[1])
+            hits = server.hits[self.path]
+        path = self.path
+        if path.startswith('/busy/'):
+            if hits <= int(path.rsplit('/', 1)[1]):
+                return self.reply(503, b'busy', {'Retry-After': '3'})
+        elif path == '/limited':
+            return self.reply(429, b'slow down', {'Retry-After': '1'})
+        elif path in ('/moved', '/moved-308', '/found'):
+            status = {'/moved': 301, '/moved-308': 308, '/found': 302}[path]
+            return self.reply(status, b'', {'Location': '/ok'})
+        elif path.startswith('/loop/'):
+            return self.reply(302, b'', {'Location': f'/loop/{int(path.rsplit("/", 1)[1]) + 1}'})
+        elif path == '/etag':
+            if self.headers.get('If-None-Match') == '"e1"':
+                return self.reply(304, None, {'ETag': '"e1"'})
+            return self.reply(200, b'body', {'ETag': '"e1"'})
+        elif path == '/not-modified':
+            return self.reply(304, None)
+        elif path == '/part' and self.headers.get('Range'):
+            return self.reply(206, b'dy', {'Content-Range': 'bytes 2-3/4'})
+        self.reply(200, b'body')
+
+    def reply(self, status: int, body, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    srv = Server()
+    thread = threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def pauses(monkeypatch):
+    """Record retry pauses instead of sleeping."""
+    slept = []
+    monkeypatch.setattr(http_pool.time, 'sleep', slept.append)
+    return slept
+
+
+def fetch(client, url, **kwargs):
+    with client.open(url, **kwargs) as response:
+        return response.status, response.read()
+
+
+def test_connection_reused(server):
+    client = HTTPClient()
+    for _ in range(5):
+        assert fetch(client, server.url('/ok')) == (200, b'body')
+    assert len(set(server.ports)) == 1
+    assert (client.requests, client.connections, client.reused) == (5, 1, 4)
+    client.close()
+
+
+def test_unread_body_not_reused(server):
+    client = HTTPClient()
+    with client.open(server.url('/ok')) as response:
+        response.read(1)
+    fetch(client, server.url('/ok'))
+    assert len(set(server.ports)) == 2
+
+
+def test_retry_honours_retry_after(server, pauses):
+    client = HTTPClient(retries=2, backoff=0.5)
+    assert fetch(client, server.url('/busy/2')) == (200, b'body')
+    assert server.hits['/busy/2'] == 3
+    # Retry-After: 3 beats the backoff of 0.5 and 1 s
+    assert pauses == [3, 3]
+    assert client.retried == 2
+    # error bodies are read, so all three requests share one connection
+    assert len(set(server.ports)) == 1
+
+
+def test_retries_exhausted(server, pauses):
+    client = HTTPClient(retries=2, backoff=0.5)
+    with pytest.raises(HTTPError) as error:
+        fetch(client, server.url('/limited'))
+    assert error.value.status == 429
+    assert server.hits['/limited'] == 3
+    assert pauses == [1, 1]
+
+
+def test_no_retry_past_deadline(server, pauses):
+    client = HTTPClient(retries=2)
+    with pytest.raises(HTTPError):
+        fetch(client, server.url('/busy/1'), deadline=http_pool.time.monotonic() + 1)
+    assert server.hits['/busy/1'] == 1 and pauses == []
+
+
+def test_permanent_redirects_memoized(server):
+    client = HTTPClient()
+    for path in ('/moved', '/moved-308', '/found'):
+        assert fetch(client, server.url(path)) == (200, b'body')
+        assert fetch(client, server.url(path)) == (200, b'body')
+    # 301 and 308 are followed once, then requested at the new address directly
+    assert server.hits['/moved'] == server.hits['/moved-308'] == 1
+    assert server.hits['/found'] == 2
+    assert server.hits['/ok'] == 6
+
+
+def test_redirect_limit(server):
+    client = HTTPClient()
+    with pytest.raises(HTTPError) as error:
+        fetch(client, server.url('/loop/0'))
+    assert error.value.status == 302
+    assert sum(n for path, n in server.hits.items() if path.startswith('/loop/')) == http_pool.MAX_REDIRECTS + 1
+
+
+def test_conditional_and_range_pass_through(server):
+    client = HTTPClient()
+    assert fetch(client, server.url('/etag')) == (200, b'body')
+    assert fetch(client, server.url('/etag'), headers={'If-None-Match': '"e1"'}) == (304, b'')
+    assert fetch(client, server.url('/part'), headers={'Range': 'bytes=2-'}) == (206, b'dy')
+    # a 304 nobody asked for is an error
+    with pytest.raises(HTTPError) as error:
+        fetch(client, server.url('/not-modified'))
+    assert error.value.status == 304
+    assert len(set(server.ports)) == 1
@@ -0,0 +1,375 @@
+"""image_downloads.py against a local http.server stand-in for the image hosts."""
+
+import hashlib
+import http.server
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+import download_index
+import image_downloads
+from image_downloads import ImageDownloader
+
+PNG = (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR'
+       + struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0) + b'\0\0\0\0' + b'x' * 200)
+
+
+BIG = 3 * 1024 * 1024
+
+
+class ImageServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.hits = Counter()
+            self.active = 0
+            self.max_active = 0
+            self.etag = '"r1"'
+            # cut off the next full /range/ response after 100 KB
+            self.cut = False
+            # (Range, If-Range, status) of every /range/ request
+            self.ranges = []
+
+    def url(self, path: str, host: str = '127.0.0.1') -> str:
+        return f'http://{host}:{self.server_port}{path}'
+
+
+def range_body(etag: str) -> bytes:
+    """A 320 KB image that differs for every ETag."""
+    return PNG + bytes((i + len(etag) * 7 + sum(etag.encode())) % 256 for i in range(256)) * 1280
+
+
+class ImageHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /slow/... - PNG after 0.2 s; /hang/... - no answer until the test ends;
+    /html/... - an HTML error page; /big/... - a 3 MB PNG, /big-nolength/... - the same
+    without Content-Length; /short/... - a PNG cut off before its Content-Length;
+    /range/... - range_body(server.etag) with Range, If-Range and 416 support; with
+    server.cut set the next full response is cut off after 100 KB;
+    anything else - PNG at once.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if self.path.startswith('/slow/'):
+                time.sleep(0.2)
+            elif self.path.startswith('/hang/'):
+                server.release.wait(10)
+            elif self.path.startswith('/range/'):
+                return self.send_range()
+            elif self.path.startswith('/html/'):
+                return self.send_image(b'<!DOCTYPE html><html><body>Not found</body></html>' * 100, 200,
+                                       {'Content-Type': 'text/html'})
+            elif self.path.startswith('/big'):
+                return self.send_big()
+            elif self.path.startswith('/short/'):
+                return self.send_short()
+            self.send_image(PNG)
+        except OSError:
+            pass
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def send_range(self):
+        etag = self.server.etag
+        body = range_body(etag)
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        requested = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        status = 200
+        if requested and if_range in (None, etag):
+            start = int(requested.split('=', 1)[1].rstrip('-'))
+            if start >= len(body):
+                status = 416
+                headers['Content-Range'] = f'bytes */{len(body)}'
+                body = b''
+            else:
+                status = 206
+                headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+                body = body[start:]
+        with self.server.lock:
+            self.server.ranges.append((requested, if_range, status))
+            cut, self.server.cut = self.server.cut and status == 200, self.server.cut and status != 200
+        if cut:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body[:100 * 1024])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.send_image(body, status, headers)
+
+    def send_big(self):
+        self.send_response(200)
+        if self.path.startswith('/big-nolength/'):
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(len(PNG) + BIG))
+        self.end_headers()
+        self.wfile.write(PNG)
+        for _ in range(BIG // 65536):
+            self.wfile.write(b'\0' * 65536)
+
+    def send_short(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(PNG) + 1000))
+        self.end_headers()
+        self.wfile.write(PNG)
+        self.wfile.flush()
+        self.close_connection = True
+
+    def send_image(self, body: bytes, status: int = 200, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def images(server):
+    server.reset()
+    return server
+
+
+def test_per_host_limit(images, tmp_path):
+    urls = [images.url(f'/slow/{i}.png') for i in range(8)]
+    with ImageDownloader(per_host=2) as downloader:
+        start = time.monotonic()
+        results = downloader.download_all([(url, tmp_path) for url in urls])
+        elapsed = time.monotonic() - start
+    assert all(results.values())
+    assert images.max_active == 2
+    # 8 requests, 2 at a time, 0.2 s each
+    assert elapsed >= 0.75
+
+
+def test_page_deadline(images, tmp_path):
+    urls = [images.url(f'/hang/{i}.png') for i in range(2)] + [images.url(f'/slow/{i}.png') for i in range(6)]
+    with ImageDownloader(per_host=2, deadline=0.5) as downloader:
+        start = time.monotonic()
+        results = downloader.download_all([(url, tmp_path) for url in urls])
+        elapsed = time.monotonic() - start
+        expired = downloader.expired
+    assert elapsed < 1.5
+    assert expired > 0
+    assert not any(results[(url, tmp_path)] for url in urls[:2])
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(filter(None, results.values()))
+
+
+def test_same_url_and_folder_fetched_once(images, tmp_path):
+    url = images.url('/slow/shared.png')
+    first, second = tmp_path / 'first', tmp_path / 'second'
+    with ImageDownloader() as downloader:
+        results = downloader.download_all([(url, first), (url, first), (url, second)])
+        again = downloader.download_all([(url, first)])
+        stats = downloader.requested, downloader.deduplicated
+    assert results[(url, first)] == results[(url, second)] == again[(url, first)] == image_downloads.image_stem(url) + '.png'
+    assert (first / results[(url, first)]).read_bytes() == PNG
+    assert (second / results[(url, second)]).read_bytes() == PNG
+    # one request per folder; the repeat in the same call and the later call reuse the first
+    assert images.hits['/slow/shared.png'] == 2
+    assert stats == (4, 2)
+
+
+def left_files(folder):
+    return sorted(str(p.relative_to(folder)) for p in folder.rglob('*') if p.is_file())
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = download_index.DownloadIndex(tmp_path / 'cache')
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize('path, error', [
+    ('/html/a.jpg', 'не изображение'),
+    # refused from Content-Length, before the body
+    ('/big/a.png', f'больше 2 МБ ({len(PNG) + BIG} байт)'),
+    ('/big-nolength/a.png', 'больше 2 МБ'),
+    ('/short/a.png', 'IncompleteRead'),
+])
+def test_rejected_body_leaves_no_file(images, index, tmp_path, path, error):
+    url = images.url(path)
+    save_dir = tmp_path / 'page_files'
+    assert image_downloads.download_image(url, save_dir, index=index, max_size=2 * 1024 * 1024) is None
+    assert left_files(save_dir) == []
+    # nothing stored, and the reason is remembered
+    assert left_files(index.store.root) == []
+    assert error in index.lookup(url)['error']
+
+
+def test_under_size_cap(images, tmp_path):
+    url = images.url('/big/a.png')
+    filename = image_downloads.download_image(url, tmp_path, max_size=4 * 1024 * 1024)
+    assert filename == image_downloads.image_stem(url) + '.png'
+    assert (tmp_path / filename).stat().st_size == len(PNG) + BIG
+
+
+@pytest.fixture
+def stale_index(tmp_path):
+    """An index whose every entry is due for revalidation."""
+    index = download_index.DownloadIndex(tmp_path / 'cache', fresh_ttl=0)
+    yield index
+    index.close()
+
+
+def cache_stale_copy(index, url: str, tmp_path) -> str:
+    tmp = tmp_path / 'stale.tmp'
+    tmp.write_bytes(PNG)
+    sha256 = hashlib.sha256(PNG).hexdigest()
+    index.store.adopt(tmp, sha256)
+    index.record_success(url, sha256, len(PNG), etag='"old"')
+    return image_downloads.image_stem(url) + '.png'
+
+
+@pytest.mark.parametrize('interruption', ['deadline', 'cancelled'])
+def test_interrupted_revalidation_keeps_no_failure(images, stale_index, tmp_path, interruption):
+    if interruption == 'deadline':
+        # the page deadline left less than the usual timeout for this request
+        url, kwargs = images.url('/hang/stale.png'), {'timeout': 0.3}
+    else:
+        stop = threading.Event()
+        stop.set()
+        url, kwargs = images.url('/stale.png'), {'stop': stop}
+    filename = cache_stale_copy(stale_index, url, tmp_path)
+
+    result = image_downloads.download_image(url, tmp_path / 'page_files', index=stale_index, **kwargs)
+
+    assert result == filename
+    assert (tmp_path / 'page_files' / filename).read_bytes() == PNG
+    assert stale_index.lookup(url)['failed_at'] is None
+
+
+class StopAfter:
+    """A stop event that is set after the download loop has checked it n times."""
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def is_set(self) -> bool:
+        self.n -= 1
+        return self.n < 0
+
+
+CUT = 100 * 1024
+
+
+def leave_part(server, url: str, save_dir, monkeypatch):
+    """Download url with the body cut off and no resuming in the same call; the .part stays."""
+    server.cut = True
+    monkeypatch.setattr(image_downloads, 'RESUMES', 0)
+    assert image_downloads.download_image(url, save_dir) is None
+    monkeypatch.undo()
+    (part,) = save_dir.glob('*.part')
+    assert part.stat().st_size == CUT
+    server.ranges.clear()
+    return part
+
+
+def test_resume_after_cut_off_body(images, tmp_path):
+    images.cut = True
+    url = images.url('/range/a.png')
+    filename = image_downloads.download_image(url, tmp_path)
+    assert (tmp_path / filename).read_bytes() == range_body('"r1"')
+    assert images.ranges == [(None, None, 200), (f'bytes={CUT}-', '"r1"', 206)]
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_resume_on_next_run(images, tmp_path, monkeypatch):
+    url = images.url('/range/a.png')
+    leave_part(images, url, tmp_path, monkeypatch)
+    filename = image_downloads.download_image(url, tmp_path)
+    assert images.ranges == [(f'bytes={CUT}-', '"r1"', 206)]
+    assert (tmp_path / filename).read_bytes() == range_body('"r1"')
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_restart_when_etag_changes(images, tmp_path, monkeypatch):
+    url = images.url('/range/a.png')
+    leave_part(images, url, tmp_path, monkeypatch)
+    images.etag = '"r2"'
+    filename = image_downloads.download_image(url, tmp_path)
+    # If-Range no longer matches: the server sends the new image whole
+    assert images.ranges == [(f'bytes={CUT}-', '"r1"', 200)]
+    assert (tmp_path / filename).read_bytes() == range_body('"r2"')
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_restart_on_416(images, tmp_path, monkeypatch):
+    url = images.url('/range/a.png')
+    part = leave_part(images, url, tmp_path, monkeypatch)
+    # a .part longer than the image, e.g. left by a bigger version with the same ETag
+    with open(part, 'ab') as f:
+        f.write(b'\0' * len(range_body('"r1"')))
+    size = part.stat().st_size
+    filename = image_downloads.download_image(url, tmp_path)
+    assert images.ranges == [(f'bytes={size}-', '"r1"', 416), (None, None, 200)]
+    assert (tmp_path / filename).read_bytes() == range_body('"r1"')
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_cancel_leaves_part(images, tmp_path):
+    url = images.url('/range/a.png')
+    assert image_downloads.download_image(url, tmp_path, stop=StopAfter(2)) is None
+    (part,) = tmp_path.glob('*.part')
+    size = part.stat().st_size
+    assert 0 < size < len(range_body('"r1"'))
+    assert part.with_name(part.name + '.json').exists()
+
+    filename = image_downloads.download_image(url, tmp_path)
+    assert images.ranges[-1] == (f'bytes={size}-', '"r1"', 206)
+    assert (tmp_path / filename).read_bytes() == range_body('"r1"')
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_collect_after_close_returns_at_once(images, tmp_path):
+    urls = [images.url(f'/hang/close-{i}.png') for i in range(4)]
+    downloader = ImageDownloader(per_host=1, deadline=30)
+    # one request hangs in a worker, the other three wait in the host's queue
+    started = downloader.start([(url, tmp_path) for url in urls])
+    time.sleep(0.1)
+    downloader.close()
+    start = time.monotonic()
+    results = downloader.collect(started)
+    assert time.monotonic() - start < 1
+    assert results == {(url, tmp_path): None for url in urls}
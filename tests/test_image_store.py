@@ -0,0 +1,59 @@
+"""image_store: one object per content, placed by hard link or by an atomic copy."""
+
+import os
+
+import image_store
+from image_store import ImageStore
+
+
+def test_identical_bytes_stored_once(tmp_path):
+    store = ImageStore(tmp_path / 'objects')
+    for name in ('a.png', 'b.png'):
+        (tmp_path / name).write_bytes(b'same image')
+    (tmp_path / 'c.png').write_bytes(b'other image')
+    pages = tmp_path / 'page_files'
+    pages.mkdir()
+
+    first = store.link_file(tmp_path / 'a.png', pages / 'a.png')
+    assert store.link_file(tmp_path / 'b.png', pages / 'b.png') == first
+    store.link_file(tmp_path / 'c.png', pages / 'c.png')
+
+    assert sorted(p.name for p in store.root.glob('??/*')) == sorted([first, image_store.file_sha256(tmp_path / 'c.png')])
+    assert store.stored == 2
+    obj = store.path(first)
+    assert (pages / 'a.png').stat().st_ino == (pages / 'b.png').stat().st_ino == obj.stat().st_ino
+    assert (store.linked, store.copied) == (3, 0)
+
+
+def test_copy_when_link_fails(tmp_path, monkeypatch):
+    src = tmp_path / 'object'
+    src.write_bytes(b'new image')
+    dest = tmp_path / 'page_files' / 'img.png'
+    dest.parent.mkdir()
+    dest.write_bytes(b'old image')
+
+    def no_link(src, dst):
+        raise OSError(18, 'Invalid cross-device link')
+
+    replaced = []
+    real_replace = os.replace
+
+    def spy_replace(src, dst):
+        # the copy is complete before it takes dest's name
+        assert os.path.getsize(src) == len(b'new image')
+        assert dest.read_bytes() == b'old image'
+        replaced.append((src, dst))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(image_store.os, 'link', no_link)
+    monkeypatch.setattr(image_store.os, 'replace', spy_replace)
+    store = ImageStore(tmp_path / 'objects')
+    store.place(src, dest)
+
+    ((tmp, target),) = replaced
+    assert target == dest
+    assert tmp.parent == dest.parent and tmp.name.endswith('.tmp')
+    assert dest.read_bytes() == b'new image'
+    assert dest.stat().st_ino != src.stat().st_ino
+    assert sorted(p.name for p in dest.parent.iterdir()) == ['img.png']
+    assert (store.linked, store.copied) == (0, 1)
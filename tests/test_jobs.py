@@ -0,0 +1,15 @@
+"""-j N extracts inputs in worker processes; the page must not depend on it."""
+
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+INPUTS = [ROOT / 'sources' / name for name in (
+    'ГЛУБОКАЯ РЕЛАКСАЦИЯ ТЕЛА И УМА.html', 'ГЛУБОКАЯ РЕЛАКСАЦИЯ ТЕЛА И УМА 2.html',
+    'САМОЛЕЧЕНИЕ ОЩУЩЕНИЯМИ.html', 'САМОЛЕЧЕНИЕ ОЩУЩЕНИЯМИ 2.html', 'АЛЬФА-ИСЦЕЛЕНИЕ.html')]
+
+
+def test_jobs_output_matches_serial(clean_html_cli, tmp_path):
+    serial, parallel = tmp_path / 'serial.html', tmp_path / 'parallel.html'
+    clean_html_cli(*INPUTS, '-o', serial)
+    clean_html_cli(*INPUTS, '-o', parallel, '-j', '3')
+    assert parallel.read_bytes() == serial.read_bytes()
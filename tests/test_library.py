@@ -0,0 +1,47 @@
+"""The in-memory library API of both tools."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import clean_forum_html
+import clean_html
+
+ROOT = Path(__file__).resolve().parent.parent
+SOURCE = sorted((ROOT / 'sources').glob('*.html'))[0]
+FORUM_PAGE = sorted((ROOT / 'practice' / 'pages').glob('*.html'))[0]
+
+
+def test_extract_matches_command_line(tmp_path, clean_html_cli):
+    out = tmp_path / 'out.html'
+    clean_html_cli(SOURCE, '-o', out)
+    doc = clean_html.extract(SOURCE.read_bytes(), str(SOURCE), str(out))
+    assert doc.to_html() == out.read_text(encoding='utf-8')
+    assert doc.title and doc.title in doc.to_html()
+    assert doc.content_html.startswith('<div') and doc.content_html in doc.to_html()
+    assert {'input', 'encoding', 'parser', 'reparses'} <= set(doc.report)
+    assert doc.report['input'] == str(SOURCE)
+
+
+def test_extract_needs_no_file():
+    page = '<html><head><title>Из памяти</title></head><body><div class="post"><div class="post-content">' \
+           '<p>Текст поста, достаточно длинный, чтобы его не приняли за заголовок раздела.</p></div></div></body></html>'
+    doc = clean_html.extract(page.encode('utf-8'), '/nonexistent/page.html')
+    assert doc.title == 'Из памяти'
+    assert 'Текст поста' in doc.content_html
+
+
+def test_forum_bytes(tmp_path):
+    html, info = clean_forum_html.clean_forum_bytes(FORUM_PAGE.read_bytes(), tmp_path / FORUM_PAGE.name,
+                                                    download_images=False)
+    assert info['posts'] > 0 and info['encoding'] and info['title']
+    assert html.startswith('<!DOCTYPE html>') and info['title'] in html
+    # nothing was written
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_forum_import_leaves_sys_path_alone():
+    code = ('import sys; before = list(sys.path); import clean_forum_html; '
+            'assert sys.path == before, sys.path; '
+            'assert not {"html_charset", "html_parsers"} & set(sys.modules), "shared modules imported by name"')
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT / 'practice', check=True)
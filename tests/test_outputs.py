@@ -0,0 +1,74 @@
+"""Markdown and JSON outputs, rendered from the section model."""
+
+import json
+
+import clean_html
+
+SECTIONS = [
+    {'heading': None, 'step': None, 'blocks': [{'type': 'paragraph', 'text': 'Вступление *с* [разметкой]_'}]},
+    {'heading': 'Первый шаг', 'step': '1', 'blocks': [
+        {'type': 'heading', 'level': 3, 'text': 'Подзаголовок'},
+        {'type': 'quote', 'paragraphs': ['Цитата\nв две строки', 'Второй абзац']},
+        {'type': 'list', 'ordered': True, 'items': ['раз', 'два']},
+        {'type': 'list', 'ordered': False, 'items': ['a']},
+        {'type': 'figure', 'src': 'img/a b>.png', 'width': 10, 'height': 5, 'caption': 'Подпись'},
+    ]},
+]
+
+
+def test_markdown():
+    assert clean_html.render_markdown('Заголовок  # 1', SECTIONS) == '''\
+# Заголовок # 1
+
+Вступление \\*с\\* \\[разметкой\\]\\_
+
+## Первый шаг
+
+### Подзаголовок
+
+> Цитата
+> в две строки
+>
+> Второй абзац
+
+1. раз
+2. два
+
+- a
+
+![Подпись](<img/a b%3E.png>)
+
+*Подпись*
+'''
+
+
+def test_markdown_line_starts_escaped():
+    text = '1. не список\n- и не пункт\n# не заголовок\n> не цитата'
+    assert clean_html.md_escape(text) == '1\\. не список\n\\- и не пункт\n\\# не заголовок\n\\> не цитата'
+
+
+def test_json():
+    out = clean_html.render_json('Заголовок', SECTIONS)
+    assert json.loads(out) == {'title': 'Заголовок', 'sections': SECTIONS}
+    assert 'Подзаголовок' in out  # not \\u-escaped
+
+
+def test_formats_from_one_run(tmp_path, clean_html_cli):
+    page = tmp_path / 'page.html'
+    page.write_text('''<html><head><title>Страница</title></head><body><div class="post"><div class="post-content">
+<p>Первый абзац поста, достаточно длинный, с запятыми и точкой в конце.</p>
+<h2>Второй раздел</h2>
+<p>Второй абзац поста, тоже длинный, с запятыми и точкой в конце.</p>
+<ul><li>пункт</li></ul></div></div></body></html>''', encoding='utf-8')
+    out = tmp_path / 'out' / 'page.html'
+    out.parent.mkdir()
+    clean_html_cli(page, '-o', out, '--format', 'html,md,json')
+    doc = clean_html.extract(page.read_bytes(), str(page), str(out))
+    assert out.read_text(encoding='utf-8') == doc.to_html()
+    assert out.with_suffix('.md').read_text(encoding='utf-8') == doc.to_markdown()
+    data = json.loads(out.with_suffix('.json').read_text(encoding='utf-8'))
+    assert data == json.loads(doc.to_json())
+    assert data['title'] == 'Страница'
+    assert [block['type'] for section in data['sections'] for block in section['blocks']] == [
+        'paragraph', 'heading', 'paragraph', 'list']
+    assert '## Второй раздел\n\nВторой абзац' in doc.to_markdown()
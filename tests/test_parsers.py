@@ -0,0 +1,66 @@
+"""Every installed parser backend must produce the same cleaned output on the sample pages."""
+
+from pathlib import Path
+
+import pytest
+
+import clean_forum_html
+import clean_html
+import html_parsers
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PAGES = sorted(ROOT.glob('sources/*.html')) + sorted(ROOT.glob('practice/pages/*.html'))
+BACKENDS = html_parsers.available_backends()
+if 'lxml' in BACKENDS:
+    BACKENDS.insert(0, 'lxml-native')
+
+
+def ids(pages):
+    return [page.name for page in pages]
+
+
+@pytest.fixture(scope='module', params=PAGES, ids=ids(PAGES))
+def page(request):
+    return request.param, request.param.read_bytes()
+
+
+def test_pages_found():
+    assert PAGES
+
+
+def test_clean_html_same_across_backends(page):
+    path, data = page
+    outputs = {parser: clean_html.extract(data, str(path), parser=parser).to_html() for parser in BACKENDS}
+    assert len(set(outputs.values())) == 1, f"outputs differ: {sorted(outputs)}"
+
+
+def test_clean_forum_bytes_same_across_backends(page):
+    path, data = page
+    outputs = {}
+    for parser in BACKENDS:
+        html, info = clean_forum_html.clean_forum_bytes(data, path, parser=parser, download_images=False)
+        assert info['parser'] == html_parsers.builder_name(parser)
+        outputs[parser] = html
+    assert len(set(outputs.values())) == 1, f"outputs differ: {sorted(outputs)}"
+
+
+@pytest.mark.skipif('lxml' not in BACKENDS, reason='lxml not installed')
+@pytest.mark.parametrize('parser', ['auto', 'lxml-native'])
+def test_lxml_failure_falls_back(page, parser, monkeypatch):
+    path, data = page
+    expected = clean_html.extract(data, str(path), parser='html.parser').to_html()
+    real_soup = html_parsers.BeautifulSoup
+
+    def no_lxml(markup, builder, *args, **kwargs):
+        if builder == 'lxml':
+            raise ValueError('lxml failed')
+        return real_soup(markup, builder, *args, **kwargs)
+
+    def no_lxml_document(html_text):
+        raise ValueError('lxml failed')
+
+    monkeypatch.setattr(html_parsers, 'BeautifulSoup', no_lxml)
+    monkeypatch.setattr(clean_html, 'lxml_document', no_lxml_document)
+    assert html_parsers.backend_name(html_parsers.make_soup('<p>x</p>', parser)) != 'lxml'
+    assert clean_html.extract(data, str(path), parser=parser).to_html() == expected
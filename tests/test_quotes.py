@@ -0,0 +1,43 @@
+"""QuoteIndex near-duplicate threshold and --quote-similarity validation."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import clean_html
+
+ROOT = Path(__file__).resolve().parent.parent
+
+QUOTE = ('Когда мы расслабляемся, дыхание становится медленным и глубоким, а мышцы лица '
+         'и плеч отпускают напряжение, которое копилось весь день.')
+ONE_WORD_CHANGED = QUOTE.replace('медленным', 'спокойным')
+OTHER = 'Совсем другая цитата про сон и отдых, без общих слов с первой вовсе.'
+
+
+def check(threshold, *quotes):
+    index = clean_html.QuoteIndex(threshold)
+    return [index.is_duplicate(q) for q in quotes], (index.kept, index.dropped_exact, index.dropped_near)
+
+
+def test_exact_repeats_only_by_default():
+    assert check(1.0, QUOTE, QUOTE, ONE_WORD_CHANGED, QUOTE[:80]) == ([False, True, False, False], (3, 1, 0))
+
+
+def test_near_duplicates_below_threshold():
+    # one changed word in 20 leaves about 0.8 of the shingles in common
+    assert check(0.8, QUOTE, ONE_WORD_CHANGED, OTHER) == ([False, True, False], (2, 0, 1))
+    assert check(0.95, QUOTE, ONE_WORD_CHANGED, OTHER) == ([False, False, False], (3, 0, 0))
+
+
+def test_truncated_requote_dropped():
+    assert check(0.8, QUOTE, QUOTE[:80]) == ([False, True], (1, 0, 1))
+
+
+@pytest.mark.parametrize('value', ['0', '-0.5', '1.5'])
+def test_similarity_out_of_range_rejected(value):
+    result = subprocess.run([sys.executable, str(ROOT / 'scripts' / 'clean_html.py'), 'x.html',
+                             '--quote-similarity', value], capture_output=True, text=True)
+    assert result.returncode == 2
+    assert '--quote-similarity must be greater than 0 and at most 1' in result.stderr
@@ -0,0 +1,58 @@
+"""readability gets a pruned copy of the page; the page itself is left whole."""
+
+import pytest
+from bs4 import BeautifulSoup
+
+import clean_html
+
+PAGE = '''<html><head><title>Статья</title><link rel="stylesheet" href="a.css"></head><body>
+<nav><a href="/">Главная</a> <a href="/about">О нас</a></nav>
+<div class="sidebar-menu"><a href="/1">Раздел 1</a></div>
+<div style="display: none">скрытый текст</div>
+<aside class="related"><p>Связанная статья с абзацем текста.</p></aside>
+<article><p>Первый абзац статьи, достаточно длинный, с запятыми, точками и прочим.</p>
+<p>Второй абзац статьи<span hidden>скрыто</span>, тоже длинный, с запятыми и точками.</p></article>
+</body></html>'''
+
+
+def test_markup_pruned_soup_untouched():
+    soup = BeautifulSoup(PAGE, 'html.parser')
+    before = str(soup)
+    markup = clean_html.readability_markup(soup)
+    assert str(soup) == before
+    for gone in ('<nav>', 'sidebar-menu', 'скрытый текст', 'скрыто', 'a.css'):
+        assert gone not in markup
+    # boilerplate holding scored tags stays, as does the article around the pruned span
+    for kept in ('Связанная статья', 'Второй абзац статьи, тоже длинный'):
+        assert kept in markup
+
+
+def test_fallback_scores_whole_page(monkeypatch):
+    readability = pytest.importorskip('readability')
+    seen = []
+
+    class FailingDocument:
+        def __init__(self, html):
+            seen.append(html)
+            raise ValueError('readability failed')
+
+    monkeypatch.setattr(readability, 'Document', FailingDocument)
+    soup = BeautifulSoup(PAGE, 'html.parser')
+    before = str(soup)
+    best, title = clean_html.pick_main_content(soup, 'html.parser')
+    assert '<nav>' not in seen[0]
+    assert str(soup) == before
+    assert best.name == 'article' and title == 'Статья'
+
+
+def test_summary_memoized(tmp_path):
+    pytest.importorskip('readability')
+    memo = clean_html.FragmentCache(str(tmp_path))
+    results = []
+    runs, hits = clean_html.readability_runs, clean_html.readability_memo_hits
+    for _ in range(2):
+        best, title = clean_html.pick_main_content(BeautifulSoup(PAGE, 'html.parser'), 'html.parser', memo)
+        results.append((str(best), title))
+    assert (clean_html.readability_runs - runs, clean_html.readability_memo_hits - hits) == (1, 1)
+    assert results[0] == results[1]
+    assert 'Первый абзац статьи' in results[0][0]
@@ -0,0 +1,56 @@
+"""--responsive-images: copies, srcset and the up-to-date check."""
+
+import re
+
+import pytest
+from bs4 import BeautifulSoup
+
+PARAGRAPH = ('Длинный абзац поста, в котором достаточно слов, запятых и точек, '
+             'чтобы он остался основным содержимым страницы.')
+PAGE = f'''<html><head><meta charset="utf-8"><title>Тема</title></head><body>
+<div class="post"><div class="post-content"><p>{PARAGRAPH}</p>
+<figure><img src="page_files/photo.png"><figcaption>Фото</figcaption></figure><p>{PARAGRAPH}</p></div></div>
+</body></html>'''
+
+
+@pytest.fixture
+def page(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    src = tmp_path / 'src'
+    (src / 'page_files').mkdir(parents=True)
+    (src / 'page.html').write_text(PAGE, encoding='utf-8')
+    Image.new('RGB', (1000, 500), (200, 100, 50)).save(src / 'page_files' / 'photo.png')
+    return src / 'page.html'
+
+
+def test_srcset_rewrite(page, tmp_path, clean_html_cli):
+    out = tmp_path / 'out' / 'page.html'
+    out.parent.mkdir()
+    clean_html_cli(page, '-o', out, '--responsive-images', '--image-widths', '320,640,1280')
+
+    (img,) = BeautifulSoup(out.read_text(encoding='utf-8'), 'html.parser').find_all('img')
+    assert (img['width'], img['height'], img['loading'], img['decoding']) == ('1000', '500', 'lazy', 'async')
+    name = re.fullmatch(r'page_images/([0-9a-f]{16})\.png', img['src']).group(1)
+    # widths up to the image's own, then the full-size copy
+    assert img['srcset'] == (f'page_images/{name}-320.png 320w, page_images/{name}-640.png 640w, '
+                             f'page_images/{name}.png 1000w')
+    assert img['sizes']
+    assert sorted(p.name for p in (out.parent / 'page_images').iterdir()) == [
+        f'{name}-320.png', f'{name}-640.png', f'{name}.png']
+
+
+def test_deleted_images_dir_rebuilds(page, tmp_path, clean_html_cli):
+    out = tmp_path / 'out' / 'page.html'
+    out.parent.mkdir()
+    args = (page, '-o', out, '--responsive-images')
+    clean_html_cli(*args)
+    assert 'is up to date' in clean_html_cli(*args)
+
+    images = out.parent / 'page_images'
+    listing = sorted(p.name for p in images.iterdir())
+    for path in images.iterdir():
+        path.unlink()
+    images.rmdir()
+    assert 'Images: 1 rewritten' in clean_html_cli(*args)
+    assert sorted(p.name for p in images.iterdir()) == listing
+    assert 'is up to date' in clean_html_cli(*args)
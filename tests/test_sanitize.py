@@ -0,0 +1,46 @@
+"""sanitize_fragment(): cleanup and sectioning in one pass."""
+
+from bs4 import BeautifulSoup, Comment
+
+import clean_html
+
+LONG = ('Это достаточно длинный абзац текста, который не должен стать заголовком, '
+        'потому что в нём много слов и есть точка в конце.')
+FRAGMENT = f'''<div>
+<script>track()</script><!-- comment -->
+<p class="lead" style="color:red" onclick="x()">{LONG} <b>жирный</b></p>
+<style>p {{ color: blue }}</style><noscript>включите JS</noscript>
+<h2 id="first"><span class="step-number">1</span> Первая часть</h2>
+<p>{LONG}</p>
+<form><input name="q"><button>Искать</button></form>
+<h2>Вторая часть</h2>
+<p>{LONG}<iframe src="https://example.com/ad"></iframe></p>
+</div>'''
+
+
+def sanitized():
+    return clean_html.sanitize_fragment(BeautifulSoup(FRAGMENT, 'html.parser'))
+
+
+def test_unwanted_content_removed():
+    out = sanitized()
+    for name in ('script', 'style', 'noscript', 'form', 'input', 'button', 'iframe'):
+        assert out.find(name) is None, name
+    assert not out.find_all(string=lambda s: isinstance(s, Comment))
+    assert 'track()' not in str(out) and 'включите JS' not in str(out)
+
+
+def test_attributes_and_classes_dropped():
+    out = sanitized()
+    for tag in out.find_all(True):
+        if tag.name == 'div':
+            continue
+        assert set(tag.attrs) <= {'class'}, tag
+    assert [tag['class'] for tag in out.find_all(class_=True) if tag.name != 'div'] == [['step-number']]
+
+
+def test_grouped_into_sections():
+    out = sanitized()
+    sections = out.find_all('div', class_='section')
+    assert [s.h2.get_text(' ', strip=True) if s.h2 else None for s in sections] == [None, '1 Первая часть', 'Вторая часть']
+    assert all(s.p.get_text().startswith(LONG) for s in sections)
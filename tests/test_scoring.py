@@ -0,0 +1,29 @@
+"""score_main_content(): the linear-time stand-in for readability's scoring."""
+
+from bs4 import BeautifulSoup
+
+import clean_html
+
+PARAGRAPH = 'Абзац статьи, в котором есть запятые, точки и достаточно текста, чтобы набрать очки. ' * 3
+
+
+def test_picks_article_over_link_lists():
+    soup = BeautifulSoup(f'''<html><body>
+    <div id="menu">{'<p><a href="/x">Очень длинная ссылка меню, с запятыми, как абзац</a></p>' * 8}</div>
+    <div id="article">{f'<p>{PARAGRAPH}</p>' * 4}</div>
+    <div id="footer"><p>Короткий подвал.</p></div>
+    </body></html>''', 'html.parser')
+    assert clean_html.score_main_content(soup)['id'] == 'article'
+
+
+def test_text_divs_count_as_paragraphs():
+    soup = BeautifulSoup(f'''<html><body>
+    <div id="comments"><p>Коротко.</p><p>Тоже.</p></div>
+    <div id="post"><div>{PARAGRAPH}</div><div>{PARAGRAPH}</div></div>
+    </body></html>''', 'html.parser')
+    assert clean_html.score_main_content(soup)['id'] == 'post'
+
+
+def test_nothing_to_score_falls_back_to_body():
+    soup = BeautifulSoup('<html><body><span>x</span></body></html>', 'html.parser')
+    assert clean_html.score_main_content(soup) is soup.body
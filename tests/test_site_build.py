@@ -0,0 +1,16 @@
+"""group_source_pages(): saved pages grouped by topic, in page order."""
+
+import clean_html
+
+
+def test_grouping(tmp_path):
+    for name in ('Тема.html', 'Тема 2.html', 'Тема 10.html', 'Тема3.html', '2020.html', '2020 2.html',
+                 'Другое.html', 'Тема_merged.html', 'notes.txt'):
+        (tmp_path / name).write_text('')
+    groups = clean_html.group_source_pages(str(tmp_path))
+    assert {name: [path.rsplit('/', 1)[1] for path in paths] for name, paths in groups.items()} == {
+        # an all-digit name is one page, not "2" page 020
+        '2020': ['2020.html', '2020 2.html'],
+        'Другое': ['Другое.html'],
+        'Тема': ['Тема.html', 'Тема 2.html', 'Тема3.html', 'Тема 10.html'],
+    }
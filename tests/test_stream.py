@@ -0,0 +1,18 @@
+"""--stream writes each input as it is extracted; the page must be the same as the aggregated one."""
+
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+INPUTS = [ROOT / 'sources' / name for name in (
+    'РАЗВИТИЕ БАЗОВОГО УРОВНЯ ЭКСТРАСЕНСА.html', 'РАЗВИТИЕ БАЗОВОГО УРОВНЯ ЭКСТРАСЕНСА 2.html',
+    'ГЛУБОКАЯ РЕЛАКСАЦИЯ ТЕЛА И УМА.html', 'АЛЬФА-ИСЦЕЛЕНИЕ.html')]
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_stream_output_matches_normal(clean_html_cli, tmp_path, jobs):
+    normal, streamed = tmp_path / 'normal.html', tmp_path / 'streamed.html'
+    clean_html_cli(*INPUTS, '-o', normal)
+    clean_html_cli(*INPUTS, '-o', streamed, '--stream', '-j', jobs)
+    assert streamed.read_bytes() == normal.read_bytes()
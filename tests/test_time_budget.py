@@ -0,0 +1,53 @@
+"""--time-budget: an input that runs over it falls back to extract_cheaply()."""
+
+import sys
+import time
+
+import pytest
+
+import clean_html
+
+PARAGRAPH = 'Абзац статьи, в котором есть запятые, точки и достаточно текста, чтобы набрать очки. ' * 3
+PAGE = f'''<html><head><title>Статья</title></head><body>
+<div id="menu"><a href="/">Главная</a> <a href="/about">О нас</a></div>
+<div id="article">{f'<p>{PARAGRAPH}</p>' * 4}</div>
+</body></html>'''
+
+
+@pytest.fixture
+def page(tmp_path):
+    path = tmp_path / 'page.html'
+    path.write_text(PAGE, encoding='utf-8')
+    return str(path)
+
+
+def test_slow_input_falls_back(page, tmp_path, monkeypatch):
+    out = str(tmp_path / 'out.html')
+    # what the cheap path makes of the page: the heuristic scorer, readability unavailable
+    with monkeypatch.context() as m:
+        m.setitem(sys.modules, 'readability', None)
+        cheap, cheap_title, _ = clean_html.extract_fragment(page, out, parser='html.parser')
+    pick_main_content = clean_html.pick_main_content
+
+    def slow_pick(soup, *args, use_readability=True, **kwargs):
+        if use_readability:
+            time.sleep(5)
+        return pick_main_content(soup, *args, use_readability=use_readability, **kwargs)
+
+    monkeypatch.setattr(clean_html, 'pick_main_content', slow_pick)
+    start = time.monotonic()
+    content, title, report = clean_html.extract_fragment(page, out, parser='html.parser', budget=0.2)
+    assert time.monotonic() - start < 2
+    assert report['fallback'] == {'stage': 'pick_main_content', 'budget': 0.2}
+    assert (str(content), title) == (str(cheap), cheap_title)
+
+
+def test_within_budget(page, tmp_path):
+    content, title, report = clean_html.extract_fragment(page, str(tmp_path / 'out.html'), budget=30)
+    assert 'fallback' not in report
+    assert title == 'Статья'
+
+
+def test_cheap_extraction_picks_article():
+    node, title, backend = clean_html.extract_cheaply(PAGE)
+    assert node['id'] == 'article' and title == 'Статья'